@@ -0,0 +1,113 @@
+"""
+Raw versus logged events for bursty file activity.
+
+Usage: python benchmarks/bench_coalescing.py [files]
+Feeds synthetic bursts (large copies written in chunks, editor saves through
+temporary files, build scratch files, rename chains) through the coalescing
+stage and reports raw and emitted event counts, then copies real files into a
+watched temporary folder to show the same for watchdog's own events.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import synthetic  # noqa: F401  (puts the repository on sys.path)
+
+from coalescer import Coalescer
+from file_events import Action, EventLog
+from log_watcher import MonitorThread
+
+CHUNK = 1024 * 1024
+
+
+def large_copy(files, root, clock):
+    """ Each file created empty and then modified once per 1 MB written. """
+    for i in range(files):
+        path = os.path.join(root, 'video', f'clip_{i}.mp4')
+        size = (i % 50 + 10) * CHUNK
+        yield Action.CREATED, path, 0, None, next(clock)
+        for written in range(CHUNK, size + 1, CHUNK):
+            yield Action.MODIFIED, path, written, None, next(clock)
+
+
+def editor_saves(files, root, clock):
+    """ Save through a temporary file: write ~tmp, delete the original, rename ~tmp over it. """
+    for i in range(files):
+        path = os.path.join(root, 'docs', f'report_{i % 20}.docx')
+        temporary = os.path.join(root, 'docs', f'~wrl{i}.tmp')
+        yield Action.CREATED, temporary, 0, None, next(clock)
+        yield Action.MODIFIED, temporary, 4096, None, next(clock)
+        yield Action.MODIFIED, temporary, 8192, None, next(clock)
+        yield Action.DELETED, path, None, None, next(clock)
+        yield Action.MOVED, temporary, None, path, next(clock)
+
+
+def scratch_files(files, root, clock):
+    """ Build output written and removed again. """
+    for i in range(files):
+        path = os.path.join(root, 'build', f'obj_{i}.o')
+        yield Action.CREATED, path, 0, None, next(clock)
+        yield Action.MODIFIED, path, 2048, None, next(clock)
+        yield Action.DELETED, path, None, None, next(clock)
+
+
+def rename_chains(files, root, clock):
+    """ Files renamed a few times, one of them back to its own name. """
+    for i in range(files):
+        names = [os.path.join(root, 'photos', f'IMG_{i}{suffix}.jpg') for suffix in ('', '_a', '_b', '')]
+        for source, destination in zip(names, names[1:]):
+            yield Action.MOVED, source, None, destination, next(clock)
+        yield Action.MOVED, names[-1], None, os.path.join(root, 'photos', f'holiday_{i}.jpg'), next(clock)
+
+
+def ticks(step=0.0005):
+    now = 0.0
+    while True:
+        now += step
+        yield now
+
+
+def synthetic_bursts(files):
+    print("synthetic bursts")
+    for generator in (large_copy, editor_saves, scratch_files, rename_chains):
+        log = EventLog()
+        coalescer = Coalescer(lambda *event: log.record(*event))
+        start = time.perf_counter()
+        for action, path, size, destination, timestamp in generator(files, 'E:', ticks()):
+            coalescer.add(action, path, size, destination, timestamp=timestamp)
+        coalescer.flush(force=True)
+        seconds = time.perf_counter() - start
+        print(f"  {generator.__name__:14} raw {coalescer.raw:8}  emitted {coalescer.emitted:7}  "
+              f"reduction {coalescer.reduction:6.1%}  {seconds * 1e6 / coalescer.raw:.2f} us/event")
+
+
+def watched_copy(files):
+    source = tempfile.mkdtemp()
+    drive = tempfile.mkdtemp()
+    for i in range(files):
+        with open(os.path.join(source, f'file_{i}.bin'), 'wb') as f:
+            f.write(os.urandom(4 * CHUNK))
+    monitor = MonitorThread(drive)
+    monitor.start()
+    time.sleep(0.5)
+    for i in range(files):
+        shutil.copyfile(os.path.join(source, f'file_{i}.bin'), os.path.join(drive, f'file_{i}.bin'))
+    time.sleep(1)
+    events = monitor.stop()
+    coalescer = monitor.event_handler.coalescer
+    print(f"watched copy of {files} files: raw {coalescer.raw}  logged {len(events)}  "
+          f"reduction {coalescer.reduction:.1%}")
+    shutil.rmtree(source)
+    shutil.rmtree(drive)
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000
+    synthetic_bursts(files)
+    watched_copy(min(files, 50))
+
+
+if __name__ == '__main__':
+    main()
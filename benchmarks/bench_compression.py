@@ -0,0 +1,85 @@
+"""
+Storage saved and read/write cost of the compressed detection columns.
+
+Usage: python benchmarks/bench_compression.py [detections] [entries]
+Writes ``detections`` rows whose tree, manifest and logs come from a synthetic
+drive of ``entries`` files, once into plain TEXT/BLOB columns and once through
+the compressed column types, and compares file size and timings.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from synthetic import build_tree, temporary_drive
+
+from sqlmodel import SQLModel, Session, create_engine, select
+
+from database import models
+from manifest import scan_drive
+
+
+def synthetic_logs(manifest, lines):
+    paths = manifest.paths()
+    actions = ("Created", "Modified", "Deleted")
+    logs = []
+    for i in range(lines):
+        path = paths[1 + i % (len(paths) - 1)]
+        logs.append(f"[2024-06-10 14:{i // 60 % 60:02d}:{i % 60:02d}] {actions[i % 3]}: E:/{path}, Size: {i % 900} KB")
+        logs.append(f"Total transferred: {i * 3} MB")
+    return "\n".join(logs)
+
+
+def main():
+    detections = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    entries = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    with temporary_drive() as root, tempfile.TemporaryDirectory() as folder:
+        build_tree(root, entries)
+        manifest = scan_drive(root)
+        tree, blob, logs = manifest.tree_text(), manifest.to_bytes(), synthetic_logs(manifest, 5000)
+
+        plain_path = os.path.join(folder, "plain.sqlite")
+        con = sqlite3.connect(plain_path)
+        con.execute("CREATE TABLE detected_devices (id INTEGER PRIMARY KEY, tree TEXT, logs TEXT, manifest BLOB)")
+        start = time.perf_counter()
+        with con:
+            con.executemany("INSERT INTO detected_devices (tree, logs, manifest) VALUES (?, ?, ?)",
+                            [(tree, logs, blob)] * detections)
+        plain_write = time.perf_counter() - start
+        start = time.perf_counter()
+        for row in con.execute("SELECT tree, logs, manifest FROM detected_devices"):
+            pass
+        plain_read = time.perf_counter() - start
+        con.close()
+
+        compressed_path = os.path.join(folder, "compressed.sqlite")
+        engine = create_engine(f"sqlite:///{compressed_path}")
+        SQLModel.metadata.create_all(engine)
+        start = time.perf_counter()
+        with Session(engine) as db:
+            for _ in range(detections):
+                db.add(models.DetectedDevice(serial_number="X", device={}, tree=tree, logs=logs, manifest=blob,
+                                             insertion_time=datetime.now()))
+            db.commit()
+        compressed_write = time.perf_counter() - start
+        start = time.perf_counter()
+        with Session(engine) as db:
+            for row in db.exec(select(models.DetectedDevice)):
+                assert row.manifest == blob and row.logs == logs
+        compressed_read = time.perf_counter() - start
+
+        codec = "zstd" if models.zstandard is not None else "zlib"
+        plain_size = os.path.getsize(plain_path)
+        compressed_size = os.path.getsize(compressed_path)
+        print(f"{detections} detections, {entries} entries each, codec {codec}")
+        print(f"per detection: tree {len(tree.encode()) / 1024:.0f} KB, manifest {len(blob) / 1024:.0f} KB, "
+              f"logs {len(logs.encode()) / 1024:.0f} KB")
+        print(f"plain      {plain_size / 1024 ** 2:8.1f} MB  write {plain_write:6.2f}s  read {plain_read:6.2f}s")
+        print(f"compressed {compressed_size / 1024 ** 2:8.1f} MB  write {compressed_write:6.2f}s  "
+              f"read {compressed_read:6.2f}s  ({100 * (1 - compressed_size / plain_size):.0f}% smaller)")
+
+
+if __name__ == '__main__':
+    main()
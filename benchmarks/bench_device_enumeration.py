@@ -0,0 +1,107 @@
+"""
+What listing the drives costs with each device backend.
+
+Usage: python benchmarks/bench_device_enumeration.py [repeats]
+Times connected_devices(), existing_disks() and the hot-plug state check of
+SysfsBackend on this machine's /sys and /proc, and on synthetic sysfs trees
+(with mountinfo and udev files) of 1 to 100 USB sticks, each with a
+partition mounted; then FakeBackend with as many drives, and WmiBackend
+when run on Windows. ``repeats`` calls are timed per figure.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import synthetic  # noqa: F401  (puts the repository on sys.path)
+
+from device_backends import FakeBackend, SysfsBackend, WmiBackend, device_info, disk_info
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text + '\n')
+
+
+def build_sysfs(base, sticks):
+    """ /sys, mountinfo and udev data of ``sticks`` USB sticks, half of them known to udev. """
+    sys_root = os.path.join(base, 'sys')
+    udev = os.path.join(base, 'udev')
+    os.makedirs(os.path.join(sys_root, 'block'))
+    os.makedirs(udev)
+    lines = ['23 28 0:22 / /proc rw,relatime - proc proc rw']
+    for i in range(sticks):
+        name = 'sd' + chr(ord('b') + i % 24) + ('' if i < 24 else str(i))
+        usb = os.path.join(sys_root, 'devices', 'pci0000:00', '0000:00:14.0', 'usb1', f'1-{i + 1}')
+        write(os.path.join(usb, 'idVendor'), '0781')
+        write(os.path.join(usb, 'serial'), f'4C53000{i:06d}')
+        write(os.path.join(usb, 'manufacturer'), 'SanDisk')
+        write(os.path.join(usb, 'product'), 'Cruzer Blade')
+        device = os.path.join(usb, f'1-{i + 1}:1.0', f'host{i}', f'target{i}:0:0', f'{i}:0:0:0')
+        write(os.path.join(device, 'vendor'), 'SanDisk')
+        write(os.path.join(device, 'model'), 'Cruzer Blade')
+        write(os.path.join(device, 'rev'), '1.00')
+        folder = os.path.join(device, 'block', name)
+        write(os.path.join(folder, 'dev'), f'8:{i * 16}')
+        write(os.path.join(folder, 'removable'), '1')
+        write(os.path.join(folder, 'ro'), '0')
+        write(os.path.join(folder, f'{name}1', 'partition'), '1')
+        write(os.path.join(folder, f'{name}1', 'dev'), f'8:{i * 16 + 1}')
+        os.symlink(os.path.relpath(device, os.path.join(sys_root, 'block')) + f'/block/{name}',
+                   os.path.join(sys_root, 'block', name))
+        os.symlink(os.path.relpath(device, folder), os.path.join(folder, 'device'))
+        mount = os.path.join(base, 'media', f'STICK {i}')
+        os.makedirs(mount)
+        lines.append(f'{100 + i} 28 8:{i * 16 + 1} / {mount.replace(" ", chr(92) + "040")} rw,nosuid - vfat '
+                     f'/dev/{name}1 rw')
+        if i % 2 == 0:
+            write(os.path.join(udev, f'b8:{i * 16}'), f'E:ID_SERIAL_SHORT=4C53000{i:06d}\nE:ID_BUS=usb')
+            write(os.path.join(udev, f'b8:{i * 16 + 1}'), f'E:ID_FS_LABEL=STICK_{i}')
+    write(os.path.join(base, 'mountinfo'), '\n'.join(lines))
+    return SysfsBackend(sys_root, os.path.join(base, 'mountinfo'), udev, os.path.join(base, 'dev'))
+
+
+def timed(backend, repeats):
+    figures = []
+    for call in (backend.connected_devices, backend.existing_disks, getattr(backend, 'state', None)):
+        if call is None:
+            figures.append('')
+            continue
+        start = time.perf_counter()
+        for _ in range(repeats):
+            call()
+        figures.append(f"{(time.perf_counter() - start) / repeats * 1e3:8.3f} ms")
+    devices, disks = backend.connected_devices(), backend.existing_disks()
+    return figures, len(devices), len(disks)
+
+
+def report(name, backend, repeats):
+    (devices, disks, state), found, mounted = timed(backend, repeats)
+    print(f"  {name:26} {found:4} drives {mounted:4} volumes   devices {devices}  disks {disks}  state {state}")
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print("per call:")
+    if os.path.isdir('/sys/block'):
+        report('sysfs, this machine', SysfsBackend(), repeats)
+    for sticks in (1, 10, 100):
+        base = tempfile.mkdtemp()
+        try:
+            report(f'sysfs, {sticks} sticks', build_sysfs(base, sticks), repeats)
+        finally:
+            shutil.rmtree(base)
+    for sticks in (1, 10, 100):
+        fake = FakeBackend({f'SN{i}': device_info(f'SN{i}', 'SanDisk Cruzer Blade', 'USB') for i in range(sticks)},
+                           {f'E{i}:': disk_info(f'STICK_{i}', 10 ** 9, 4 * 10 ** 9) for i in range(sticks)})
+        report(f'fake, {sticks} sticks', fake, repeats)
+    if sys.platform == 'win32':
+        report('wmi, this machine', WmiBackend(), repeats)
+    else:
+        print("  wmi: Windows only")
+
+
+if __name__ == '__main__':
+    main()
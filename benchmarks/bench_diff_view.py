@@ -0,0 +1,88 @@
+"""
+Load and scroll cost of the comparison window's diff view.
+
+Usage: python benchmarks/bench_diff_view.py [lines] [text edit lines]
+Runs Qt offscreen. Fills the model/view diff pane with ``lines`` changes,
+paints it, jumps to the end and walks a few hunks. The old QTextEdit filling
+(one QTextCharFormat insert per line) is timed on a smaller diff for
+comparison.
+"""
+import os
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import synthetic  # noqa: F401  (puts the repository on sys.path)
+
+from PyQt5.QtWidgets import QApplication, QTextEdit, QAbstractItemView
+from PyQt5.QtGui import QColor, QTextCharFormat, QTextCursor
+
+from snapshot_diff import ADDED, REMOVED, RESIZED, TOUCHED, RENAMED, Change, describe
+from tree_compair import COLORS, DiffLineModel, line_view
+
+KINDS = (ADDED, ADDED, REMOVED, RESIZED, TOUCHED, RENAMED)
+
+
+def changes(count):
+    return [Change(KINDS[i // 7 % len(KINDS)], f"dir_{i // 1000:04d}/file_{i:07d}.dat", f"old/file_{i:07d}.dat",
+                   i, i // 2) for i in range(count)]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    small = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    app = QApplication(sys.argv)
+
+    lines = changes(count)
+    model = DiffLineModel()
+    view = line_view(model, "#ffffff")
+    view.resize(800, 600)
+    view.show()
+    app.processEvents()
+
+    start = time.perf_counter()
+    model.set_lines(lines)
+    app.processEvents()
+    view.grab()
+    load = time.perf_counter() - start
+
+    start = time.perf_counter()
+    view.scrollToBottom()
+    app.processEvents()
+    view.grab()
+    bottom = time.perf_counter() - start
+
+    start = time.perf_counter()
+    row, hops = 0, 0
+    for _ in range(100):
+        row = model.next_hunk(row)
+        if row is None:
+            break
+        view.scrollTo(model.index(row), QAbstractItemView.PositionAtTop)
+        hops += 1
+    app.processEvents()
+    view.grab()
+    hunks = time.perf_counter() - start
+    print(f"model/view, {count} lines: load+paint {load * 1000:.1f} ms, jump to end {bottom * 1000:.1f} ms, "
+          f"{hops} hunk jumps {hunks * 1000:.1f} ms")
+
+    edit = QTextEdit()
+    edit.setReadOnly(True)
+    edit.show()
+    start = time.perf_counter()
+    cursor = edit.textCursor()
+    for change in lines[:small]:
+        text_format = QTextCharFormat()
+        text_format.setForeground(QColor(COLORS[change.kind]))
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(describe(change) + '\n', text_format)
+    app.processEvents()
+    edit.grab()
+    seconds = time.perf_counter() - start
+    print(f"QTextEdit, {small} lines: {seconds * 1000:.0f} ms "
+          f"(~{seconds * count / small:.0f} s projected for {count} lines)")
+
+
+if __name__ == '__main__':
+    main()
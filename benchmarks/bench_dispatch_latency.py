@@ -0,0 +1,80 @@
+"""
+Watchdog dispatch latency with inline and queued size lookups.
+
+Usage: python benchmarks/bench_dispatch_latency.py [events] [stat latency ms]
+Writes ``events`` files into a temporary folder and dispatches create and
+modify events for them to USBEventHandler the way watchdog's observer thread
+does, once with sizes looked up inline in the callback (what the handler used
+to do) and once through the stat worker. Every stat call is slowed down by
+the given latency to stand in for a slow flash drive. Some of the files are
+deleted before their events arrive, like short-lived temporary files.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import synthetic  # noqa: F401  (puts the repository on sys.path)
+
+from watchdog.events import FileCreatedEvent, FileModifiedEvent
+
+from log_watcher import USBEventHandler
+from stat_worker import StatWorker
+
+
+class SlowStatWorker(StatWorker):
+    latency = 0.002
+
+    def folder_sizes(self, folder, names):
+        time.sleep(self.latency * (1 if len(names) >= 8 else len(names)))
+        return super().folder_sizes(folder, names)
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def run(root, paths, workers, latency):
+    handler = USBEventHandler(stat_workers=workers)
+    handler.stats.close()
+    handler.stats = SlowStatWorker(handler.coalescer.add, workers)
+    handler.stats.latency = latency
+    timings = []
+    start = time.perf_counter()
+    for path in paths:
+        for event in (FileCreatedEvent(path), FileModifiedEvent(path)):
+            before = time.perf_counter()
+            handler.dispatch(event)
+            timings.append(time.perf_counter() - before)
+    dispatched = time.perf_counter() - start
+    handler.close()
+    total = time.perf_counter() - start
+    timings.sort()
+    print(f"  {'inline' if workers == 0 else f'{workers} stat workers':16} "
+          f"p50 {percentile(timings, 0.5) * 1e6:8.1f} us  p99 {percentile(timings, 0.99) * 1e6:8.1f} us  "
+          f"max {timings[-1] * 1e3:6.1f} ms  dispatched in {dispatched:5.2f}s  logged in {total:5.2f}s  "
+          f"({len(handler.events)} events, {handler.stats.vanished} vanished)")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.002
+    root = tempfile.mkdtemp()
+    paths = []
+    for i in range(count):
+        folder = os.path.join(root, f'folder_{i % 40}')
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f'file_{i}.bin')
+        if i % 10:
+            with open(path, 'wb') as f:
+                f.write(b'x' * i)
+        paths.append(path)  # every tenth file is already gone
+    print(f"{count * 2} events, {latency * 1000:.1f} ms per stat call")
+    for workers in (0, 1, 4, 8):
+        run(root, paths, workers, latency)
+    shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
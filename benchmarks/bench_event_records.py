@@ -0,0 +1,96 @@
+"""
+Cost of recording, storing and loading watcher events.
+
+Usage: python benchmarks/bench_event_records.py [events]
+Compares the old per-event log formatting (strftime, message string and a
+"Total transferred" line) with appending typed EventLog records, including
+memory held, then bulk-inserts the records into a fresh database's
+file_events table and reads them back.
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import synthetic  # noqa: F401  (puts the repository on sys.path)
+
+from file_events import Action, EventLog, format_size
+
+
+def session(events):
+    """ (action, path, size) of a copy session over a few hundred folders. """
+    actions = (Action.CREATED, Action.MODIFIED, Action.MODIFIED, Action.DELETED)
+    for i in range(events):
+        action = actions[i % len(actions)]
+        size = None if action == Action.DELETED else 1000 + i
+        yield action, f"E:\\projects\\folder_{i % 300}\\file_{i % 5000}.bin", size
+
+
+def old_log(events):
+    logs = []
+    total = 0
+    labels = {Action.CREATED: "Created", Action.MODIFIED: "Modified", Action.DELETED: "Deleted"}
+    for action, path, size in events:
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if size is not None:
+            total += size
+            logs.append(f"[{timestamp}] {labels[action]}: {path}, Size: {format_size(size)}")
+            logs.append(f"Total transferred: {format_size(total)}")
+        else:
+            logs.append(f"[{timestamp}] {labels[action]}: {path}")
+    return logs
+
+
+def new_log(events):
+    log = EventLog()
+    for action, path, size in events:
+        log.record(action, path, size)
+    return log
+
+
+def measure(function, events):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(events)
+    seconds = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, seconds, memory
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    events = list(session(count))
+
+    _, old_seconds, old_memory = measure(old_log, events)
+    log, new_seconds, new_memory = measure(new_log, events)
+    print(f"{count} events")
+    print(f"  formatted strings: {old_seconds * 1e6 / count:.2f} us/event, {old_memory / 1024 ** 2:.1f} MB")
+    print(f"  EventLog records:  {new_seconds * 1e6 / count:.2f} us/event, {new_memory / 1024 ** 2:.1f} MB")
+
+    with tempfile.TemporaryDirectory() as folder:
+        # crud works on ./database.sqlite
+        os.chdir(folder)
+        from database import crud
+        from database.db import create_db_and_tables, get_db
+        create_db_and_tables()
+        db = get_db()
+        start = time.perf_counter()
+        crud.save_file_events(db, 1, log)
+        db.commit()
+        insert = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded = crud.get_file_events(1, db)
+        load = time.perf_counter() - start
+        start = time.perf_counter()
+        text = loaded.text()
+        render = time.perf_counter() - start
+        db.close()
+    print(f"  executemany insert {insert:.2f}s, load {load:.2f}s ({len(loaded)} events), "
+          f"render to text {render:.2f}s ({len(text) / 1024 ** 2:.1f} MB)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Memory held by a long drive session, with and without spilling to disk.
+
+Usage: python benchmarks/bench_event_spill.py [events]
+Records ``events`` file events (distinct paths, as a build running off a
+stick produces) into an EventLog and into a SpooledEventLog, printing the
+memory traced at a few checkpoints, then streams the spooled session into
+the file_events table of a fresh database and reports the peak memory while
+doing so.
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import synthetic  # noqa: F401  (puts the repository on sys.path)
+
+from file_events import Action, EventLog, SpooledEventLog
+
+
+def fill(log, events, checkpoints):
+    memory = []
+    for i in range(events):
+        log.record(Action.MODIFIED if i % 4 else Action.CREATED,
+                   f"E:\\build\\obj_{i % 997}\\unit_{i}.o", 4096 + i, timestamp=1_700_000_000 + i / 100)
+        if i + 1 in checkpoints:
+            memory.append(tracemalloc.get_traced_memory()[0])
+    return memory
+
+
+def main():
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    # just before a spill, when the spooled log holds the most
+    checkpoints = [events // 4 - 1, events // 2 - 1, events * 3 // 4 - 1, events - 1]
+    with tempfile.TemporaryDirectory() as folder:
+        # crud works on ./database.sqlite
+        os.chdir(folder)
+        print(f"{events} events; memory after " + ", ".join(f"{point}" for point in checkpoints))
+        spooled = SpooledEventLog(folder=os.path.join(folder, 'event_spill'))
+        for name, log in (('EventLog', EventLog()), ('SpooledEventLog', spooled)):
+            tracemalloc.start()
+            start = time.perf_counter()
+            memory = fill(log, events, set(checkpoints))
+            seconds = time.perf_counter() - start
+            tracemalloc.stop()
+            print(f"  {name:16} " + "  ".join(f"{value / 1024 ** 2:7.1f} MB" for value in memory)
+                  + f"   {seconds * 1e6 / events:.2f} us/event")
+
+        spilled = sum(os.path.getsize(segment) for segment, _, _ in log.segments)
+        print(f"  {len(log.segments)} segment files, {spilled / 1024 ** 2:.1f} MB on disk")
+
+        from database import crud
+        from database.db import create_db_and_tables, get_db
+        create_db_and_tables()
+        db = get_db()
+        start = time.perf_counter()
+        crud.save_file_events(db, 1, log)
+        db.commit()
+        seconds = time.perf_counter() - start
+        # once more under tracemalloc, which slows it down too much to time
+        tracemalloc.start()
+        crud.save_file_events(db, 2, log)
+        db.commit()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        log.discard()
+        db.close()
+        print(f"streamed into file_events in {seconds:.1f}s, peak {peak / 1024 ** 2:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
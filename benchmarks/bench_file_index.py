@@ -0,0 +1,81 @@
+"""
+File index maintenance and query latency.
+
+Usage: python benchmarks/bench_file_index.py [detections] [snapshots] [entries per snapshot]
+Fills a fresh database with ``snapshots`` distinct drive snapshots indexed
+through crud, then inserts ``detections`` detection rows pointing at them
+(every fifth with a short activity log) and times file searches by name, by
+path and by wildcard, up to a name found in every detection.
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import synthetic  # noqa: F401  (puts the repository on sys.path)
+
+from manifest import Manifest, FLAG_DIR, FLAG_LAST
+
+
+def drive_manifest(seed, entries):
+    """ A drive with shared system files plus ``entries`` files of its own. """
+    manifest = Manifest('E:')
+    manifest.add(-1, 'E:', 0, 0, FLAG_DIR | FLAG_LAST)
+    shared = manifest.add(0, 'Shared', 0, 0, FLAG_DIR)
+    manifest.add(shared, 'autorun.inf', 10, 0)
+    manifest.add(shared, 'readme.txt', 10, 0, FLAG_LAST)
+    own = manifest.add(0, f'drive_{seed}', 0, 0, FLAG_DIR | FLAG_LAST)
+    for i in range(entries):
+        manifest.add(own, f'document_{seed}_{i}.docx', i, 0, FLAG_LAST if i == entries - 1 else 0)
+    return manifest.to_bytes()
+
+
+def main():
+    detections = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    snapshots = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    entries = int(sys.argv[3]) if len(sys.argv) > 3 else 5_000
+    with tempfile.TemporaryDirectory() as folder:
+        # crud works on ./database.sqlite
+        os.chdir(folder)
+        from database import crud
+        from database.db import create_db_and_tables, get_db
+        create_db_and_tables()
+        db = get_db()
+
+        start = time.perf_counter()
+        hashes = []
+        for seed in range(snapshots):
+            hashes.append(crud.acquire_snapshot(db, drive_manifest(seed, entries)))
+            db.commit()
+        seconds = time.perf_counter() - start
+        print(f"indexed {snapshots} snapshots of {entries + 5} entries: {seconds / snapshots * 1000:.1f} ms each")
+
+        device = json.dumps({key: '' for key in (
+            'SerialNumber', 'display_name', 'Caption', 'InterfaceType', 'MediaType', 'total_size', 'free_space',
+            'used_space', 'Model', 'Status', 'Partitions', 'Manufacturer', 'FirmwareRevision')}
+            | {'CapabilityDescriptions': []})
+        random.seed(1)
+        rows = [{'id': i + 1, 'serial': f'SN{i % 5000}', 'device': device, 'hash': random.choice(hashes),
+                 'time': f'2024-01-01 00:00:{i % 60:02d}'} for i in range(detections)]
+        start = time.perf_counter()
+        db.execute(crud.text('INSERT INTO detected_devices (id, serial_number, device, tree, snapshot_hash, '
+                             'snapshot_status, insertion_time, removal_time) '
+                             'VALUES (:id, :serial, :device, \'\', :hash, \'complete\', :time, :time)'), rows)
+        for i in range(0, detections, 5):
+            crud.index_detection_activity(db, i + 1, [f'copied/report_{i}.pdf', 'copied/notes.txt'])
+        db.commit()
+        print(f"inserted {detections} detections with activity in {time.perf_counter() - start:.1f}s")
+
+        for query in ('document_7_42.docx', 'drive_3/document_3_99.docx', 'report_5000.pdf',
+                      'document_7_4*', 'notes.txt', 'autorun.inf', 'missing.bin'):
+            start = time.perf_counter()
+            results = crud.search_file_index(query, db)
+            seconds = time.perf_counter() - start
+            print(f"{query!r:32} {len(results):5} results in {seconds * 1000:7.1f} ms")
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Database write load of the periodic activity flusher.
+
+Usage: python benchmarks/bench_flush_load.py [events per second] [seconds]
+Logs a steady stream of file events into a watched session of a fresh
+database for a few seconds under several flush intervals and batch sizes,
+and reports the transactions committed, rows per transaction, time spent
+flushing and the most events that were ever waiting to be written (what a
+crash at the worst moment would have had to recover from the segments).
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import synthetic  # noqa: F401  (puts the repository on sys.path)
+
+from sqlalchemy import event
+
+CONFIGS = ((0.1, 500), (1.0, 5_000), (1.0, 50_000), (5.0, 50_000))
+
+
+def run(detection_id, rate, seconds, interval, batch_events):
+    from event_flusher import EventFlusher
+    from file_events import Action
+    from log_watcher import USBEventHandler
+
+    handler = USBEventHandler(stat_workers=0, session=detection_id)
+    flusher = handler.flusher = EventFlusher(handler, detection_id, 'E:', interval, batch_events)
+    flush = flusher.flush
+    busy = [0.0]
+
+    def timed_flush():
+        start = time.perf_counter()
+        flush()
+        busy[0] += time.perf_counter() - start
+    flusher.flush = timed_flush
+
+    flusher.start()
+    backlog = 0
+    start = time.perf_counter()
+    sent = 0
+    while True:
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            break
+        due = int(elapsed * rate)
+        with handler.lock:
+            for i in range(sent, due):
+                handler.log_event(Action.MODIFIED, f"E:\\data\\dir_{i % 50}\\file_{i}.bin", i)
+        sent = due
+        backlog = max(backlog, flusher.pending())
+        time.sleep(0.005)
+    handler.close()
+    return sent, flusher.flushes, flusher.rows, busy[0], backlog
+
+
+def main():
+    rate = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    with tempfile.TemporaryDirectory() as folder:
+        # crud works on ./database.sqlite
+        os.chdir(folder)
+        from database import crud, models
+        from database.db import create_db_and_tables, engine, get_db
+        create_db_and_tables()
+        commits = [0]
+        event.listen(engine, 'commit', lambda connection: commits.__setitem__(0, commits[0] + 1))
+
+        db = get_db()
+        print(f"{rate} events/s for {seconds:.0f}s")
+        for interval, batch_events in CONFIGS:
+            detection = models.DetectedDevice(serial_number='SN', device={}, tree='', insertion_time=datetime.now())
+            db.add(detection)
+            db.commit()
+            before = commits[0]
+            sent, flushes, rows, busy, backlog = run(detection.id, rate, seconds, interval, batch_events)
+            saved = crud.file_event_cursor(db, detection.id)
+            print(f"  interval {interval:4.1f}s batch {batch_events:6}: {commits[0] - before:4} transactions, "
+                  f"{rows / max(flushes, 1):8.0f} rows each, flushing {busy / seconds:5.1%} of the time, "
+                  f"backlog up to {backlog:6} events ({saved}/{sent} saved)")
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Measure re-snapshot latency for a re-inserted, mostly unchanged drive.
+
+Usage: python benchmarks/bench_incremental_scan.py [entries ...]
+A full scan is taken first, then a handful of files are added, removed and
+renamed in one folder, and the drive is rescanned against the first manifest.
+The rescan must match a fresh full scan of the changed drive.
+"""
+import os
+import sys
+import time
+
+from synthetic import build_tree, temporary_drive, parse_sizes
+
+from manifest import scan_drive
+
+
+def same(a, b):
+    return (a.names == b.names and a.parents == b.parents and a.sizes == b.sizes
+            and a.mtimes == b.mtimes and a.flags == b.flags)
+
+
+def change_one_folder(root):
+    folder = os.path.join(root, 'dir_001', 'dir_002')
+    for i in range(5):
+        with open(os.path.join(folder, f'new_{i}.txt'), 'w') as f:
+            f.write('x' * 1000 * i)
+    os.remove(os.path.join(folder, 'file_0003.dat'))
+    os.rename(os.path.join(folder, 'file_0004.dat'), os.path.join(folder, 'renamed.dat'))
+
+
+def main():
+    sizes = parse_sizes(sys.argv, [100_000, 500_000])
+    print(f"{'entries':>10} {'full s':>10} {'rescan ms':>10} {'unchanged ms':>13} {'correct':>8}")
+    for size in sizes:
+        with temporary_drive() as root:
+            build_tree(root, size)
+            start = time.perf_counter()
+            first = scan_drive(root)
+            full_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            unchanged = scan_drive(root, previous=first)
+            unchanged_ms = (time.perf_counter() - start) * 1000
+
+            change_one_folder(root)
+            start = time.perf_counter()
+            rescan = scan_drive(root, previous=first)
+            rescan_ms = (time.perf_counter() - start) * 1000
+
+            correct = same(unchanged, first) and same(rescan, scan_drive(root))
+            print(f"{size:>10} {full_seconds:>10.3f} {rescan_ms:>10.1f} {unchanged_ms:>13.1f} "
+                  f"{'yes' if correct else 'NO':>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+watchdog and the native inotify backend under a scripted file workload.
+
+Usage: python benchmarks/bench_inotify_backend.py [files] [folder]
+Runs the same workload on a fresh folder (under /dev/shm, a tmpfs, unless
+``folder`` is given) watched through each backend in turn, and reports per
+phase the events the handler received by action and the paths reported
+created more than once, then whether the sizes the watcher ended up with
+match the files actually on the drive.
+
+The phases: ``files`` copies written in 8 chunks each, renaming half of
+them, editor-style saves (a temporary file renamed over the original),
+moving a folder of files, copying a folder tree onto the drive (with the
+observer's listing of new folders slowed down, as on a slow stick, so files
+land between a folder being watched and being listed), files moved off the
+drive and onto it, files opened for writing and closed unchanged, and
+deleting a quarter of them.
+"""
+import collections
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import synthetic  # noqa: F401  (puts the repository on sys.path)
+
+from file_events import Action
+from log_watcher import SharedObserver, USBEventHandler
+
+CHUNK = 16 * 1024
+# watchdog holds back move events for half a second to pair them
+SETTLE = 1.0
+# Seconds the observer thread takes to list a folder during copy_folder
+LISTING_DELAY = 0.005
+
+
+def copy(drive, files):
+    for i in range(files):
+        with open(os.path.join(drive, f'copy_{i}.bin'), 'wb') as f:
+            for _ in range(8):
+                f.write(os.urandom(CHUNK))
+                f.flush()
+
+
+def rename(drive, files):
+    for i in range(0, files, 2):
+        os.rename(os.path.join(drive, f'copy_{i}.bin'), os.path.join(drive, f'renamed_{i}.bin'))
+
+
+def editor_saves(drive, files):
+    for i in range(1, files, 2):
+        path = os.path.join(drive, f'copy_{i}.bin')
+        with open(path + '.tmp', 'wb') as f:
+            f.write(os.urandom(CHUNK * 3))
+        os.replace(path + '.tmp', path)
+
+
+def move_folder(drive, files):
+    folder = os.path.join(drive, 'folder')
+    os.mkdir(folder)
+    for i in range(files // 4):
+        with open(os.path.join(folder, f'inner_{i}.bin'), 'wb') as f:
+            f.write(os.urandom(CHUNK))
+    time.sleep(SETTLE)
+    os.rename(folder, os.path.join(drive, 'moved_folder'))
+
+
+@contextlib.contextmanager
+def slow_listing():
+    scandir = os.scandir
+
+    def slow(path='.'):
+        if threading.current_thread().name == 'inotify-observer':
+            time.sleep(LISTING_DELAY)
+        return scandir(path)
+    os.scandir = slow
+    try:
+        yield
+    finally:
+        os.scandir = scandir
+
+
+def copy_folder(drive, files):
+    # a folder at a time, its files written right after it is made, as fast as a copy can
+    payloads = [os.urandom(CHUNK * (1 + i % 4)) for i in range(4)]
+    with slow_listing():
+        for i in range(files // 2):
+            folder = os.path.join(drive, 'copied_tree', f'sub_{i // 10}')
+            if i % 10 == 0:
+                os.makedirs(folder)
+            payload = payloads[i % 4]
+            with open(os.path.join(folder, f'copied_{i}.bin'), 'wb') as f:
+                for offset in range(0, len(payload), CHUNK):
+                    f.write(payload[offset:offset + CHUNK])
+                    f.flush()
+        time.sleep(SETTLE)
+
+
+def off_and_onto(drive, files, outside):
+    for i in range(1, files, 4):
+        os.rename(os.path.join(drive, f'copy_{i}.bin'), os.path.join(outside, f'away_{i}.bin'))
+    for i in range(files // 4):
+        path = os.path.join(outside, f'incoming_{i}.bin')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(CHUNK * 2))
+        os.rename(path, os.path.join(drive, f'incoming_{i}.bin'))
+
+
+def unchanged(drive, files):
+    for i in range(0, files, 2):
+        with open(os.path.join(drive, f'renamed_{i}.bin'), 'ab'):
+            pass
+
+
+def delete(drive, files):
+    for i in range(0, files, 4):
+        os.remove(os.path.join(drive, f'renamed_{i}.bin'))
+
+
+PHASES = (copy, rename, editor_saves, move_folder, copy_folder, off_and_onto, unchanged, delete)
+
+
+def on_disk(drive):
+    sizes = {}
+    for folder, _, names in os.walk(drive):
+        for name in names:
+            path = os.path.join(folder, name)
+            sizes[path] = os.path.getsize(path)
+    return sizes
+
+
+def run(backend, base, files):
+    drive = tempfile.mkdtemp(dir=base)
+    outside = tempfile.mkdtemp(dir=base)
+    before = threading.active_count()
+    shared = SharedObserver(backend=backend)
+    handler = USBEventHandler(root=drive, stats=shared.stats)
+    received = collections.Counter()
+    created = collections.Counter()
+    deliver = handler.deliver
+
+    def counted(action, path, size, destination, is_directory, timestamp):
+        received[action] += 1
+        if action == Action.CREATED:
+            created[path] += 1
+        deliver(action, path, size, destination, is_directory, timestamp)
+    handler.deliver = counted
+
+    shared.attach(drive, handler)
+    threads = threading.active_count() - before
+    observer = type(shared.observer)
+    print(f"{backend}: {observer.__module__}.{observer.__name__}, {threads} threads")
+    for phase in PHASES:
+        received.clear()
+        created.clear()
+        if phase is off_and_onto:
+            phase(drive, files, outside)
+        else:
+            phase(drive, files)
+        time.sleep(SETTLE)
+        shared.stats.sync()
+        twice = sum(1 for count in created.values() if count > 1)
+        print(f"  {phase.__name__:13} " + "  ".join(f"{action.name.lower()} {received[action]:4}"
+                                                     for action in Action if received[action])
+              + f"  ({twice} created twice)")
+    shared.detach(drive)
+    handler.close()
+    shared.observer.stop()
+    shared.stats.close()
+
+    actual = on_disk(drive)
+    known = {path: size for path, size in handler.file_events.items() if path.startswith(drive)}
+    wrong = sum(1 for path, size in actual.items() if known.get(path) != size)
+    stale = sum(1 for path in known if path not in actual)
+    print(f"  {len(actual)} files on the drive: {wrong} with a wrong or missing size, {stale} stale paths; "
+          f"{len(handler.events)} events logged")
+    shutil.rmtree(drive)
+    shutil.rmtree(outside)
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    base = sys.argv[2] if len(sys.argv) > 2 else ('/dev/shm' if os.path.isdir('/dev/shm') else None)
+    for backend in ('watchdog', 'inotify'):
+        run(backend, base, files)
+
+
+if __name__ == '__main__':
+    main()
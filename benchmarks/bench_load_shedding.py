@@ -0,0 +1,154 @@
+"""
+Logging a flood of file events with and without load shedding.
+
+Usage: python benchmarks/bench_load_shedding.py [files] [rounds]
+Feeds USBEventHandler, on a simulated clock, a quiet minute of ordinary
+activity, a flood and a quiet minute again, for two floods:
+
+* rewrites: ``files`` files in 200 folders created and rewritten ``rounds``
+  times a few seconds apart (a build, or ransomware encrypting in place), a
+  tenth of them saved over once more through a temporary file renamed over
+  them the way editors do, renamed to ``.locked`` and partly deleted;
+* checkout: ``files`` distinct files written once each, in 2000 folders
+  (a ``git checkout`` or an unpacked archive).
+
+Each is run with shedding off and on. Reports the events logged and the time
+taken, the size of the log text and the time to render it, whether the
+bytes and the per-action counts are the same, how many files replaying the
+shed log over an empty drive gives as the full log does (the others are only
+counted per folder), the shedding rows in the log, and what the detection
+stores of the episodes.
+"""
+import collections
+import json
+import os
+import sys
+import tempfile
+import time
+
+import synthetic  # noqa: F401  (puts the repository on sys.path)
+
+import load_shedding
+from file_events import Action, SHEDDING_ACTIONS, format_size
+from log_watcher import USBEventHandler
+from manifest import scan_drive
+from replay import Replay
+
+FOLDERS = 200
+CHECKOUT_FOLDERS = 2000
+# Seconds between the rounds of rewrites, more than the coalescer's quiet window
+ROUND_GAP = 3.0
+
+
+def quiet(root, now):
+    """ A minute of ordinary activity, one event a second. """
+    for i in range(60):
+        now += 1
+        path = os.path.join(root, 'documents', 'note_0.txt')
+        yield Action.CREATED if i == 0 else Action.MODIFIED, path, 100 + i, None, False, now
+
+
+def rewrites(root, files, rounds, start):
+    """ (action, path, size, destination, is_directory, timestamp) of the raw events. """
+    yield from quiet(root, start)
+    now = start + 60
+    for folder in range(FOLDERS):
+        yield Action.CREATED_DIRECTORY, os.path.join(root, f'tree_{folder}'), None, None, True, now
+    step = ROUND_GAP / files
+    for round_ in range(rounds):
+        action = Action.CREATED if round_ == 0 else Action.MODIFIED
+        for i in range(files):
+            path = os.path.join(root, f'tree_{i % FOLDERS}', f'file_{i}.dat')
+            now += step
+            yield action, path, 1000 + round_ * 100 + i % 97, None, False, now
+    # the temporary files are renamed over the others a round later, so the renames are
+    # not merged into their creation
+    saved = [os.path.join(root, f'tree_{i % FOLDERS}', f'file_{i}.dat') for i in range(0, files, 10)]
+    for i, path in enumerate(saved):
+        now += step * 10
+        yield Action.MODIFIED, path, 1, None, False, now
+        yield Action.CREATED, path + '.tmp', 2000 + i % 97, None, False, now
+    for path in saved:
+        now += step * 10
+        yield Action.MOVED, path + '.tmp', None, path, False, now
+    for i in range(files):
+        path = os.path.join(root, f'tree_{i % FOLDERS}', f'file_{i}.dat')
+        now += step
+        if i % 4 == 0:
+            yield Action.DELETED, path, None, None, False, now
+        else:
+            yield Action.MOVED, path, None, path + '.locked', False, now
+    yield from quiet(root, now)
+
+
+def checkout(root, files, rounds, start):
+    """ The same, for ``files`` distinct files written once, a few thousand a second. """
+    yield from quiet(root, start)
+    now = start + 60
+    for folder in range(CHECKOUT_FOLDERS):
+        yield Action.CREATED_DIRECTORY, os.path.join(root, f'src_{folder}'), None, None, True, now
+    for i in range(files):
+        now += 1 / 5000
+        path = os.path.join(root, f'src_{i % CHECKOUT_FOLDERS}', f'module_{i}.py')
+        yield Action.CREATED, path, 500 + i % 4000, None, False, now
+    yield from quiet(root, now)
+
+
+def run(workload, root, files, rounds, rate):
+    handler = USBEventHandler(stat_workers=0, root=root)
+    handler.shedder.rate = rate
+    start = time.perf_counter()
+    for event in workload(root, files, rounds, time.time()):
+        handler.deliver(*event)
+    handler.close()
+    seconds = time.perf_counter() - start
+    # what every logged event costs again later: its database row and its line of text
+    start = time.perf_counter()
+    text = handler.events.text()
+    rendered = time.perf_counter() - start
+    print(f"  {'shedding above ' + str(rate) + '/s' if rate else 'no shedding':24} {len(handler.events):8} events "
+          f"logged in {seconds:5.2f}s, {handler.shedder.shed} writes shed; "
+          f"{format_size(len(text)):>9} of text in {rendered:4.2f}s")
+    return handler
+
+
+def files_of(manifest):
+    return {path: manifest.sizes[row] for row, path in enumerate(manifest.paths()) if not manifest.is_dir(row)}
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    root = tempfile.mkdtemp()
+    empty = scan_drive(root)
+    for title, workload in ((f"rewrites: {files} files rewritten {rounds} times", rewrites),
+                            (f"checkout: {files} distinct files written once", checkout)):
+        print(title)
+        compare(workload, root, empty, files, rounds)
+    os.rmdir(root)
+
+
+def compare(workload, root, empty, files, rounds):
+    full = run(workload, root, files, rounds, 0)
+    shed = run(workload, root, files, rounds, load_shedding.SHED_RATE or 2_000)
+    print(f"  same bytes: {full.transfers.summary() == shed.transfers.summary()} "
+          f"({format_size(shed.transfers.added)} added, {format_size(shed.transfers.removed)} removed)")
+    print(f"  same counts per action: {full.actions == shed.actions}")
+    replayed = [files_of(Replay(empty, root).apply_all(handler.events.replay_events()).result())
+                for handler in (full, shed)]
+    same = sum(1 for path, size in replayed[1].items() if replayed[0].get(path) == size)
+    print(f"  files replayed as from the full log: {same} of {len(replayed[0])}, "
+          f"{len(replayed[1]) - same} with another size")
+    rows = collections.Counter(action for _, action, _, _, _ in shed.events.records() if action in SHEDDING_ACTIONS)
+    print("  shedding rows logged: " + ", ".join(f"{action.name.lower()} {rows[action]}" for action in SHEDDING_ACTIONS))
+    activity = shed.activity()
+    episodes = activity['shedding']['episodes']
+    print(f"  stored with the detection: {len(json.dumps(activity))} bytes, {len(episodes)} episodes, "
+          f"{sum(episode['shed'] for episode in episodes)} writes shed in "
+          f"{sum(episode['folders'] for episode in episodes)} folders")
+    full.events.discard()
+    shed.events.discard()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""
+Lost watcher events and the rescan that reconciles them.
+
+Usage: python benchmarks/bench_overflow_reconcile.py [files] [folder]
+Watches a fresh folder (under /dev/shm, a tmpfs, unless ``folder`` is
+given) holding ``files`` existing files through the native inotify backend.
+A few files are created and deleted first, and once those events are logged
+the snapshot taken before is handed to the handler. Then the observer is
+stalled while a burst of creates, rewrites, renames, deletions and new
+folders runs, until the kernel queue overflows. Once the rescans are done,
+the snapshot with the session's events replayed over it is compared with a
+fresh snapshot of the folder: every file and folder should be there with
+the right size, and none of the first files should have been reconciled
+again. This is done with the snapshot as the handler's baseline, once more
+with the session flushed to a database under a detection id while it runs
+(where the replay reads the events back from file_events), and without a
+baseline, where deletions of files that had no events before the overflow
+cannot be told.
+
+Linux only: the overflow is forced through inotify.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import synthetic  # noqa: F401  (puts the repository on sys.path)
+
+import inotify_observer
+from coalescer import QUIET_WINDOW
+from database import crud
+from database.db import create_db_and_tables, get_db
+from event_flusher import EventFlusher
+from file_events import FILE_ACTIONS
+from log_watcher import SharedObserver, USBEventHandler
+from manifest import scan_drive
+from replay import Replay
+
+
+def populate(drive, files):
+    for i in range(files):
+        folder = os.path.join(drive, f'old_{i % 20}')
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f'file_{i}.txt'), 'wb') as f:
+            f.write(b'x' * (100 + i))
+
+
+def warm_up(drive, files):
+    """ Paths of files created and deleted before the overflow, none of which the burst touches. """
+    paths = []
+    for i in range(200):
+        path = os.path.join(drive, f'old_{i % 20}', f'warm_{i}.txt')
+        with open(path, 'wb') as f:
+            f.write(b'w' * (10 + i))
+        paths.append(path)
+    for i in range(5, files, 6):
+        path = os.path.join(drive, f'old_{i % 20}', f'file_{i}.txt')
+        os.remove(path)
+        paths.append(path)
+    return set(paths)
+
+
+def burst(drive, files, events):
+    """ At least ``events`` inotify events of every kind, plus changes to the existing files. """
+    for i in range(0, files, 3):
+        os.remove(os.path.join(drive, f'old_{i % 20}', f'file_{i}.txt'))
+    for i in range(1, files, 3):
+        with open(os.path.join(drive, f'old_{i % 20}', f'file_{i}.txt'), 'ab') as f:
+            f.write(b'y' * 50)
+    for i in range(2, files, 6):
+        os.rename(os.path.join(drive, f'old_{i % 20}', f'file_{i}.txt'),
+                  os.path.join(drive, f'old_{(i + 1) % 20}', f'renamed_{i}.txt'))
+    for i in range(10):
+        os.mkdir(os.path.join(drive, f'new_{i}'))
+    count = 0
+    while count < events:
+        # in watched folders: a new folder only gets a watch once the observer catches up
+        path = os.path.join(drive, f'old_{count % 20}', f'new_{count}.bin')
+        with open(path, 'wb') as f:
+            f.write(b'z' * (count % 4096))
+        if count % 7 == 0:
+            os.remove(path)
+        count += 4  # created, modified, closed, and the odd deletion
+
+
+def compare(expected, actual):
+    """ Entries missing from ``expected``, missing from ``actual``, and files whose sizes differ. """
+    old = {path: (manifest_is_dir, size) for path, manifest_is_dir, size in entries(expected)}
+    new = {path: (manifest_is_dir, size) for path, manifest_is_dir, size in entries(actual)}
+    missing = sum(1 for path in new if path not in old)
+    extra = sum(1 for path in old if path not in new)
+    wrong = sum(1 for path, (is_dir, size) in new.items()
+                if path in old and not is_dir and old[path] != (is_dir, size))
+    return missing, extra, wrong
+
+
+def entries(manifest):
+    for row, path in enumerate(manifest.paths()):
+        if row:
+            yield path, manifest.is_dir(row), manifest.sizes[row]
+
+
+def run(base, files, events, baseline, flushed=False):
+    drive = tempfile.mkdtemp(dir=base)
+    populate(drive, files)
+    snapshot = scan_drive(drive)
+    shared = SharedObserver(backend='inotify')
+    detection_id = None
+    if flushed:
+        detection_id = crud.add_or_update_detected_pc({}, f'SN{time.time()}', None, datetime.now(),
+                                                      crud.SNAPSHOT_PENDING)
+    handler = USBEventHandler(session=detection_id, root=drive, stats=shared.stats)
+    # the burst is a flood, and the writes load shedding leaves out of the log do not replay
+    handler.shedder.rate = 0
+    handler.events.folder = os.path.join(os.getcwd(), 'event_spill')
+    if flushed:
+        handler.flusher = EventFlusher(handler, detection_id, drive, interval=0.2)
+        handler.flusher.start()
+    shared.attach(drive, handler)
+
+    # logged, and flushed to the database, before the baseline arrives
+    warm = warm_up(drive, files)
+    time.sleep(QUIET_WINDOW + 1.0)
+    if baseline:
+        handler.set_baseline(snapshot)
+
+    start = time.perf_counter()
+    with shared.observer.lock:
+        # the observer reads this one and then waits for the lock, so the kernel queue fills up
+        os.mkdir(os.path.join(drive, 'first'))
+        time.sleep(0.2)
+        burst(drive, files, events)
+        time.sleep(0.2)
+    time.sleep(0.5)
+    handler.reconciler.wait()
+    shared.detach(drive)
+    handler.close()
+    seconds = time.perf_counter() - start
+    shared.observer.stop()
+    shared.stats.close()
+
+    log = handler.events
+    if flushed:
+        db = get_db()
+        log = crud.get_file_events(detection_id, db)
+        db.close()
+    reconciled = sum(1 for *_, flag in log.entries() if flag)
+    again = sum(1 for _, _, path, _, _, flag in log.entries() if flag and path in warm)
+    by_action = dict.fromkeys(FILE_ACTIONS, 0)
+    for _, action, *_ in log.records():
+        by_action[action] += 1
+    replayed = Replay(snapshot, drive).apply_all(log.replay_events()).result()
+    missing, extra, wrong = compare(replayed, scan_drive(drive))
+    name = ('with baseline, flushed' if flushed else 'with baseline') if baseline else 'without baseline'
+    print(f"  {name}: {shared.observer.overflows} overflows, "
+          f"{handler.reconciler.rescans} rescans, {len(log)} events logged "
+          f"({reconciled} reconciled, {again} of them for the first files) in {seconds:.1f}s")
+    print("    " + ", ".join(f"{action.name.lower()} {count}" for action, count in by_action.items()))
+    print(f"    replayed log against the drive: {missing} entries missing, {extra} too many, {wrong} wrong sizes")
+    shutil.rmtree(drive)
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 3_000
+    base = sys.argv[2] if len(sys.argv) > 2 else ('/dev/shm' if os.path.isdir('/dev/shm') else None)
+    if not inotify_observer.available():
+        print("inotify is not available here")
+        return
+    with open('/proc/sys/fs/inotify/max_queued_events') as f:
+        events = 3 * int(f.read())
+    print(f"{files} files on the drive, a burst of about {events} events")
+    with tempfile.TemporaryDirectory() as folder:
+        # crud works on ./database.sqlite
+        os.chdir(folder)
+        create_db_and_tables()
+        for baseline, flushed in ((True, False), (True, True), (False, False)):
+            run(base, files, events, baseline, flushed)
+
+
+if __name__ == '__main__':
+    main()
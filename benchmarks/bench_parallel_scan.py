@@ -0,0 +1,40 @@
+"""
+Compare serial and threaded drive scans on wide and deep synthetic trees.
+
+Usage: python benchmarks/bench_parallel_scan.py [entries ...]
+Point TMPDIR at a USB mount to measure against real flash latency; on a
+warm local page cache the listing cost is mostly CPU and gains are smaller.
+"""
+import sys
+import time
+
+from synthetic import build_wide_tree, build_deep_tree, temporary_drive, parse_sizes
+
+import utils
+from manifest import scan_drive
+
+WORKER_COUNTS = (1, 2, 4, 8, 16)
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    sizes = parse_sizes(sys.argv, [100_000])
+    for shape, build in (('wide', build_wide_tree), ('deep', build_deep_tree)):
+        for size in sizes:
+            with temporary_drive() as root:
+                build(root, size)
+                reference, seconds = timed(utils.print_tree, root, root + '\n')
+                print(f"{shape} {size} entries: utils.print_tree {seconds:.3f}s")
+                for workers in WORKER_COUNTS:
+                    manifest, seconds = timed(scan_drive, root, workers=workers)
+                    same = 'identical' if manifest.tree_text() == reference else 'DIFFERENT'
+                    print(f"    scan_drive workers={workers:<3} {seconds:.3f}s  {same}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Memory of the per-path sizes the watcher keeps, unbounded and as an LRU.
+
+Usage: python benchmarks/bench_path_sizes.py [temp files] [capacity]
+Feeds TransferStats the events of a build running off a stick: ``temp
+files`` distinct object files created and written once (a third of them
+deleted again), interleaved with a few hundred hot files (a database, logs)
+that are rewritten all along. This is done once with the plain dict the
+handler used to keep and once with a PathSizes of ``capacity`` paths. Reports
+the memory held per tracked path and in total, the time per event, the
+evictions, and whether the bytes accounted for the hot files still match.
+"""
+import sys
+import time
+import tracemalloc
+
+import synthetic  # noqa: F401  (puts the repository on sys.path)
+
+from file_events import Action, PathSizes, TransferStats, format_size
+
+HOT_FILES = 300
+
+
+def build(temp_files):
+    """ (action, path, size, destination) of the build. """
+    for i in range(temp_files):
+        path = f'E:\\build\\obj\\module_{i % 997}\\unit_{i}.o'
+        yield Action.CREATED, path, 0, None
+        yield Action.MODIFIED, path, 4096 + i % 50_000, None
+        if i % 3 == 0:
+            yield Action.DELETED, path, None, None
+        hot = i % HOT_FILES
+        yield Action.MODIFIED, f'E:\\build\\state\\hot_{hot}.db', 1_000_000 + (i // HOT_FILES) * 512, None
+
+
+def run(name, make_sizes, temp_files):
+    events = list(build(temp_files))
+    stats = TransferStats('E:', make_sizes())
+    start = time.perf_counter()
+    for action, path, size, destination in events:
+        stats.account(action, path, size, destination)
+    seconds = time.perf_counter() - start
+    count = len(events)
+    del events
+
+    # again, traced, with the events made as they come so the path strings kept are counted
+    tracemalloc.start()
+    traced = TransferStats('E:', make_sizes())
+    for action, path, size, destination in build(temp_files):
+        traced.account(action, path, size, destination)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    tracked = len(traced.sizes)
+    evicted = getattr(traced.sizes, 'evicted', 0)
+    print(f"  {name:20} {tracked:9} paths  {format_size(memory):>9}  {memory / tracked:6.0f} B per path  "
+          f"{seconds / count * 1e6:5.2f} us per event  {evicted} evicted")
+    return stats
+
+
+def main():
+    temp_files = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    capacity = int(sys.argv[2]) if len(sys.argv) > 2 else 50_000
+    print(f"{temp_files} temporary files and {HOT_FILES} hot files")
+    exact = run('dict', dict, temp_files)
+    bounded = run(f'PathSizes({capacity})', lambda: PathSizes(capacity), temp_files)
+    for extension in ('.db', '.o'):
+        added, removed = exact.extensions[extension]
+        bounded_added, bounded_removed = bounded.extensions[extension]
+        print(f"  {extension:4} added {format_size(added):>10} / {format_size(bounded_added):>10}  "
+              f"removed {format_size(removed):>10} / {format_size(bounded_removed):>10}  (dict / PathSizes)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Replay a long watcher session over an insertion snapshot.
+
+Usage: python benchmarks/bench_replay.py [entries] [events]
+Snapshots a synthetic drive of ``entries`` entries, writes ``events`` log
+lines in the USBEventHandler format (creates, modifies, deletes, file and
+folder moves, new folders) and times parsing, applying and building the
+reconstructed removal-time manifest.
+"""
+import os
+import random
+import sys
+import time
+
+from synthetic import build_tree, temporary_drive
+
+from manifest import scan_drive
+from replay import Replay, parse_logs
+
+
+def session_logs(manifest, events, seed=1):
+    """ Watcher log text for ``events`` random but consistent changes. """
+    random.seed(seed)
+    paths = manifest.paths()
+    sep = os.sep
+    root = manifest.root
+    files = [root + sep + paths[row].replace('/', sep) for row in range(1, len(manifest)) if not manifest.is_dir(row)]
+    folders = [root] + [root + sep + paths[row].replace('/', sep) for row in range(1, len(manifest))
+                        if manifest.is_dir(row)]
+    stamp = "[2024-05-01 10:00:00]"
+    lines = []
+    for n in range(events):
+        choice = random.random()
+        if choice < 0.4 or not files:
+            path = f"{random.choice(folders)}{sep}new_{n}.bin"
+            files.append(path)
+            lines.append(f"{stamp} Created: {path}, Size: {random.randint(1, 900)}.5 KB")
+            lines.append("Total transferred: 1.0 MB")
+        elif choice < 0.7:
+            lines.append(f"{stamp} Modified: {random.choice(files)}, Size: 2.25 MB")
+            lines.append("Total transferred: 1.0 MB")
+        elif choice < 0.85:
+            i = random.randrange(len(files))
+            files[i], files[-1] = files[-1], files[i]
+            lines.append(f"{stamp} Deleted: {files.pop()}")
+        elif choice < 0.95:
+            i = random.randrange(len(files))
+            destination = f"{random.choice(folders)}{sep}moved_{n}.bin"
+            lines.append(f"{stamp} Changed: from {files[i]} to {destination}")
+            files[i] = destination
+        else:
+            path = f"{random.choice(folders)}{sep}folder_{n}"
+            folders.append(path)
+            lines.append(f"{stamp} Created directory: {path}")
+    return '\n'.join(lines)
+
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    events = int(sys.argv[2]) if len(sys.argv) > 2 else 200_000
+    with temporary_drive() as root:
+        build_tree(root, entries)
+        manifest = scan_drive(root)
+        logs = session_logs(manifest, events)
+
+        start = time.perf_counter()
+        parsed = list(parse_logs(logs))
+        parse_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        replay = Replay(manifest).apply_all(parsed)
+        apply_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = replay.result()
+        result_seconds = time.perf_counter() - start
+
+        total = parse_seconds + apply_seconds + result_seconds
+        print(f"{len(manifest)} entries, {len(parsed)} events ({replay.applied} applied, {replay.skipped} skipped) "
+              f"-> {len(result)} entries")
+        print(f"parse {parse_seconds:.2f}s, apply {apply_seconds:.2f}s, build {result_seconds:.2f}s: "
+              f"{len(parsed) / total:,.0f} events/s overall")
+
+
+if __name__ == '__main__':
+    main()
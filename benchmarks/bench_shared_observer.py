@@ -0,0 +1,129 @@
+"""
+Threads and event delivery with many drives monitored at once.
+
+Usage: python benchmarks/bench_shared_observer.py [mounts] [files per mount]
+Watches ``mounts`` temporary folders standing in for drives, first the old
+way (an observer and a stat worker per drive) and then through the shared
+observer with a flusher per drive writing to a fresh database, and reports
+the threads running as the drives are attached, how long it takes until
+every file written to every drive is logged, and whether any event reached
+the wrong drive.
+"""
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import synthetic  # noqa: F401  (puts the repository on sys.path)
+
+from watchdog.observers import Observer
+
+
+def write_files(drives, files):
+    for i in range(files):
+        for drive in drives:
+            with open(os.path.join(drive, f'file_{i}.bin'), 'wb') as f:
+                f.write(b'x' * (1024 + i))
+
+
+def logged(handlers, files):
+    """ Seconds until every handler logged its files, once the quiet window has been skipped. """
+    start = time.perf_counter()
+    while True:
+        for handler in handlers:
+            handler.flush(force=True)
+        if all(len(handler.file_events) >= files for handler in handlers) or time.perf_counter() - start > 30:
+            return time.perf_counter() - start
+        time.sleep(0.01)
+
+
+def misrouted(drives, handlers):
+    return sum(1 for drive, handler in zip(drives, handlers)
+               for path in handler.file_events if not path.startswith(drive))
+
+
+def per_drive(drives, files):
+    from log_watcher import USBEventHandler
+
+    baseline = threading.active_count()
+    observers, handlers, counts = [], [], []
+    for drive in drives:
+        handler = USBEventHandler(root=drive)
+        observer = Observer()
+        observer.schedule(handler, path=drive, recursive=True)
+        observer.start()
+        observers.append(observer)
+        handlers.append(handler)
+        counts.append(threading.active_count() - baseline)
+    start = time.perf_counter()
+    write_files(drives, files)
+    seconds = time.perf_counter() - start + logged(handlers, files)
+    peak = threading.active_count() - baseline
+    wrong = misrouted(drives, handlers)
+    for observer, handler in zip(observers, handlers):
+        observer.stop()
+        observer.join()
+        handler.close()
+    return counts, peak, seconds, wrong
+
+
+def shared(drives, files):
+    from database import crud, models
+    from database.db import get_db
+    from log_watcher import start_monitoring
+
+    db = get_db()
+    baseline = threading.active_count()
+    monitors, counts = [], []
+    for drive in drives:
+        detection = models.DetectedDevice(serial_number='SN', device={}, tree='', insertion_time=datetime.now())
+        db.add(detection)
+        db.commit()
+        with contextlib.redirect_stdout(io.StringIO()):
+            monitors.append(start_monitoring(drive, detection.id))
+        counts.append(threading.active_count() - baseline)
+    handlers = [monitor.event_handler for monitor in monitors]
+    start = time.perf_counter()
+    write_files(drives, files)
+    seconds = time.perf_counter() - start + logged(handlers, files)
+    peak = threading.active_count() - baseline
+    wrong = misrouted(drives, handlers)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for monitor in monitors:
+            monitor.stop()
+    saved = sum(crud.file_event_cursor(db, monitor.event_handler.flusher.detection_id) for monitor in monitors)
+    print(f"  shared observer: {saved} events flushed to the database")
+    return counts, peak, seconds, wrong
+
+
+def main():
+    mounts = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    with tempfile.TemporaryDirectory() as folder:
+        # crud works on ./database.sqlite
+        os.chdir(folder)
+        from database import models  # noqa: F401  (registers the tables)
+        from database.db import create_db_and_tables
+        create_db_and_tables()
+        checkpoints = sorted({0, 9, mounts // 2 - 1, mounts - 1} & set(range(mounts)))
+        print(f"{mounts} drives, {files} files each; extra threads with " +
+              ", ".join(f"{point + 1}" for point in checkpoints) + " drives attached")
+        for name, monitor in (('observer per drive', per_drive), ('shared observer', shared)):
+            drives = [tempfile.mkdtemp(dir=folder) for _ in range(mounts)]
+            counts, peak, seconds, wrong = monitor(drives, files)
+            print(f"  {name:18} " + "  ".join(f"{counts[point]:5}" for point in checkpoints) +
+                  f"   {peak:5} while busy   all logged in {seconds:5.2f}s   {wrong} misrouted")
+            for drive in drives:
+                shutil.rmtree(drive)
+        time.sleep(0.5)
+        print(f"  {threading.active_count() - 1} threads left once every drive was removed "
+              f"(the shared observer, stat worker, flush loop and metrics dump)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Database growth for repeated insertions of the same drive.
+
+Usage: python benchmarks/bench_snapshot_dedup.py [insertions] [entries]
+Records ``insertions`` detections of one unchanged drive through crud into a
+fresh database and reports the file size per detection next to the size of
+one stored snapshot.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from synthetic import build_tree, temporary_drive
+
+from manifest import scan_drive
+
+
+def main():
+    insertions = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    entries = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    with temporary_drive() as root, tempfile.TemporaryDirectory() as folder:
+        build_tree(root, entries)
+        manifest = scan_drive(root).to_bytes()
+
+        # crud works on ./database.sqlite
+        os.chdir(folder)
+        import utils
+        from database import crud
+        from database.db import create_db_and_tables
+        create_db_and_tables()
+
+        device = {"SerialNumber": "BENCH"}
+        start = time.perf_counter()
+        for _ in range(insertions):
+            crud.add_or_update_detected_pc(device, "BENCH", manifest, utils.timestamp())
+        seconds = time.perf_counter() - start
+
+        size = os.path.getsize("database.sqlite")
+        print(f"{insertions} detections of a {entries}-entry drive in {seconds:.2f}s")
+        print(f"manifest {len(manifest) / 1024:.0f} KB raw; database {size / 1024:.0f} KB "
+              f"({size / insertions / 1024:.1f} KB per detection, "
+              f"{insertions * len(manifest) / size:.0f}x less than one raw copy per detection)")
+
+
+if __name__ == '__main__':
+    main()
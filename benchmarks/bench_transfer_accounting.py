@@ -0,0 +1,72 @@
+"""
+Transferred-bytes accounting: summed sizes versus size deltas.
+
+Usage: python benchmarks/bench_transfer_accounting.py [events]
+Compares what the old "Total transferred" (the sum of every logged size) and
+TransferStats report for a few sessions whose true volume is known, then
+times TransferStats.account over ``events`` events spread over many paths,
+extensions and folders to show the cost per event stays flat.
+"""
+import sys
+import time
+
+import synthetic  # noqa: F401  (puts the repository on sys.path)
+
+from file_events import Action, TransferStats, format_size
+
+GB = 1024 ** 3
+
+
+def appended_video():
+    """ A 4 GB file appended to ten times by 100 MB. """
+    path = 'E:\\video\\capture.mkv'
+    yield Action.CREATED, path, 4 * GB, None
+    for i in range(1, 11):
+        yield Action.MODIFIED, path, 4 * GB + i * 100 * 1024 ** 2, None
+    # true volume: 5 GB written
+
+
+def rewritten_database():
+    """ A 200 MB database rewritten in place fifty times. """
+    path = 'E:\\data\\app.sqlite'
+    yield Action.CREATED, path, 200 * 1024 ** 2, None
+    for _ in range(50):
+        yield Action.MODIFIED, path, 200 * 1024 ** 2, None
+    # true volume: 200 MB (the size never changes after the first copy)
+
+
+def copied_then_deleted():
+    """ 100 photos of 5 MB copied, renamed, then half of them deleted. """
+    for i in range(100):
+        yield Action.CREATED, f'E:\\photos\\IMG_{i}.jpg', 5 * 1024 ** 2, None
+        yield Action.MOVED, f'E:\\photos\\IMG_{i}.jpg', None, f'E:\\photos\\holiday_{i}.jpg'
+    for i in range(0, 100, 2):
+        yield Action.DELETED, f'E:\\photos\\holiday_{i}.jpg', None, None
+    # true volume: 500 MB added, 250 MB removed
+
+
+def main():
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    for session in (appended_video, rewritten_database, copied_then_deleted):
+        summed = 0
+        stats = TransferStats('E:')
+        for action, path, size, destination in session():
+            if size is not None:
+                summed += size
+            stats.account(action, path, size, destination)
+        print(f"{session.__name__:20} summed sizes {format_size(summed):>10}   "
+              f"deltas: added {format_size(stats.added):>10}, removed {format_size(stats.removed):>10}")
+
+    stats = TransferStats('E:')
+    extensions = ('.docx', '.pdf', '.jpg', '.mp4', '.zip', '')
+    start = time.perf_counter()
+    for i in range(events):
+        path = f'E:\\folder_{i % 40}\\sub\\file_{i % 50_000}{extensions[i % len(extensions)]}'
+        stats.account(Action.MODIFIED if i % 7 else Action.DELETED, path, 1000 + i % 5000)
+    seconds = time.perf_counter() - start
+    print(f"{events} events over {len(stats.extensions)} extensions and {len(stats.folders)} folders: "
+          f"{seconds * 1e6 / events:.2f} us/event")
+
+
+if __name__ == '__main__':
+    main()
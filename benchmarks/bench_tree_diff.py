@@ -0,0 +1,101 @@
+"""
+Structural snapshot diff against the old difflib comparison.
+
+Usage: python benchmarks/bench_tree_diff.py [entries] [difflib entries]
+Builds two in-memory manifests of ``entries`` rows that differ by about one
+percent (resized, touched, renamed, removed and added files) and times
+``snapshot_diff.diff_manifests`` on them. difflib over the rendered trees is
+timed on a smaller pair because it does not finish in reasonable time on large
+ones.
+"""
+import difflib
+import sys
+import time
+
+import synthetic  # noqa: F401  (puts the repository on sys.path)
+
+from manifest import Manifest, FLAG_DIR, FLAG_LAST
+from snapshot_diff import diff_manifests
+
+
+def build_manifest(entries, changed, files_per_dir=50, dirs_per_dir=5):
+    """ Same shape as synthetic.build_tree; ``changed`` alters every 100th file. """
+    folders = [[]]  # folder number -> children (name, size, mtime, folder number or None)
+    queue = [0]
+    created = 0
+    while queue and created < entries:
+        children = folders[queue.pop(0)]
+        for i in range(files_per_dir):
+            if created >= entries:
+                break
+            name, size, mtime = f"file_{i:04d}.dat", 1000 + created, 1_700_000_000_000_000_000
+            created += 1
+            if changed and created % 100 == 0:
+                kind = created // 100 % 5
+                if kind == 0:
+                    size += 1
+                elif kind == 1:
+                    mtime += 1
+                elif kind == 2:
+                    name = f"renamed_{i:04d}.dat"
+                elif kind == 3:
+                    continue
+                else:
+                    name = f"added_{i:04d}.dat"
+                    size = 1
+            children.append((name, size, mtime, None))
+        for i in range(dirs_per_dir):
+            if created >= entries:
+                break
+            folders.append([])
+            queue.append(len(folders) - 1)
+            children.append((f"dir_{i:03d}", 0, 0, len(folders) - 1))
+            created += 1
+
+    # Rows are stored in depth-first order, like scan_drive produces them
+    manifest = Manifest('/bench')
+    manifest.add(-1, 'bench', len(folders[0]), 0, FLAG_DIR | FLAG_LAST)
+    stack = [(0, iter(enumerate(folders[0])), len(folders[0]) - 1)]
+    while stack:
+        parent, children, last = stack[-1]
+        for index, (name, size, mtime, folder) in children:
+            flags = FLAG_LAST if index == last else 0
+            if folder is None:
+                manifest.add(parent, name, size, mtime, flags)
+                continue
+            row = manifest.add(parent, name, len(folders[folder]), mtime, flags | FLAG_DIR)
+            stack.append((row, iter(enumerate(folders[folder])), len(folders[folder]) - 1))
+            break
+        else:
+            stack.pop()
+    return manifest
+
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    small = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+
+    old, new = build_manifest(entries, False), build_manifest(entries, True)
+    start = time.perf_counter()
+    changes = diff_manifests(old, new)
+    seconds = time.perf_counter() - start
+    kinds = {}
+    for change in changes:
+        kinds[change.kind] = kinds.get(change.kind, 0) + 1
+    print(f"diff_manifests: {len(old)} vs {len(new)} entries in {seconds:.2f}s, "
+          f"{len(changes)} changes {kinds}")
+
+    old, new = build_manifest(small, False), build_manifest(small, True)
+    start = time.perf_counter()
+    changes = diff_manifests(old, new)
+    structural = time.perf_counter() - start
+    text1, text2 = old.tree_text(), new.tree_text()
+    start = time.perf_counter()
+    lines = list(difflib.unified_diff(text1.splitlines(), text2.splitlines(), lineterm=''))
+    unified = time.perf_counter() - start
+    print(f"{len(old)} entries: diff_manifests {structural:.3f}s ({len(changes)} changes), "
+          f"difflib {unified:.3f}s ({len(lines)} lines)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Compare the streaming ``utils.write_tree`` walker with the original recursive
+string-concatenating ``print_tree``.
+
+Usage: python benchmarks/bench_tree_walk.py [entries ...]
+Default sizes are 10k, 100k and 1M entries. The legacy walker is quadratic,
+so it is only timed up to LEGACY_LIMIT entries.
+"""
+import io
+import os
+import sys
+import time
+
+from synthetic import build_tree, temporary_drive, parse_sizes
+
+import utils
+
+LEGACY_LIMIT = 200_000
+
+
+def legacy_print_tree(directory, tree, indent='', last=True):
+    # Verbatim copy of the pre-streaming implementation, used as the reference.
+    tree += indent
+    if last:
+        tree += '└── '
+        indent += '    '
+    else:
+        tree += '├── '
+        indent += '│   '
+    tree += os.path.basename(directory) + '\n'
+    contents = os.listdir(directory)
+    for i, item in enumerate(contents):
+        item_path = os.path.join(directory, item)
+        is_last = (i == len(contents) - 1)
+        if os.path.isdir(item_path):
+            if "System Volume Information" in item_path:
+                continue
+            tree = legacy_print_tree(item_path, tree, indent, is_last)
+        else:
+            tree += indent
+            if is_last:
+                tree += '└── '
+            else:
+                tree += '├── '
+            tree += item + "\n"
+    return tree
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    sizes = parse_sizes(sys.argv, [10_000, 100_000, 1_000_000])
+    print(f"{'entries':>10} {'legacy s':>10} {'stream s':>10} {'stream us/entry':>16} {'identical':>10}")
+    for size in sizes:
+        with temporary_drive() as root:
+            build_tree(root, size)
+
+            buffer = io.StringIO()
+            _, stream_seconds = timed(utils.write_tree, root, buffer.write, '', True)
+            streamed = root + '\n' + buffer.getvalue()
+
+            legacy_seconds = float('nan')
+            identical = '-'
+            if size <= LEGACY_LIMIT:
+                legacy, legacy_seconds = timed(legacy_print_tree, root, root + '\n')
+                identical = 'yes' if legacy == streamed == utils.print_tree(root, root + '\n') else 'NO'
+
+            print(f"{size:>10} {legacy_seconds:>10.3f} {stream_seconds:>10.3f} "
+                  f"{stream_seconds / size * 1e6:>16.2f} {identical:>10}")
+
+
+if __name__ == '__main__':
+    main()
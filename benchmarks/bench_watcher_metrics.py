@@ -0,0 +1,80 @@
+"""
+Cost of the per-drive watcher metrics, and what a snapshot shows.
+
+Usage: python benchmarks/bench_watcher_metrics.py [events] [stat workers]
+Dispatches create and modify events for files in a temporary folder to
+USBEventHandler the way the observer thread does, once with the metrics the
+handler keeps and once with counters that do nothing, and reports the time
+per event from dispatch until the event is logged. Then prints the snapshot
+of the measured run, with its latency histogram, and the time a snapshot
+takes.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import synthetic  # noqa: F401  (puts the repository on sys.path)
+
+from watchdog.events import FileCreatedEvent, FileModifiedEvent
+
+from log_watcher import USBEventHandler
+from watcher_metrics import DriveMetrics, describe
+
+
+class NoMetrics(DriveMetrics):
+    def delivered_event(self, timestamp):
+        pass
+
+
+def run(paths, workers, metrics):
+    handler = USBEventHandler(stat_workers=workers, quiet_window=0.5)
+    handler.metrics = metrics
+    start = time.perf_counter()
+    for path in paths:
+        handler.dispatch(FileCreatedEvent(path))
+        handler.dispatch(FileModifiedEvent(path))
+    handler.stats.sync()
+    seconds = time.perf_counter() - start
+    snapshot = handler.snapshot()
+    handler.close()
+    return seconds / (2 * len(paths)), handler, snapshot
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    root = tempfile.mkdtemp()
+    paths = []
+    for i in range(count):
+        folder = os.path.join(root, f'folder_{i % 40}')
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f'file_{i}.bin')
+        with open(path, 'wb') as f:
+            f.write(b'x' * (i % 5000))
+        paths.append(path)
+    print(f"{count * 2} events, {workers} stat workers")
+
+    # alternate the two so neither gets the warmer caches
+    timings = {'metrics': [], 'no metrics': []}
+    for _ in range(5):
+        timings['no metrics'].append(run(paths, workers, NoMetrics())[0])
+        per_event, handler, snapshot = run(paths, workers, DriveMetrics())
+        timings['metrics'].append(per_event)
+    for name, values in timings.items():
+        print(f"  {name:10}  {min(values) * 1e6:6.2f} us per event from dispatch to the coalescer")
+    print(f"  overhead    {(min(timings['metrics']) - min(timings['no metrics'])) * 1e6:6.2f} us per event")
+
+    print(describe(root, snapshot))
+    print("  latency buckets (below us: events): "
+          + ", ".join(f"{bound}: {events}" for bound, events in snapshot['latency']['buckets'].items()))
+    start = time.perf_counter()
+    for _ in range(1000):
+        handler.snapshot()
+    print(f"  a snapshot takes {(time.perf_counter() - start) * 1e3:.1f} us")
+    shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
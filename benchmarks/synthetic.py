@@ -0,0 +1,61 @@
+"""
+Helpers for building synthetic drive trees used by the benchmark scripts.
+
+Run the benchmarks from the repository root, e.g.::
+
+    python benchmarks/bench_tree_walk.py
+"""
+import os
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+def build_tree(root, entries, files_per_dir=50, dirs_per_dir=5):
+    """
+    Populate ``root`` with roughly ``entries`` empty files and directories.
+
+    Directories are filled breadth-first, ``files_per_dir`` files and
+    ``dirs_per_dir`` sub-directories at a time, which gives a tree shaped like
+    a typical document/photo stick.
+    """
+    created = 0
+    queue = [root]
+    while queue and created < entries:
+        directory = queue.pop(0)
+        for i in range(files_per_dir):
+            if created >= entries:
+                return created
+            open(os.path.join(directory, f"file_{i:04d}.dat"), "wb").close()
+            created += 1
+        for i in range(dirs_per_dir):
+            if created >= entries:
+                return created
+            child = os.path.join(directory, f"dir_{i:03d}")
+            os.mkdir(child)
+            queue.append(child)
+            created += 1
+    return created
+
+
+def build_wide_tree(root, entries):
+    """ Many top-level folders, each shallow. """
+    return build_tree(root, entries, files_per_dir=20, dirs_per_dir=200)
+
+
+def build_deep_tree(root, entries):
+    """ Few folders per level, many levels. """
+    return build_tree(root, entries, files_per_dir=10, dirs_per_dir=2)
+
+
+def temporary_drive():
+    return tempfile.TemporaryDirectory(prefix="usb_bench_")
+
+
+def parse_sizes(argv, default):
+    if len(argv) > 1:
+        return [int(arg.replace("_", "")) for arg in argv[1:]]
+    return default
@@ -0,0 +1,182 @@
+"""
+Coalescing of raw watcher events into net file operations.
+
+Copying one large file fires a create and then a modify for every chunk
+written, and editors save through temporary files that are created,
+written, renamed and deleted within a second. ``Coalescer`` keeps one
+pending entry per path and only passes the net result on once the path has
+been quiet for ``window`` seconds:
+
+* any number of modifies (and the create before them) become one event with
+  the final size,
+* rename chains collapse into a single move from the original path,
+* a file created and deleted inside the window disappears altogether.
+
+Directory events are passed on as they come, after everything pending
+inside the directory, so the emitted order can still be replayed.
+
+The watcher cannot tell whether a move overwrote a file it has not seen
+during the window, so such destinations are taken to be new. Moving a file
+over an untouched one and then on again within the window therefore loses
+the overwritten file's removal.
+"""
+import os
+import time
+from collections import OrderedDict
+
+from file_events import Action
+
+# Seconds a path has to stay quiet before its events are emitted
+QUIET_WINDOW = 2.0
+
+
+class _Pending:
+    __slots__ = ('origin', 'kind', 'size', 'last', 'replaced')
+
+    def __init__(self, origin, kind, size, last):
+        self.origin = origin  # path before the window, None if created in it
+        self.kind = kind  # CREATED, MODIFIED, DELETED or None for a plain move
+        self.size = size
+        self.last = last  # timestamp of the latest event
+        self.replaced = False  # moved over a path that may already have existed
+
+
+class Coalescer:
+    """ Merges raw events per path and passes net events to ``emit(action, path, size, destination, timestamp)``. """
+
+    def __init__(self, emit, window=QUIET_WINDOW):
+        self.emit = emit
+        self.window = window
+        self.pending = OrderedDict()  # path -> _Pending, least recently touched first
+        self.moved_from = {}  # origin -> path of pending entries that left their origin
+        self.raw = 0
+        self.emitted = 0
+
+    @property
+    def reduction(self):
+        """ Share of raw events that never had to be logged. """
+        return 1 - self.emitted / self.raw if self.raw else 0.0
+
+    def add(self, action, path, size=None, destination=None, is_directory=False, timestamp=None):
+        now = time.time() if timestamp is None else timestamp
+        self.raw += 1
+        self.flush(now)
+        if is_directory or action == Action.CREATED_DIRECTORY:
+            self._directory(action, path, destination, now)
+        elif action == Action.MOVED:
+            self._moved(path, destination, now)
+        elif action == Action.DELETED:
+            self._deleted(path, now)
+        else:
+            self._written(action, path, size, now)
+
+    def flush(self, now=None, force=False):
+        """ Emit every entry quiet for the whole window, or everything with ``force``. """
+        pending = self.pending
+        deadline = (time.time() if now is None else now) - self.window
+        while pending:
+            path, entry = next(iter(pending.items()))
+            if not force and entry.last > deadline:
+                break
+            self._emit(path, self._take(path))
+
+    def _take(self, path):
+        entry = self.pending.pop(path, None)
+        if entry is not None and entry.origin is not None and entry.origin != path:
+            del self.moved_from[entry.origin]
+        return entry
+
+    def _put(self, path, entry):
+        self.pending[path] = entry
+        if entry.origin is not None and entry.origin != path:
+            self.moved_from[entry.origin] = path
+
+    def _vacate(self, path):
+        # A pending move or delete away from ``path`` must be logged before anything new lands there
+        moved = self.moved_from.get(path)
+        if moved is not None:
+            self._emit(moved, self._take(moved))
+
+    def _written(self, action, path, size, now):
+        entry = self._take(path)
+        self._vacate(path)
+        if entry is not None and entry.kind == Action.DELETED:
+            if entry.origin == path:
+                # deleted and written again: the file was replaced
+                entry = _Pending(path, Action.MODIFIED, size, now)
+            else:
+                self._emit(path, entry)
+                entry = None
+        if entry is None:
+            entry = _Pending(None if action == Action.CREATED else path, action, size, now)
+        else:
+            if entry.kind is None:
+                entry.kind = Action.MODIFIED
+            if size is not None:
+                entry.size = size
+            entry.last = now
+        self._put(path, entry)
+
+    def _deleted(self, path, now):
+        entry = self._take(path)
+        if entry is None:
+            entry = _Pending(path, Action.DELETED, None, now)
+        elif entry.origin is None and not entry.replaced:
+            return  # created and deleted within the window
+        else:
+            entry.kind = Action.DELETED
+            entry.size = None
+            entry.last = now
+        self._put(path, entry)
+
+    def _moved(self, source, destination, now):
+        entry = self._take(source)
+        if entry is not None and entry.replaced:
+            # whatever the entry overwrote at the source is gone now
+            self._output(Action.DELETED, source, None, None, now)
+        replaced = self._take(destination)
+        self._vacate(destination)
+        if (replaced is not None and replaced.kind == Action.DELETED and replaced.origin == destination
+                and entry is not None and entry.kind == Action.CREATED):
+            # saved through a temporary file: the original was rewritten
+            self._put(destination, _Pending(destination, Action.MODIFIED, entry.size, now))
+            return
+        if replaced is not None:
+            self._emit(destination, replaced)
+        if entry is None:
+            entry = _Pending(source, None, None, now)
+        if replaced is None and entry.origin == destination and entry.kind is None:
+            return  # renamed back to where it started
+        # a destination not seen in the window is taken to be new (see the module docstring)
+        entry.replaced = replaced is not None and replaced.kind != Action.DELETED
+        entry.last = now
+        self._put(destination, entry)
+
+    def _directory(self, action, path, destination, now):
+        # Whatever is pending in (or was moved out of) the directory has to come first
+        prefixes = tuple(folder.rstrip('\\/') + os.sep for folder in (path, destination) if folder)
+        folders = (path, destination)
+        for pending_path in [pending_path for pending_path, entry in self.pending.items()
+                             if pending_path in folders or pending_path.startswith(prefixes)
+                             or (entry.origin is not None
+                                 and (entry.origin in folders or entry.origin.startswith(prefixes)))]:
+            self._emit(pending_path, self._take(pending_path))
+        self._output(action, path, None, destination, now)
+
+    def _emit(self, path, entry):
+        if entry.kind == Action.DELETED:
+            if entry.origin is not None:
+                self._output(Action.DELETED, entry.origin, None, None, entry.last)
+            if entry.replaced and entry.origin != path:
+                self._output(Action.DELETED, path, None, None, entry.last)
+        elif entry.kind == Action.CREATED:
+            self._output(Action.CREATED, path, entry.size, None, entry.last)
+        else:
+            if entry.origin != path:
+                self._output(Action.MOVED, entry.origin, None, path, entry.last)
+            if entry.kind == Action.MODIFIED:
+                self._output(Action.MODIFIED, path, entry.size, None, entry.last)
+
+    def _output(self, action, path, size, destination, timestamp):
+        self.emitted += 1
+        self.emit(action, path, size, destination, timestamp)
@@ -0,0 +1,22 @@
+# Add the snapshots and activity logs of an existing database to the file index.
+# Run from the project folder: python -m database.build_file_index
+import time
+
+from database import crud
+from database.db import create_db_and_tables, get_db
+
+
+def build_index():
+    create_db_and_tables()
+    db = get_db()
+    start = time.perf_counter()
+    try:
+        snapshots, detections = crud.build_file_index(db)
+    finally:
+        db.close()
+    seconds = time.perf_counter() - start
+    print(f"Indexed {snapshots} snapshots and the activity of {detections} detections in {seconds:.2f}s")
+
+
+if __name__ == '__main__':
+    build_index()
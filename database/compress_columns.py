@@ -0,0 +1,28 @@
+# Compress the snapshot and log columns of an existing database in place.
+# Run from the project folder: python -m database.compress_columns
+import os
+import time
+
+from database import crud
+from database.db import create_db_and_tables
+
+DATABASE_FILE = "database.sqlite"
+
+
+def compress_database():
+    create_db_and_tables()
+    size_before = os.path.getsize(DATABASE_FILE)
+    start = time.perf_counter()
+    rows, before, after = crud.compress_detection_columns()
+    seconds = time.perf_counter() - start
+    with crud.engine.connect() as conn:
+        conn.exec_driver_sql("VACUUM")
+    size_after = os.path.getsize(DATABASE_FILE)
+
+    print(f"Compressed {rows} detections in {seconds:.2f}s")
+    print(f"Column data: {before / 1024 ** 2:.2f} MB -> {after / 1024 ** 2:.2f} MB")
+    print(f"{DATABASE_FILE}: {size_before / 1024 ** 2:.2f} MB -> {size_after / 1024 ** 2:.2f} MB")
+
+
+if __name__ == '__main__':
+    compress_database()
@@ -2,13 +2,114 @@ import hashlib
 from datetime import datetime, timedelta
 from typing import Optional, Sequence
 
-from sqlmodel import select, desc, func
+from sqlalchemy import update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import defer
+from sqlmodel import select, desc, func, text
 
 import utils
-from .db import Session, get_db, archive_db
+from file_events import EventLog, TransferStats
+from file_index import activity_paths, manifest_paths, name_of, parse_query
+from manifest import Manifest
+from .db import Session, get_db, archive_db, engine
 from . import models
 from .models import UserRegister
 
+SNAPSHOT_PENDING = 'pending'
+SNAPSHOT_COMPLETE = 'complete'
+SNAPSHOT_TRUNCATED = 'truncated'
+
+# Listings never need the (compressed) snapshot and log columns
+_DEFER_CONTENTS = (defer(models.DetectedDevice.tree), defer(models.DetectedDevice.logs),
+                   defer(models.DetectedDevice.manifest))
+
+
+def acquire_snapshot(db: Session, manifest, index: bool = True) -> Optional[str]:
+    """
+    Store ``manifest`` once under its SHA-256 and take a reference to it.
+
+    With ``index`` the snapshot's entries are added to the file index (once
+    per snapshot); partial snapshots of a scan in progress are not indexed.
+    """
+    if not manifest:
+        return None
+    snapshot_hash = hashlib.sha256(manifest).hexdigest()
+    snapshot = db.get(models.Snapshot, snapshot_hash)
+    if snapshot is None:
+        snapshot = models.Snapshot(hash=snapshot_hash, manifest=manifest, size=len(manifest), ref_count=0)
+    snapshot.ref_count += 1
+    db.add(snapshot)
+    if index:
+        index_snapshot(db, snapshot_hash, manifest)
+    return snapshot_hash
+
+
+def release_snapshot(db: Session, snapshot_hash: Optional[str]):
+    """ Drop a reference to a stored snapshot, deleting it with its last reference. """
+    if not snapshot_hash:
+        return
+    snapshot = db.get(models.Snapshot, snapshot_hash)
+    if snapshot is None:
+        return
+    snapshot.ref_count -= 1
+    if snapshot.ref_count <= 0:
+        unindex_snapshot(db, snapshot_hash)
+        db.delete(snapshot)
+    else:
+        db.add(snapshot)
+
+
+def _index_paths(db: Session, paths, table: str, column: str, owner_id: int):
+    """
+    Add (owner, path) postings to ``table`` for index ``paths``.
+
+    Names and paths are interned with set-based statements over a temporary
+    batch table, so a whole snapshot costs a handful of queries.
+    """
+    rows = [{'path': path, 'name': name_of(path)} for path in paths]
+    if not rows:
+        return
+    db.execute(text('CREATE TEMP TABLE IF NOT EXISTS index_batch (path TEXT PRIMARY KEY, name TEXT)'))
+    db.execute(text('DELETE FROM index_batch'))
+    db.execute(text('INSERT OR IGNORE INTO index_batch (path, name) VALUES (:path, :name)'), rows)
+    db.execute(text('INSERT OR IGNORE INTO file_names (name) SELECT DISTINCT name FROM index_batch'))
+    db.execute(text('INSERT OR IGNORE INTO file_paths (path, name_id) '
+                    'SELECT b.path, n.id FROM index_batch b JOIN file_names n ON n.name = b.name'))
+    db.execute(text(f'INSERT OR IGNORE INTO {table} ({column}, path_id) '
+                    'SELECT :owner, p.id FROM index_batch b JOIN file_paths p ON p.path = b.path'),
+               {'owner': owner_id})
+    db.execute(text('DELETE FROM index_batch'))
+
+
+def index_snapshot(db: Session, snapshot_hash: str, manifest):
+    """ Add the entries of a stored snapshot to the file index, unless already there. """
+    query = select(models.IndexedSnapshot.id).where(models.IndexedSnapshot.snapshot_hash == snapshot_hash)
+    if db.exec(query).first() is not None:
+        return
+    indexed = models.IndexedSnapshot(snapshot_hash=snapshot_hash)
+    db.add(indexed)
+    db.flush()
+    _index_paths(db, manifest_paths(Manifest.from_bytes(manifest)), 'snapshot_files', 'snapshot_id', indexed.id)
+
+
+def unindex_snapshot(db: Session, snapshot_hash: str):
+    query = select(models.IndexedSnapshot).where(models.IndexedSnapshot.snapshot_hash == snapshot_hash)
+    indexed = db.exec(query).first()
+    if indexed is None:
+        return
+    db.execute(text('DELETE FROM snapshot_files WHERE snapshot_id = :id'), {'id': indexed.id})
+    db.delete(indexed)
+
+
+def index_detection_activity(db: Session, detection_id: int, paths):
+    """ Add the paths a detection's activity log touched to the file index. """
+    _index_paths(db, paths, 'detection_files', 'detection_id', detection_id)
+
+
+def get_detection_activity_paths(db: Session, detection_id: int):
+    return db.execute(text('SELECT p.path FROM detection_files d JOIN file_paths p ON p.id = d.path_id '
+                           'WHERE d.detection_id = :id'), {'id': detection_id}).scalars().all()
+
 
 def copy_instance(instance):
     """ Create a new instance of the given SQLModel instance. """
@@ -68,6 +169,20 @@ def archive(path, days, delete_old, update_progress, process_finished):
         copy_and_emit_progress(connected_device_data, connected_device_data_copy)
         copy_and_emit_progress(user_register_data, user_register_data_copy)
 
+        # Archived detections take their own references in the archive's snapshot store
+        # and carry their file index postings along
+        for record, copy in zip(detected_device_data, detected_device_data_copy):
+            if record.snapshot_hash:
+                snapshot = db.get(models.Snapshot, record.snapshot_hash)
+                if snapshot is not None:
+                    acquire_snapshot(ar_db, snapshot.manifest)
+                else:
+                    # archived without a snapshot rather than pointing at one the archive lacks
+                    print(f"archive give Error: snapshot {record.snapshot_hash} of detection {record.id} "
+                          f"is missing, archived without it")
+                    copy.snapshot_hash = None
+            index_detection_activity(ar_db, record.id, get_detection_activity_paths(db, record.id))
+            save_file_events(ar_db, record.id, get_file_events(record.id, db))
         ar_db.add_all(detected_device_data_copy)
         ar_db.add_all(connected_device_data_copy)
         ar_db.add_all(user_register_data_copy)
@@ -82,6 +197,10 @@ def archive(path, days, delete_old, update_progress, process_finished):
         print(f"Archived User Register Data: {len(archived_user_data)} records")
 
         if delete_old:
+            for record in detected_device_data:
+                release_snapshot(db, record.snapshot_hash)
+                db.execute(text('DELETE FROM detection_files WHERE detection_id = :id'), {'id': record.id})
+                db.execute(text('DELETE FROM file_events WHERE detection_id = :id'), {'id': record.id})
             delete_old_records(detected_device_data)
             delete_old_records(connected_device_data)
             delete_old_records(user_register_data)
@@ -213,18 +332,177 @@ def get_connected_dv_by_serial_number(db: Session, serial_number: str):
     return db.exec(query).first()
 
 
-def update_removal_time(serial_number, removal_time, logs):
+def get_last_manifest(serial_number: str):
+    """ Manifest bytes of the most recent detection of this serial number, if any. """
+    db: Session = get_db()
+
+    try:
+        query = (
+            select(models.Snapshot.manifest, models.DetectedDevice.manifest)
+            .select_from(models.DetectedDevice)
+            .outerjoin(models.Snapshot, models.Snapshot.hash == models.DetectedDevice.snapshot_hash)
+            .where((models.DetectedDevice.serial_number == serial_number) &
+                   ((models.DetectedDevice.snapshot_hash != None) | (models.DetectedDevice.manifest != None)) &
+                   ((models.DetectedDevice.snapshot_status == None) |
+                    (models.DetectedDevice.snapshot_status == SNAPSHOT_COMPLETE)))
+            .order_by(desc(models.DetectedDevice.insertion_time))
+        )
+        row = db.exec(query).first()
+        return (row[0] or row[1]) if row else None
+    except Exception as e:
+        print("get_last_manifest from db give Error: ", str(e))
+        return None
+
+    finally:
+        db.close()
+
+
+def update_snapshot(detection_id: int, manifest, snapshot_status: str):
+    """ Store a (possibly partial) snapshot for a detection recorded earlier. """
+    db: Session = get_db()
+
+    try:
+        detected_device: models.DetectedDevice = db.get(models.DetectedDevice, detection_id)
+        previous_hash = detected_device.snapshot_hash
+        detected_device.snapshot_hash = acquire_snapshot(db, manifest, snapshot_status != SNAPSHOT_PENDING)
+        release_snapshot(db, previous_hash)
+        detected_device.snapshot_status = snapshot_status
+        db.add(detected_device)
+        db.commit()
+    except Exception as e:
+        print("update_snapshot in to db give Error: ", str(e))
+
+    finally:
+        db.close()
+
+
+def set_snapshot_status(detection_id: int, snapshot_status: str):
+    """ Finish a background snapshot with the last checkpoint it stored, if any. """
+    db: Session = get_db()
+
+    try:
+        detected_device: models.DetectedDevice = db.get(models.DetectedDevice, detection_id)
+        snapshot = db.get(models.Snapshot, detected_device.snapshot_hash) if detected_device.snapshot_hash else None
+        if snapshot is not None and snapshot_status != SNAPSHOT_PENDING:
+            index_snapshot(db, snapshot.hash, snapshot.manifest)
+        detected_device.snapshot_status = snapshot_status
+        db.add(detected_device)
+        db.commit()
+    except Exception as e:
+        print("set_snapshot_status in to db give Error: ", str(e))
+
+    finally:
+        db.close()
+
+
+def get_file_hashes(serial_number: str, algorithm: str):
+    """ Cached hashes of a drive as {path: (size, mtime, digest)}. """
+    db: Session = get_db()
+
+    try:
+        query = select(models.FileHash).where((models.FileHash.serial_number == serial_number) &
+                                              (models.FileHash.algorithm == algorithm))
+        return {row.path: (row.size, row.mtime, row.digest) for row in db.exec(query)}
+    except Exception as e:
+        print("get_file_hashes from db give Error: ", str(e))
+        return {}
+
+    finally:
+        db.close()
+
+
+def save_file_hashes(serial_number: str, algorithm: str, hashes, detection_id=None):
+    """ Insert or refresh the cached hashes of a drive in one transaction. """
+    if not hashes:
+        return
+    db: Session = get_db()
+
+    try:
+        rows = [dict(serial_number=serial_number, path=path, algorithm=algorithm, size=size, mtime=mtime,
+                     digest=digest, detection_id=detection_id)
+                for path, (size, mtime, digest) in hashes.items()]
+        statement = sqlite_insert(models.FileHash)
+        statement = statement.on_conflict_do_update(
+            index_elements=['serial_number', 'path', 'algorithm'],
+            set_=dict(size=statement.excluded.size, mtime=statement.excluded.mtime,
+                      digest=statement.excluded.digest, detection_id=statement.excluded.detection_id))
+        db.execute(statement, rows)
+        db.commit()
+    except Exception as e:
+        print("save_file_hashes in to db give Error: ", str(e))
+
+    finally:
+        db.close()
+
+
+def save_file_events(db: Session, detection_id: int, events: EventLog, start: int = 0, stop: int = None):
+    """ Bulk insert events ``start`` up to ``stop`` of a drive session into file_events, a batch at a time. """
+    insert = models.FileEvent.__table__.insert()
+    for rows in events.row_batches(detection_id, start=start, stop=stop):
+        db.execute(insert, rows)
+
+
+def file_event_cursor(db: Session, detection_id: int) -> int:
+    """ How many events of a detection file_events holds, i.e. the sequence number of the next one. """
+    query = select(func.max(models.FileEvent.sequence)).where(models.FileEvent.detection_id == detection_id)
+    last = db.exec(query).one()
+    return 0 if last is None else last + 1
+
+
+def get_file_events(detection_id: int, db: Session) -> EventLog:
+    query = (select(models.FileEvent.timestamp, models.FileEvent.action, models.FileEvent.path,
+                    models.FileEvent.size, models.FileEvent.destination, models.FileEvent.reconciled)
+             .where(models.FileEvent.detection_id == detection_id)
+             .order_by(models.FileEvent.sequence))
+    return EventLog.from_rows(db.exec(query).all())
+
+
+def save_transfer_summary(db: Session, detection_id: int, summary: dict):
+    db.execute(update(models.DetectedDevice).where(models.DetectedDevice.id == detection_id)
+               .values(transfers=summary))
+
+
+def save_activity_summary(db: Session, detection_id: int, activity: dict):
+    db.execute(update(models.DetectedDevice).where(models.DetectedDevice.id == detection_id)
+               .values(activity=activity))
+
+
+def get_transfer_summary(detection_id: int, db: Session) -> dict:
+    """ Stored TransferStats summary of a detection, worked out from its events for older rows. """
+    pc = db.get(models.DetectedDevice, detection_id)
+    if pc.transfers is not None:
+        return pc.transfers
+    return TransferStats.of(_detection_events(pc, db).records()).summary()
+
+
+def update_removal_time(serial_number, removal_time, events, root=None, transfers=None, activity=None):
+    """
+    Close the open detection of a drive; ``events`` is its EventLog (log text from older callers),
+    ``transfers`` the watcher's TransferStats and ``activity`` its USBEventHandler.activity().
+    """
     # Create a database session
     db: Session = get_db()
 
     try:
         detected_device: models.DetectedDevice = get_detected_dv_by_serial_number(db=db, serial_number=serial_number)
         detected_device.removal_time = removal_time
-        detected_device.logs = logs
+        if isinstance(events, str):
+            detected_device.logs = events
+        else:
+            # whatever the flusher wrote while the drive was connected is already there
+            save_file_events(db, detected_device.id, events, events.flushed)
+        if transfers is not None:
+            detected_device.transfers = transfers.summary()
+        if activity is not None:
+            detected_device.activity = activity
 
         # update the existing record
         db.merge(detected_device)
+        # Files touched while the drive was connected go into the file index
+        index_detection_activity(db, detected_device.id, activity_paths(events, root))
         db.commit()
+        if not isinstance(events, str):
+            events.discard()
     except Exception as e:
         print("update_removal_time in to db give Error: ", str(e))
 
@@ -248,9 +526,11 @@ def register_usb(serial_number: str, db: Session):
         print("Error registering USB:", str(e))
 
 
-def add_or_update_detected_pc(device, serial_number, tree, insertion_time):
+def add_or_update_detected_pc(device, serial_number, manifest, insertion_time, snapshot_status=SNAPSHOT_COMPLETE):
+    """ Record a detection and return its id (None if it could not be stored). """
     # Create a database session
     db: Session = get_db()
+    detection_id = None
 
     try:
         connected_device: models.ConnectedDevice = get_connected_dv_by_serial_number(db=db, serial_number=serial_number)
@@ -268,11 +548,16 @@ def add_or_update_detected_pc(device, serial_number, tree, insertion_time):
 
             also_add_into_detection: models.DetectedDevice = models.DetectedDevice(serial_number=serial_number,
                                                                                    device=device,
-                                                                                   tree=tree,
+                                                                                   tree='',
+                                                                                   snapshot_hash=acquire_snapshot(
+                                                                                       db, manifest,
+                                                                                       snapshot_status != SNAPSHOT_PENDING),
+                                                                                   snapshot_status=snapshot_status,
                                                                                    insertion_time=insertion_time, )
             db.add(also_add_into_detection)
             db.commit()
             db.refresh(also_add_into_detection)
+            detection_id = also_add_into_detection.id
             print("\nNew Unique recorde stored in db success...\n")
         else:
             query = select(models.DetectedDevice).where(models.DetectedDevice.serial_number == serial_number)
@@ -280,12 +565,17 @@ def add_or_update_detected_pc(device, serial_number, tree, insertion_time):
 
             detection: models.DetectedDevice = models.DetectedDevice(serial_number=serial_number,
                                                                      device=device,
-                                                                     tree=tree,
+                                                                     tree='',
+                                                                     snapshot_hash=acquire_snapshot(
+                                                                         db, manifest,
+                                                                         snapshot_status != SNAPSHOT_PENDING),
+                                                                     snapshot_status=snapshot_status,
                                                                      insertion_time=insertion_time,
                                                                      is_registered=usb.is_registered)
             db.add(detection)
             db.commit()
             db.refresh(detection)
+            detection_id = detection.id
             print("\nNew Detection stored in db success...\n")
 
     except Exception as e:
@@ -294,6 +584,8 @@ def add_or_update_detected_pc(device, serial_number, tree, insertion_time):
     finally:
         db.close()
 
+    return detection_id
+
 
 def print_detected_pcs():
     # Create a database session
@@ -335,36 +627,138 @@ def print_detected_pcs():
     # print("=" * 60)
 
 
+def _detection_info(pc: models.DetectedDevice):
+    device = pc.device
+    return {
+        # "Insertion Time": pc.insertion_time.strftime("%m/%d/%Y - %I:%M:%S.%f %p"),
+        "Insertion Time": pc.insertion_time.strftime("%m/%d/%Y - %I:%M %p"),
+        "Removal Time": pc.removal_time.strftime("%m/%d/%Y - %I:%M %p") if pc.removal_time else '',
+        "Serial Number": device['SerialNumber'],
+        "Device Display Name": device['display_name'],
+        "Device Manufacture Name": device['Caption'],
+        "Device Connect Through": device['InterfaceType'],
+        "Type of Storage": device['MediaType'],
+        "Storage Capacity": device['total_size'],
+        "Free Space": device['free_space'],
+        "Used Space": device['used_space'],
+        "Specific version or Model of the drive": device['Model'],
+        "Drive Status": device['Status'],
+        "number of partitions": device['Partitions'],
+        "Capabilities of the drive": device['CapabilityDescriptions'],
+        "Manufacture": device['Manufacturer'],
+        "FirmwareRevision": device['FirmwareRevision'],
+        "Snapshot Status": pc.snapshot_status,
+    }
+
+
 def get_device_from_db(serial_number: str, db: Session):
     # Retrieve entries from the database based on the specified serial_number
-    detected_devices = db.query(models.DetectedDevice).filter_by(serial_number=serial_number).all()
+    detected_devices = (db.query(models.DetectedDevice).filter_by(serial_number=serial_number)
+                        .options(*_DEFER_CONTENTS).all())
     formatted_data = []
 
     for pc in detected_devices:
-        device = pc.device
-        single_drive_info = {
-            # "Insertion Time": pc.insertion_time.strftime("%m/%d/%Y - %I:%M:%S.%f %p"),
-            "Insertion Time": pc.insertion_time.strftime("%m/%d/%Y - %I:%M %p"),
-            "Removal Time": pc.removal_time.strftime("%m/%d/%Y - %I:%M %p"),
-            "Serial Number": device['SerialNumber'],
-            "Device Display Name": device['display_name'],
-            "Device Manufacture Name": device['Caption'],
-            "Device Connect Through": device['InterfaceType'],
-            "Type of Storage": device['MediaType'],
-            "Storage Capacity": device['total_size'],
-            "Free Space": device['free_space'],
-            "Used Space": device['used_space'],
-            "Specific version or Model of the drive": device['Model'],
-            "Drive Status": device['Status'],
-            "number of partitions": device['Partitions'],
-            "Capabilities of the drive": device['CapabilityDescriptions'],
-            "Manufacture": device['Manufacturer'],
-            "FirmwareRevision": device['FirmwareRevision'],
-        }
-        formatted_data.append((single_drive_info, pc.tree, pc.logs))
+        # Tree and logs are loaded by get_detection_contents when the detail view opens
+        formatted_data.append((_detection_info(pc), pc.id))
     return formatted_data
 
 
+def _snapshot_contents(pc: models.DetectedDevice, db: Session):
+    # Manifest bytes, or tree text for older rows
+    if pc.snapshot_hash:
+        snapshot = db.get(models.Snapshot, pc.snapshot_hash)
+        if snapshot is not None:
+            return snapshot.manifest
+        print(f"detection {pc.id} give Error: its snapshot {pc.snapshot_hash} is missing")
+    return pc.manifest or pc.tree
+
+
+def get_detection_contents(detection_id: int, db: Session):
+    """ Snapshot (manifest bytes, or tree text for older rows) and EventLog of one detection. """
+    pc = db.get(models.DetectedDevice, detection_id)
+    return _snapshot_contents(pc, db), _detection_events(pc, db)
+
+
+def _detection_events(pc, db):
+    events = get_file_events(pc.id, db)
+    if not events and pc.logs:
+        events = EventLog.from_text(pc.logs)
+    return events
+
+
+def get_comparison_manifests(detection_id: int, db: Session):
+    """
+    Manifest bytes of one detection and of the next complete snapshot of the
+    same drive, i.e. the state the drive was in when it came back. Either may
+    be None for detections recorded before manifests were stored.
+    """
+    pc = db.get(models.DetectedDevice, detection_id)
+    contents = _snapshot_contents(pc, db)
+    query = (
+        select(models.DetectedDevice.id)
+        .where((models.DetectedDevice.serial_number == pc.serial_number) &
+               (models.DetectedDevice.insertion_time > pc.insertion_time) &
+               ((models.DetectedDevice.snapshot_status == None) |
+                (models.DetectedDevice.snapshot_status == SNAPSHOT_COMPLETE)))
+        .order_by(models.DetectedDevice.insertion_time)
+    )
+    next_id = db.exec(query).first()
+    later = _snapshot_contents(db.get(models.DetectedDevice, next_id), db) if next_id is not None else None
+    return (contents if isinstance(contents, bytes) else None,
+            later if isinstance(later, bytes) else None)
+
+
+def search_file_index(query: str, db: Session, limit: int = 200):
+    """
+    Detections whose snapshot or activity log contains a file or folder.
+
+    ``query`` is a name, or a path relative to the drive root when it contains
+    a separator; '*' and '?' act as wildcards. Returns at most ``limit``
+    (info, detection id) pairs, newest detection first, where info also holds
+    the matched "Path" and where it was "Found In" (Snapshot or Activity).
+    """
+    kind, value, is_pattern = parse_query(query)
+    if not value:
+        return []
+    operator = 'GLOB' if is_pattern else '='
+    if kind == 'name':
+        matched = ('SELECT p.id, p.path FROM file_names n JOIN file_paths p ON p.name_id = n.id '
+                   f'WHERE n.name {operator} :value')
+    else:
+        matched = f'SELECT id, path FROM file_paths WHERE path {operator} :value'
+    # Sorted newest first before the limit (ix_detected_devices_snapshot_time keeps
+    # that cheap for names found in most snapshots)
+    hits = db.execute(text(
+        f'WITH matched AS ({matched}) '
+        'SELECT d.id, m.path, \'Snapshot\', d.insertion_time FROM matched m '
+        'JOIN snapshot_files f ON f.path_id = m.id '
+        'JOIN indexed_snapshots s ON s.id = f.snapshot_id '
+        'JOIN detected_devices d ON d.snapshot_hash = s.snapshot_hash '
+        'UNION ALL '
+        'SELECT d.id, m.path, \'Activity\', d.insertion_time FROM matched m '
+        'JOIN detection_files f ON f.path_id = m.id '
+        'JOIN detected_devices d ON d.id = f.detection_id '
+        'ORDER BY 4 DESC, 1 DESC '
+        'LIMIT :limit'), {'value': value, 'limit': limit}).all()
+    if not hits:
+        return []
+
+    query = (select(models.DetectedDevice)
+             .where(models.DetectedDevice.id.in_({hit[0] for hit in hits}))
+             .options(*_DEFER_CONTENTS))
+    detections = {pc.id: pc for pc in db.exec(query).all()}
+    results = []
+    for detection_id, path, found_in, _ in hits:
+        pc = detections.get(detection_id)
+        if pc is None:
+            continue
+        info = _detection_info(pc)
+        info["Path"] = path
+        info["Found In"] = found_in
+        results.append((info, pc.id))
+    return results
+
+
 def get_latest_unique_detections(db: Session):
     # Subquery to get the latest insertion_time for each serial_number
     subquery = (
@@ -380,6 +774,7 @@ def get_latest_unique_detections(db: Session):
         .join(subquery, (models.DetectedDevice.serial_number == subquery.c.serial_number) &
               (models.DetectedDevice.insertion_time == subquery.c.latest_insertion_time))
         .order_by(desc(models.DetectedDevice.insertion_time))
+        .options(*_DEFER_CONTENTS)
     )
 
     latest_unique_detections = db.exec(query).all()
@@ -406,5 +801,67 @@ def get_latest_unique_detections(db: Session):
             "Manufacture": device['Manufacturer'],
             "FirmwareRevision": device['FirmwareRevision'],
         }
-        formatted_data.append((single_drive_info, pc.tree, pc.is_registered))
+        formatted_data.append((single_drive_info, pc.id, pc.is_registered))
     return formatted_data
+
+
+def build_file_index(db: Session):
+    """
+    Index snapshots and activity logs stored before the file index existed.
+
+    Works one snapshot or detection per commit and skips what is already
+    indexed, so it can be interrupted and run again. Returns (snapshots,
+    detections) indexed.
+    """
+    snapshots = detections = 0
+    hashes = db.execute(text('SELECT hash FROM snapshots WHERE hash NOT IN '
+                             '(SELECT snapshot_hash FROM indexed_snapshots)')).scalars().all()
+    for snapshot_hash in hashes:
+        index_snapshot(db, snapshot_hash, db.get(models.Snapshot, snapshot_hash).manifest)
+        db.commit()
+        snapshots += 1
+    ids = db.execute(text('SELECT id FROM detected_devices WHERE logs IS NOT NULL AND id NOT IN '
+                          '(SELECT detection_id FROM detection_files)')).scalars().all()
+    for detection_id in ids:
+        paths = activity_paths(db.get(models.DetectedDevice, detection_id).logs)
+        if paths:
+            index_detection_activity(db, detection_id, paths)
+            db.commit()
+            detections += 1
+    return snapshots, detections
+
+
+def compress_detection_columns(chunk_size: int = 500, bind=engine):
+    """
+    Compress tree, logs and manifest values written before compression existed.
+
+    Rows are rewritten in id order, ``chunk_size`` rows per transaction, so the
+    migration can be interrupted and resumed; values that are already
+    compressed are left alone. Returns (rows updated, bytes before, bytes after).
+    """
+    columns = ('tree', 'logs', 'manifest')
+    last_id = 0
+    updated = before = after = 0
+    while True:
+        with bind.begin() as conn:
+            rows = conn.execute(text('SELECT id, tree, logs, manifest FROM detected_devices '
+                                     'WHERE id > :last_id ORDER BY id LIMIT :limit'),
+                                {'last_id': last_id, 'limit': chunk_size}).all()
+            if not rows:
+                break
+            for row in rows:
+                changes = {}
+                for column, value in zip(columns, row[1:]):
+                    if not value or models.is_compressed(value):
+                        continue
+                    raw = value.encode('utf-8') if isinstance(value, str) else value
+                    changes[column] = models.compress(raw)
+                    before += len(raw)
+                    after += len(changes[column])
+                if changes:
+                    assignments = ', '.join(f'{column} = :{column}' for column in changes)
+                    conn.execute(text(f'UPDATE detected_devices SET {assignments} WHERE id = :id'),
+                                 dict(changes, id=row[0]))
+                    updated += 1
+            last_id = rows[-1][0]
+    return updated, before, after
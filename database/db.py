@@ -1,6 +1,6 @@
 import os
 
-from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel import SQLModel, create_engine, Session, inspect, text
 import utils
 
 # Create DB Engine and Session
@@ -23,12 +23,35 @@ def archive_db(path: str = ""):
 
         # Create tables in the archive database if they don't exist
         SQLModel.metadata.create_all(archive_engine)
+        upgrade_tables(archive_engine)
 
         return Session(archive_engine)
 
 
+def upgrade_tables(bind):
+    """
+    Add columns and indexes that were introduced after a table was first created.
+
+    ``create_all`` only creates missing tables, so an existing database.sqlite
+    would otherwise lack newer (nullable) columns and their indexes.
+    """
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=bind.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    upgrade_tables(engine)
 
 
 # Dependency
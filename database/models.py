@@ -1,7 +1,81 @@
 # models.py
-from sqlmodel import SQLModel, Field, JSON, Column, Text
+import zlib
+from typing import Optional
+
+from sqlalchemy import Index
+from sqlalchemy.types import TypeDecorator
+from sqlmodel import SQLModel, Field, JSON, Column, LargeBinary
 from datetime import datetime
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# First byte of a compressed value; anything else was stored uncompressed
+ZLIB_MARKER = b'\x01'
+ZSTD_MARKER = b'\x02'
+
+
+def compress(data: bytes) -> bytes:
+    if zstandard is not None:
+        return ZSTD_MARKER + zstandard.ZstdCompressor(level=3).compress(data)
+    return ZLIB_MARKER + zlib.compress(data, 6)
+
+
+def is_compressed(value) -> bool:
+    return isinstance(value, bytes) and value[:1] in (ZLIB_MARKER, ZSTD_MARKER)
+
+
+def decompress(data: bytes) -> bytes:
+    marker = data[:1]
+    if marker == ZLIB_MARKER:
+        return zlib.decompress(data[1:])
+    if marker == ZSTD_MARKER:
+        if zstandard is None:
+            raise RuntimeError("Value was compressed with zstd but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data[1:])
+    return data
+
+
+class CompressedBinary(TypeDecorator):
+    """
+    Binary column compressed with zstd when available, zlib otherwise.
+
+    Values are tagged with a marker byte so rows written with either codec, or
+    before compression was introduced, can all be read back.
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if not value:
+            return value
+        return compress(value)
+
+    def process_result_value(self, value, dialect):
+        if not value:
+            return value
+        return decompress(value)
+
+
+class CompressedText(CompressedBinary):
+    """ Text column stored compressed; plain text from older rows is returned as is. """
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if not value:
+            return b''
+        return compress(value.encode('utf-8'))
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+        if not value:
+            return ''
+        return decompress(value).decode('utf-8')
+
 
 class ConnectedDevice(SQLModel, table=True):
     __tablename__ = 'connected_devices'
@@ -13,15 +87,105 @@ class ConnectedDevice(SQLModel, table=True):
 
 class DetectedDevice(SQLModel, table=True):
     __tablename__ = 'detected_devices'
+    # File searches list the newest detections of the snapshots that matched first
+    __table_args__ = (Index('ix_detected_devices_snapshot_time', 'snapshot_hash', 'insertion_time'),)
 
     id: int = Field(primary_key=True)
     serial_number: str = Field()
     device: dict = Field(sa_column=Column(JSON))
-    tree: str = Field(Text)
+    # Large columns are compressed and only loaded when accessed
+    tree: str = Field(default='', sa_column=Column(CompressedText))
     insertion_time: datetime = Field(nullable=True)
     removal_time: datetime = Field(nullable=True)
     is_registered: bool = Field(nullable=True)
-    logs: str = Field(sa_column=Column(Text, nullable=True))
+    logs: str = Field(sa_column=Column(CompressedText, nullable=True))
+    # Older rows keep their own manifest; newer ones reference the snapshot store
+    manifest: Optional[bytes] = Field(default=None, sa_column=Column(CompressedBinary, nullable=True))
+    snapshot_hash: Optional[str] = Field(default=None, nullable=True, index=True)
+    # 'pending' while the background snapshot runs, then 'complete' or 'truncated'
+    snapshot_status: Optional[str] = Field(default=None, nullable=True)
+    # file_events.TransferStats summary: bytes added/removed, per extension and top-level folder
+    transfers: Optional[dict] = Field(default=None, sa_column=Column(JSON, nullable=True))
+    # USBEventHandler.activity: events per action, and the load shedding episodes with their busiest folders
+    activity: Optional[dict] = Field(default=None, sa_column=Column(JSON, nullable=True))
+
+
+class Snapshot(SQLModel, table=True):
+    __tablename__ = 'snapshots'
+
+    # Content-addressed manifest store: identical snapshots are stored once
+    hash: str = Field(primary_key=True)
+    manifest: bytes = Field(sa_column=Column(CompressedBinary, nullable=False))
+    size: int = Field(nullable=False)
+    ref_count: int = Field(default=0, nullable=False)
+
+
+class FileHash(SQLModel, table=True):
+    __tablename__ = 'file_hashes'
+
+    # Hash cache: a row is valid while the file keeps the recorded size and mtime
+    serial_number: str = Field(primary_key=True)
+    path: str = Field(primary_key=True)
+    algorithm: str = Field(primary_key=True)
+    size: int = Field(nullable=False)
+    mtime: int = Field(nullable=False)
+    digest: str = Field(nullable=False)
+    detection_id: Optional[int] = Field(default=None, nullable=True)
+
+
+class FileEvent(SQLModel, table=True):
+    __tablename__ = 'file_events'
+
+    # File activity of a detection, one row per watcher event in order
+    detection_id: int = Field(primary_key=True)
+    sequence: int = Field(primary_key=True)
+    timestamp: float = Field(nullable=False)  # seconds since the epoch
+    action: int = Field(nullable=False)  # file_events.Action
+    path: str = Field(nullable=False)
+    size: Optional[int] = Field(default=None, nullable=True)
+    destination: Optional[str] = Field(default=None, nullable=True)  # target of a move
+    reconciled: Optional[bool] = Field(default=None, nullable=True)  # found by a rescan, not seen by the watcher
+
+
+class FileName(SQLModel, table=True):
+    __tablename__ = 'file_names'
+
+    # File index: every normalized (lower-case) file or folder name once
+    id: int = Field(primary_key=True)
+    name: str = Field(unique=True, index=True)
+
+
+class FilePath(SQLModel, table=True):
+    __tablename__ = 'file_paths'
+
+    # Normalized path relative to the drive root, '/' separated and lower-case
+    id: int = Field(primary_key=True)
+    path: str = Field(unique=True, index=True)
+    name_id: int = Field(index=True)
+
+
+class IndexedSnapshot(SQLModel, table=True):
+    __tablename__ = 'indexed_snapshots'
+
+    # Short id for a snapshot whose entries are in snapshot_files
+    id: int = Field(primary_key=True)
+    snapshot_hash: str = Field(unique=True, index=True)
+
+
+class SnapshotFile(SQLModel, table=True):
+    __tablename__ = 'snapshot_files'
+
+    # Posting: the snapshot contains the path
+    snapshot_id: int = Field(primary_key=True)
+    path_id: int = Field(primary_key=True, index=True)
+
+
+class DetectionFile(SQLModel, table=True):
+    __tablename__ = 'detection_files'
+
+    # Posting: the path shows up in the activity log of the detection
+    detection_id: int = Field(primary_key=True)
+    path_id: int = Field(primary_key=True, index=True)
 
 
 class UserRegister(SQLModel, table=True):
@@ -0,0 +1,449 @@
+"""
+Where the drives come from: listing disk drives and volumes, and hot-plug.
+
+usb_detection pairs a disk drive that just appeared (by serial number) with
+the volume that appeared with it, and diffs both lists again when a drive is
+pulled out. A ``DeviceBackend`` provides them:
+
+* ``connected_devices()``: {serial number: device info} of the disk drives,
+  with the keys of WMI's Win32_DiskDrive (see ``device_info``);
+* ``existing_disks()``: {volume: disk info} of the mounted volumes, the
+  volume being a drive letter on Windows and a mount point elsewhere;
+* ``subscribe(callback)``: ``callback(ARRIVAL)`` or ``callback(REMOVAL)``
+  whenever drives may have come or gone, on a thread of the backend.
+
+``WmiBackend`` is what the program always used on Windows: WMI queries and
+WM_DEVICECHANGE messages to a hidden window. ``SysfsBackend`` reads the disks
+from /sys/block (with the udev database for serial numbers and labels where
+there is one) and the volumes from /proc/self/mountinfo, and listens to
+kernel uevents and mount table changes. ``FakeBackend`` keeps drives in
+memory that are plugged and unplugged by hand, for tests and benchmarks.
+``device_backend()`` returns the process-wide backend DEVICE_BACKEND names.
+"""
+import os
+import select
+import socket
+import sys
+import threading
+import time
+
+# 'wmi' (Windows only), 'sysfs' (Linux), 'fake', or 'auto' for the one that fits the system
+DEVICE_BACKEND = 'auto'
+# Seconds a hot-plug signal waits for the rest of the change (the mount after the disk, say)
+HOTPLUG_SETTLE = 1.0
+
+ARRIVAL = 'arrival'
+REMOVAL = 'removal'
+
+# Netlink protocol and multicast group of the kernel's uevents
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_GROUP = 1
+
+
+def device_info(serial_number, caption=None, interface_type=None, media_type=None, model=None, status=None,
+                partitions=None, capabilities=None, manufacturer=None, firmware_revision=None):
+    """ A disk drive as usb_detection and the database expect it, whatever the backend. """
+    return {
+        "SerialNumber": serial_number,
+        "Caption": caption,
+        "InterfaceType": interface_type,
+        "MediaType": media_type,
+        "Model": model,
+        "Status": status,
+        "Partitions": partitions,
+        "CapabilityDescriptions": capabilities,
+        "Manufacturer": manufacturer,
+        "FirmwareRevision": firmware_revision
+    }
+
+
+def disk_info(name, free_bytes, total_bytes):
+    """ A volume with its sizes written out the way the detection stores them. """
+    free_space_gb = round(int(free_bytes) / (1024 ** 3), 2)
+    size_gb = round(int(total_bytes) / (1024 ** 3), 2)
+    used_space_gb = round(size_gb - free_space_gb, 2)
+
+    # Check if used space is less than 1 GB
+    if used_space_gb < 1:
+        used_space_mb = round((size_gb - free_space_gb) * 1024, 2)
+        used_space_str = f"{used_space_mb} MB"
+    else:
+        used_space_str = f"{used_space_gb} GB"
+
+    return {
+        "name": name,
+        "free_space": f"{free_space_gb} GB",
+        "total_size": f"{size_gb} GB",
+        "used_space": used_space_str
+    }
+
+
+class DeviceBackend:
+    """ Lists disk drives and volumes and signals hot-plug changes (see the module docstring). """
+
+    def __init__(self):
+        self.callbacks = []
+        self.thread = None
+
+    def connected_devices(self):
+        raise NotImplementedError
+
+    def existing_disks(self):
+        raise NotImplementedError
+
+    def subscribe(self, callback):
+        """ Call ``callback(ARRIVAL or REMOVAL)`` on hot-plug changes from now on. """
+        self.callbacks.append(callback)
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.listen, name='hotplug', daemon=True)
+            self.thread.start()
+
+    def notify(self, change):
+        for callback in list(self.callbacks):
+            try:
+                callback(change)
+            except Exception as e:
+                print("DeviceBackend callback give Error: ", str(e))
+
+    def listen(self):
+        """ Wait for hot-plug changes on the backend's thread and ``notify`` them. """
+        raise NotImplementedError
+
+    def wait(self):
+        """ Block until the hot-plug thread stops. """
+        if self.thread is not None:
+            self.thread.join()
+
+    def close(self):
+        pass
+
+
+class WmiBackend(DeviceBackend):
+    """ Win32_DiskDrive and Win32_LogicalDisk through WMI, WM_DEVICECHANGE for hot-plug. """
+
+    def __init__(self):
+        super().__init__()
+        # Windows only, hence imported here
+        import pythoncom
+        import win32api
+        import win32con
+        import win32gui
+        import wmi
+        self.pythoncom = pythoncom
+        self.win32api = win32api
+        self.win32con = win32con
+        self.win32gui = win32gui
+        self.wmi = wmi
+        self.hwnd = None
+
+    def query(self, table):
+        # Any thread may ask; WMI needs the COM environment initialized in it
+        self.pythoncom.CoInitialize()
+        try:
+            return list(getattr(self.wmi.WMI(), table)())
+        finally:
+            self.pythoncom.CoUninitialize()
+
+    def connected_devices(self):
+        connected_devices = {}
+        for device in self.query('Win32_DiskDrive'):
+            connected_devices[device.SerialNumber] = device_info(
+                device.SerialNumber, device.Caption, device.InterfaceType, device.MediaType, device.Model,
+                device.Status, device.Partitions, device.CapabilityDescriptions, device.Manufacturer,
+                device.FirmwareRevision)
+        return connected_devices
+
+    def existing_disks(self):
+        disks = {}
+        for disk in self.query('Win32_LogicalDisk'):
+            disks[disk.DeviceID] = disk_info(disk.VolumeName, disk.FreeSpace, disk.Size)
+        return disks
+
+    def listen(self):
+        """
+        Create a window for listening to messages, and pump them
+        """
+        win32gui = self.win32gui
+        wc = win32gui.WNDCLASS()
+        wc.lpfnWndProc = self.wnd_proc
+        wc.lpszClassName = 'USB Monitoring'
+        wc.hInstance = self.win32api.GetModuleHandle(None)
+        class_atom = win32gui.RegisterClass(wc)
+        self.hwnd = win32gui.CreateWindow(class_atom, 'USB Monitoring', 0, 0, 0, 0, 0, 0, 0, wc.hInstance, None)
+        win32gui.PumpMessages()
+
+    def wnd_proc(self, hwnd, msg, wparam, lparam):
+        """
+        Window procedure to handle messages
+        """
+        win32con = self.win32con
+        if msg == win32con.WM_DEVICECHANGE:
+            if wparam == win32con.DBT_DEVICEARRIVAL:
+                self.notify(ARRIVAL)
+            elif wparam == win32con.DBT_DEVICEREMOVECOMPLETE:
+                self.notify(REMOVAL)
+        elif msg == win32con.WM_DESTROY:
+            # after close(): ends PumpMessages
+            self.win32gui.PostQuitMessage(0)
+        return self.win32gui.DefWindowProc(hwnd, msg, wparam, lparam)
+
+    def close(self):
+        if self.hwnd is not None:
+            self.win32gui.PostMessage(self.hwnd, self.win32con.WM_CLOSE, 0, 0)
+
+
+class SysfsBackend(DeviceBackend):
+    """ Disks from /sys/block and the udev database, volumes from /proc/self/mountinfo. """
+
+    def __init__(self, sys_root='/sys', mountinfo='/proc/self/mountinfo', udev_data='/run/udev/data',
+                 dev_root='/dev'):
+        super().__init__()
+        self.block = os.path.join(sys_root, 'block')
+        self.mountinfo = mountinfo
+        self.udev_data = udev_data
+        self.dev_root = dev_root
+        # Written to by close() to end the hot-plug thread
+        self.wake_read, self.wake_write = os.pipe()
+
+    @staticmethod
+    def read(path):
+        try:
+            with open(path, encoding='utf-8', errors='replace') as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def udev(self, number):
+        """ The E: properties udev stored for block device ``number`` (major:minor). """
+        properties = {}
+        text = self.read(os.path.join(self.udev_data, f'b{number}'))
+        for line in (text or '').splitlines():
+            if line.startswith('E:'):
+                key, _, value = line[2:].partition('=')
+                properties[key] = value
+        return properties
+
+    def disks(self):
+        """ (name, sysfs folder) of the physical disks: loop, ram and device-mapper disks are virtual. """
+        try:
+            names = sorted(os.listdir(self.block))
+        except OSError:
+            return []
+        disks = []
+        for name in names:
+            folder = os.path.join(self.block, name)
+            if '/virtual/' not in os.path.realpath(folder):
+                disks.append((name, folder))
+        return disks
+
+    @staticmethod
+    def partitions(name, folder):
+        try:
+            return [os.path.join(folder, entry) for entry in sorted(os.listdir(folder))
+                    if entry.startswith(name) and os.path.exists(os.path.join(folder, entry, 'partition'))]
+        except OSError:
+            return []
+
+    @staticmethod
+    def usb_parent(folder):
+        """ The sysfs folder of the USB device a disk hangs off, or None. """
+        path = os.path.realpath(folder)
+        while '/usb' in path:
+            if os.path.exists(os.path.join(path, 'idVendor')):
+                return path
+            path = os.path.dirname(path)
+        return None
+
+    def connected_devices(self):
+        connected_devices = {}
+        read = self.read
+        for name, folder in self.disks():
+            properties = self.udev(read(os.path.join(folder, 'dev')))
+            usb = self.usb_parent(folder)
+            device = os.path.join(folder, 'device')
+            serial_number = (properties.get('ID_SERIAL_SHORT') or read(os.path.join(folder, 'serial'))
+                             or (usb and read(os.path.join(usb, 'serial'))) or read(os.path.join(device, 'serial'))
+                             or name)
+            manufacturer = (properties.get('ID_VENDOR') or read(os.path.join(device, 'vendor'))
+                            or (usb and read(os.path.join(usb, 'manufacturer'))))
+            model = (properties.get('ID_MODEL') or read(os.path.join(device, 'model'))
+                     or (usb and read(os.path.join(usb, 'product'))))
+            removable = read(os.path.join(folder, 'removable')) == '1' or usb is not None
+            capabilities = ['Random Access']
+            if read(os.path.join(folder, 'ro')) != '1':
+                capabilities.append('Supports Writing')
+            if removable:
+                capabilities.append('Supports Removable Media')
+            connected_devices[serial_number] = device_info(
+                serial_number,
+                ' '.join(part for part in (manufacturer, model) if part) or name,
+                (properties.get('ID_BUS') or ('usb' if usb else 'scsi')).upper(),
+                'Removable Media' if removable else 'Fixed hard disk media',
+                model,
+                'OK',
+                len(self.partitions(name, folder)),
+                tuple(capabilities),
+                manufacturer,
+                properties.get('ID_REVISION') or read(os.path.join(device, 'rev')))
+        return connected_devices
+
+    def mounts(self):
+        """ {mount point: major:minor} of the block devices mounted, first mount of each point. """
+        mounts = {}
+        text = self.read(self.mountinfo)
+        for line in (text or '').splitlines():
+            fields = line.split()
+            if len(fields) > 4 and fields[4] not in mounts:
+                # spaces and the like are escaped as \\ooo
+                point = fields[4].encode('latin-1', 'backslashreplace').decode('unicode_escape')
+                mounts[point] = fields[2]
+        return mounts
+
+    def labels(self):
+        """ {device name: volume label} from /dev/disk/by-label. """
+        folder = os.path.join(self.dev_root, 'disk', 'by-label')
+        labels = {}
+        try:
+            for label in os.listdir(folder):
+                target = os.path.basename(os.readlink(os.path.join(folder, label)))
+                labels[target] = label.encode('latin-1', 'backslashreplace').decode('unicode_escape')
+        except OSError:
+            pass
+        return labels
+
+    def existing_disks(self):
+        volumes = {}  # major:minor -> device name, of the physical disks and their partitions
+        for name, folder in self.disks():
+            for path in [folder] + self.partitions(name, folder):
+                number = self.read(os.path.join(path, 'dev'))
+                if number:
+                    volumes[number] = os.path.basename(path)
+        disks = {}
+        labels = None
+        for point, number in self.mounts().items():
+            if number not in volumes:
+                continue
+            try:
+                status = os.statvfs(point)
+            except OSError:
+                continue
+            label = self.udev(number).get('ID_FS_LABEL')
+            if label is None:
+                if labels is None:
+                    labels = self.labels()
+                label = labels.get(volumes[number], '')
+            disks[point] = disk_info(label, status.f_bavail * status.f_frsize, status.f_blocks * status.f_frsize)
+        return disks
+
+    def state(self):
+        """ What a hot-plug change is told from: the physical disks present and the block devices mounted. """
+        # major 0 is for the filesystems without a device: proc, tmpfs, cgroups...
+        return ({name for name, _ in self.disks()},
+                {point for point, number in self.mounts().items() if not number.startswith('0:')})
+
+    def listen(self):
+        poller = select.poll()
+        poller.register(self.wake_read, select.POLLIN)
+        # The mount table signals a change with POLLPRI; uevents report disks coming and going
+        mountinfo = open(self.mountinfo, 'rb')
+        mountinfo.read()
+        poller.register(mountinfo, select.POLLPRI | select.POLLERR)
+        uevents = None
+        try:
+            uevents = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            uevents.bind((0, UEVENT_GROUP))
+            uevents.setblocking(False)
+            poller.register(uevents, select.POLLIN)
+        except (OSError, AttributeError) as e:
+            print("SysfsBackend uevents give Error: ", str(e))
+            uevents = None
+        previous = self.state()
+        try:
+            while True:
+                ready = [fd for fd, _ in poller.poll()]
+                if self.wake_read in ready:
+                    return
+                time.sleep(HOTPLUG_SETTLE)
+                mountinfo.seek(0)
+                mountinfo.read()
+                while uevents is not None:
+                    try:
+                        uevents.recv(65536)
+                    except OSError:
+                        break
+                current = self.state()
+                if current[1] - previous[1]:
+                    self.notify(ARRIVAL)
+                if previous[1] - current[1] or previous[0] - current[0]:
+                    self.notify(REMOVAL)
+                previous = current
+        finally:
+            mountinfo.close()
+            if uevents is not None:
+                uevents.close()
+            os.close(self.wake_read)
+            os.close(self.wake_write)
+
+    def close(self):
+        if self.thread is not None and self.thread.is_alive():
+            os.write(self.wake_write, b'x')
+
+
+class FakeBackend(DeviceBackend):
+    """ Drives held in memory and plugged in or out by hand, for tests and benchmarks. """
+
+    def __init__(self, devices=None, disks=None):
+        super().__init__()
+        self.devices = dict(devices or {})
+        self.disks = dict(disks or {})
+
+    def connected_devices(self):
+        # Copies, as a real enumeration returns fresh dicts usb_detection is free to change
+        return {serial_number: dict(device) for serial_number, device in self.devices.items()}
+
+    def existing_disks(self):
+        return {symbol: dict(disk) for symbol, disk in self.disks.items()}
+
+    def subscribe(self, callback):
+        # Changes are notified by plug() and unplug(), on the caller's thread
+        self.callbacks.append(callback)
+
+    def plug(self, serial_number, device, symbol, disk):
+        self.devices[serial_number] = device
+        self.disks[symbol] = disk
+        self.notify(ARRIVAL)
+
+    def unplug(self, serial_number, symbol):
+        self.devices.pop(serial_number, None)
+        self.disks.pop(symbol, None)
+        self.notify(REMOVAL)
+
+
+def make_backend(name=DEVICE_BACKEND):
+    if name == 'wmi' or name == 'auto' and sys.platform == 'win32':
+        return WmiBackend()
+    if name == 'sysfs' or name == 'auto' and os.path.isdir('/sys/block'):
+        return SysfsBackend()
+    if name in ('fake', 'auto'):
+        return FakeBackend()
+    raise ValueError(f"unknown device backend {name!r}")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def device_backend():
+    """ The process-wide DeviceBackend, made on first use. """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = make_backend(DEVICE_BACKEND)
+        return _backend
+
+
+def use_backend(backend):
+    """ Make ``backend`` (a FakeBackend in tests, say) the one device_backend() returns. """
+    global _backend
+    with _backend_lock:
+        _backend = backend
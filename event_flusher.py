@@ -0,0 +1,210 @@
+"""
+Periodic flushing of a connected drive's file activity to the database.
+
+Without it a session only reaches the database when the drive is removed,
+and a crash or reboot in between loses all of it. ``EventFlusher`` runs next
+to the watcher and every ``interval`` seconds, or as soon as ``batch_events``
+new events have been logged, does two things:
+
+1. spills the events in memory to the session's segment files and fsyncs
+   them, which is the write-ahead step: from then on they survive a crash;
+2. inserts everything past the cursor into file_events, and the current
+   transfer totals, counts per action and load shedding episodes into the
+   detection, in one transaction.
+
+The cursor is simply how many rows of the session file_events holds, so it
+commits together with the rows it counts. Segments whose events are all in
+the database are deleted. After a crash, ``recover_sessions`` reads the
+cursor of every session that left segments behind and inserts the rest, so
+nothing is lost or written twice.
+
+The flushers of all connected drives are run by a single ``FlushLoop``
+thread, each on its own schedule, so the thread count does not grow with the
+number of drives.
+"""
+import os
+import threading
+import time
+
+from sqlmodel import Session
+
+from database import crud
+from database.db import engine
+from file_events import SPILL_DIR, SpooledEventLog, recover_segments
+from file_index import activity_paths
+
+# Seconds between flushes of a connected drive's activity
+FLUSH_INTERVAL = 10.0
+# New events that trigger a flush before the interval is up
+FLUSH_EVENTS = 5_000
+
+
+class FlushLoop(threading.Thread):
+    """ The one thread that runs the flushers of every connected drive when they are due. """
+
+    def __init__(self):
+        super().__init__(name='event-flusher', daemon=True)
+        self.flushers = {}  # EventFlusher -> monotonic time of its next flush
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+
+    def add(self, flusher):
+        with self.lock:
+            self.flushers[flusher] = time.monotonic() + flusher.interval
+        self.wake.set()
+
+    def remove(self, flusher):
+        with self.lock:
+            self.flushers.pop(flusher, None)
+
+    def run(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                due = [flusher for flusher, at in self.flushers.items() if flusher.requested or at <= now]
+                for flusher in due:
+                    flusher.requested = False
+                    self.flushers[flusher] = now + flusher.interval
+                timeout = min(self.flushers.values(), default=now + FLUSH_INTERVAL) - now
+            for flusher in due:
+                # One drive failing to flush (a full disk while spilling) must not stop the others
+                try:
+                    flusher.flush()
+                except Exception as e:
+                    print(f"FlushLoop flush of detection {flusher.detection_id} give Error: ", str(e))
+            if not due:
+                self.wake.wait(timeout)
+                self.wake.clear()
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def flush_loop():
+    """ The process-wide FlushLoop, started on first use. """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = FlushLoop()
+            _loop.start()
+        return _loop
+
+
+class EventFlusher:
+    """ Writes the activity a USBEventHandler logs to file_events of ``detection_id`` as it comes in. """
+
+    def __init__(self, handler, detection_id, root=None, interval=FLUSH_INTERVAL, batch_events=FLUSH_EVENTS):
+        self.handler = handler
+        self.events = handler.events  # a SpooledEventLog
+        self.detection_id = detection_id
+        self.root = root
+        self.interval = interval
+        self.batch_events = batch_events
+        self.requested = False
+        self.stopped = False
+        # Keeps the final flush of stop() and one of the loop from overlapping
+        self.flushing = threading.Lock()
+        self.flushes = 0
+        self.rows = 0
+
+    def start(self):
+        flush_loop().add(self)
+
+    def request(self):
+        """ Ask for a flush before the interval is up. """
+        if not self.requested:
+            self.requested = True
+            flush_loop().wake.set()
+
+    def stop(self):
+        """ Stop flushing after one last flush of everything logged so far. """
+        flush_loop().remove(self)
+        with self.flushing:
+            self.write()
+            self.stopped = True
+
+    def pending(self):
+        return len(self.events) - self.events.flushed
+
+    def stored(self):
+        """ EventLog of the session's events in file_events so far; hold ``flushing`` to keep it current. """
+        db = Session(engine)
+        try:
+            return crud.get_file_events(self.detection_id, db)
+        except Exception as e:
+            print("EventFlusher stored give Error: ", str(e))
+            return None
+        finally:
+            db.close()
+
+    def flush(self):
+        with self.flushing:
+            if not self.stopped:
+                self.write()
+
+    def write(self):
+        with self.handler.lock:
+            # paths that have gone quiet would otherwise wait for the next event, and so would
+            # the end of a flood
+            self.handler.coalescer.flush()
+            self.handler.shedder.settle()
+            self.events.spill(sync=True)
+            start, stop = self.events.flushed, len(self.events)
+            transfers = self.handler.transfers.summary()
+            activity = self.handler.activity()
+        if start == stop:
+            return
+        db = Session(engine)
+        try:
+            crud.save_file_events(db, self.detection_id, self.events, start, stop)
+            crud.index_detection_activity(db, self.detection_id,
+                                          activity_paths(self.events, self.root, start, stop))
+            crud.save_transfer_summary(db, self.detection_id, transfers)
+            crud.save_activity_summary(db, self.detection_id, activity)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print("EventFlusher flush give Error: ", str(e))
+            return
+        finally:
+            db.close()
+        with self.handler.lock:
+            self.events.mark_flushed(stop)
+        self.flushes += 1
+        self.rows += stop - start
+
+
+def recover_sessions(folder=SPILL_DIR):
+    """ Write the activity of sessions cut short by a crash to the database, past their cursors. """
+    for session, segments in recover_segments(folder).items():
+        if not session.isdigit():
+            # Logged without a detection, so there is nothing to recover into;
+            # sessions of this process may still be in use
+            if not session.startswith(f"s{os.getpid()}_"):
+                discard_segments(session, segments)
+            continue
+        detection_id = int(session)
+        events = SpooledEventLog.resume(session, segments, folder)
+        db = Session(engine)
+        try:
+            cursor = crud.file_event_cursor(db, detection_id)
+            crud.save_file_events(db, detection_id, events, cursor)
+            crud.index_detection_activity(db, detection_id, activity_paths(events, None, cursor))
+            db.commit()
+            events.discard()
+            print(f"recover_sessions: {max(len(events) - cursor, 0)} events of detection {detection_id} recovered")
+        except Exception as e:
+            db.rollback()
+            print("recover_sessions give Error: ", str(e))
+        finally:
+            db.close()
+
+
+def discard_segments(session, segments):
+    for _, segment in segments:
+        try:
+            os.remove(segment)
+        except OSError as e:
+            print("recover_sessions discard give Error: ", str(e))
+    print(f"recover_sessions: {len(segments)} segments of session {session} without a detection discarded")
@@ -0,0 +1,536 @@
+"""
+Typed records of the file activity seen on a drive while it is connected.
+
+The watcher only appends small slotted records (epoch timestamp, action,
+interned path id, size); log text is produced from them when something is
+displayed. Older detections only have the text, which ``EventLog.from_text``
+reads back into records. While a drive is connected the watcher records into
+a ``SpooledEventLog``, which moves older events out to segment files so that
+memory use does not grow with the length of the session.
+"""
+import itertools
+import math
+import os
+import struct
+import time
+from datetime import datetime
+from enum import IntEnum
+
+from replay import CREATED, CREATED_DIRECTORY, DELETED, MODIFIED, MOVED, parse_logs
+from utils import get_database_folder
+
+
+class Action(IntEnum):
+    CREATED = 1
+    CREATED_DIRECTORY = 2
+    DELETED = 3
+    MODIFIED = 4
+    MOVED = 5
+    # Not file events: load shedding began (size: its rate) or ended (size: the writes left out),
+    # and the writes it left out of one folder (size: their count, at the time of the first)
+    SHEDDING_STARTED = 6
+    SHEDDING_STOPPED = 7
+    SHED = 8
+
+
+# What happens to files and folders, as the watcher sees it and the replay engine applies it
+FILE_ACTIONS = (Action.CREATED, Action.CREATED_DIRECTORY, Action.DELETED, Action.MODIFIED, Action.MOVED)
+SHEDDING_ACTIONS = (Action.SHEDDING_STARTED, Action.SHED, Action.SHEDDING_STOPPED)
+
+# Text used for each action in the log (and by the replay engine)
+LABELS = {
+    Action.CREATED: CREATED,
+    Action.CREATED_DIRECTORY: CREATED_DIRECTORY,
+    Action.DELETED: DELETED,
+    Action.MODIFIED: MODIFIED,
+    Action.MOVED: MOVED,
+    Action.SHEDDING_STARTED: 'Load shedding started',
+    Action.SHEDDING_STOPPED: 'Load shedding stopped',
+    Action.SHED: 'Not logged',
+}
+ACTIONS = {label: action for action, label in LABELS.items()}
+
+# Rows per insert when a session is written to the file_events table
+ROW_BATCH = 5_000
+# Events a SpooledEventLog keeps in memory before appending them to disk
+SPILL_EVENTS = 50_000
+# Where spilled events go (next to the database, whatever the working directory
+# later becomes), and how large a segment file grows before the next
+SPILL_DIR = os.path.join(get_database_folder(), 'event_spill')
+SEGMENT_BYTES = 64 * 1024 * 1024
+
+# Paths whose last size TransferStats remembers; the least recently written are forgotten first,
+# 1/PATH_EVICT_BATCH of them at a time
+PATH_CAPACITY = 100_000
+PATH_EVICT_BATCH = 16
+# Buckets of TransferStats for files without an extension and files in the root folder
+NO_EXTENSION = '(none)'
+ROOT_FOLDER = '(root)'
+
+# timestamp, action, size (-1 if none), path length, destination length + 1 (0 if none)
+_RECORD = struct.Struct('<dBqII')
+# Set in the action byte of a spilled event that a rescan reconciled
+_RECONCILED = 0x80
+
+
+def format_size(size_bytes):
+    if size_bytes == 0:
+        return "0 B"
+    size_name = ("B", "KB", "MB", "GB", "TB")
+    i = int(math.floor(math.log(size_bytes, 1024)))
+    p = math.pow(1024, i)
+    s = round(size_bytes / p, 2)
+    return f"{s} {size_name[i]}"
+
+
+def format_event(timestamp, action, path, size=None, destination=None, reconciled=False):
+    stamp = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+    label = LABELS[action] + (" (reconciled)" if reconciled else "")
+    if action == Action.MOVED:
+        return f"[{stamp}] {label}: from {path} to {destination}"
+    if action == Action.SHEDDING_STARTED:
+        return f"[{stamp}] {label}: {path}, more than {size} events/s"
+    if action == Action.SHEDDING_STOPPED:
+        return f"[{stamp}] {label}: {path}, {size} writes not logged"
+    if action == Action.SHED:
+        return f"[{stamp}] {label}: {path}, {size} writes"
+    if size is not None:
+        return f"[{stamp}] {label}: {path}, Size: {format_size(size)}"
+    return f"[{stamp}] {label}: {path}"
+
+
+class FileEvent:
+    __slots__ = ('timestamp', 'action', 'path', 'size', 'destination', 'reconciled')
+
+    def __init__(self, timestamp, action, path, size=None, destination=None, reconciled=False):
+        self.timestamp = timestamp  # seconds since the epoch
+        self.action = action
+        self.path = path  # path id in the owning EventLog
+        self.size = size  # bytes, for created and modified files
+        self.destination = destination  # path id, for moves
+        self.reconciled = reconciled  # synthesized by a rescan after the watcher lost events
+
+
+class EventLog:
+    """ File events of one drive session, with the paths they refer to interned. """
+
+    # Events already written to the file_events table
+    flushed = 0
+
+    def __init__(self):
+        self.events = []
+        self.paths = []
+        self.path_ids = {}
+
+    def __len__(self):
+        return len(self.events)
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def intern(self, path):
+        path_id = self.path_ids.get(path)
+        if path_id is None:
+            path_id = self.path_ids[path] = len(self.paths)
+            self.paths.append(path)
+        return path_id
+
+    def record(self, action, path, size=None, destination=None, timestamp=None, reconciled=False):
+        event = FileEvent(time.time() if timestamp is None else timestamp, action, self.intern(path), size,
+                          None if destination is None else self.intern(destination), reconciled)
+        self.events.append(event)
+        return event
+
+    @property
+    def total_transferred(self):
+        """ Bytes added to the drive (see TransferStats). """
+        return TransferStats.of(self.records()).added
+
+    def records(self, start=0, stop=None):
+        """ (timestamp, action, path, size, destination) of events ``start`` up to ``stop``, oldest first. """
+        for timestamp, action, path, size, destination, _ in self.entries(start, stop):
+            yield timestamp, action, path, size, destination
+
+    def entries(self, start=0, stop=None):
+        """ ``records`` with whether each event was reconciled as a sixth value. """
+        paths = self.paths
+        for event in self.events[start:stop]:
+            yield (event.timestamp, event.action, paths[event.path], event.size,
+                   None if event.destination is None else paths[event.destination], event.reconciled)
+
+    def touched_paths(self, start=0, stop=None):
+        """ Every path file events ``start`` up to ``stop`` refer to (a path may come up more than once). """
+        for _, action, path, _, destination in self.records(start, stop):
+            if action not in FILE_ACTIONS:
+                continue
+            yield path
+            if destination is not None:
+                yield destination
+
+    def describe(self, event):
+        """ The log line of one event, as the watcher used to write it. """
+        return format_event(event.timestamp, event.action, self.paths[event.path], event.size,
+                            None if event.destination is None else self.paths[event.destination],
+                            event.reconciled)
+
+    def text(self):
+        """ The whole session as log text, with the running transfer totals. """
+        lines = []
+        stats = TransferStats()
+        for timestamp, action, path, size, destination, reconciled in self.entries():
+            lines.append(format_event(timestamp, action, path, size, destination, reconciled))
+            stats.account(action, path, size, destination)
+            if size is not None and action in FILE_ACTIONS:
+                lines.append(f"Total transferred: {format_size(stats.added)}")
+        return "\n".join(lines)
+
+    def rows(self, detection_id):
+        """ Column values for bulk inserts into the file_events table. """
+        return [row for batch in self.row_batches(detection_id) for row in batch]
+
+    def row_batches(self, detection_id, size=ROW_BATCH, start=0, stop=None):
+        """ ``rows`` (of events ``start`` up to ``stop``) in lists of at most ``size``, without holding them all. """
+        batch = []
+        for sequence, (timestamp, action, path, event_size, destination, reconciled) in enumerate(
+                self.entries(start, stop), start):
+            batch.append({'detection_id': detection_id, 'sequence': sequence, 'timestamp': timestamp,
+                          'action': int(action), 'path': path, 'size': event_size, 'destination': destination,
+                          'reconciled': reconciled})
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def discard(self):
+        """ Drop whatever the log keeps outside memory, once it has been saved. """
+
+    @classmethod
+    def from_rows(cls, rows):
+        """ Rebuild from (timestamp, action, path, size, destination[, reconciled]) rows in order. """
+        log = cls()
+        for timestamp, action, path, size, destination, *reconciled in rows:
+            log.record(Action(action), path, size, destination, timestamp, bool(reconciled and reconciled[0]))
+        return log
+
+    @classmethod
+    def from_text(cls, logs):
+        """ Read events back from log text (sizes are the rounded logged values). """
+        log = cls()
+        for timestamp, label, path, size in parse_logs(logs or ''):
+            action = ACTIONS.get(label)
+            if action is None:
+                continue
+            if action == Action.MOVED:
+                log.record(action, path[0], None, path[1], timestamp / 1_000_000_000)
+            else:
+                log.record(action, path, size, None, timestamp / 1_000_000_000)
+        return log
+
+    def replay_events(self, start=0):
+        """ (timestamp ns, action label, path, size) tuples for replay.Replay, from event ``start`` on. """
+        for timestamp, action, path, size, destination in self.records(start):
+            if action not in FILE_ACTIONS:
+                continue
+            if action == Action.MOVED:
+                path = (path, destination)
+            yield int(timestamp * 1_000_000_000), LABELS[action], path, size
+
+
+class PathSizes:
+    """
+    Last known size per path, for the ``capacity`` most recently written paths.
+
+    A build running off a stick writes millions of distinct temporary files;
+    past the capacity, the paths written longest ago are dropped (a batch at a
+    time) and counted in ``evicted``. Paths written again and again stay, so
+    their deltas remain exact; a dropped file written again counts with its
+    whole size, like a file the watcher has never seen, and its deletion is
+    not counted at all.
+
+    The recency order is the insertion order of a plain dict, a written path
+    being inserted anew, so a path costs no more than in the dict the watcher
+    kept before; an OrderedDict's links take 60% more.
+    """
+
+    __slots__ = ('sizes', 'capacity', 'evicted')
+
+    def __init__(self, capacity=PATH_CAPACITY):
+        self.sizes = {}  # path -> size, least recently written first
+        self.capacity = capacity
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def __contains__(self, path):
+        return path in self.sizes
+
+    def __iter__(self):
+        return iter(self.sizes)
+
+    def __getitem__(self, path):
+        return self.sizes[path]
+
+    def __setitem__(self, path, size):
+        sizes = self.sizes
+        sizes.pop(path, None)
+        sizes[path] = size
+        if len(sizes) > self.capacity:
+            self._evict()
+
+    def _evict(self):
+        # In one pass: dropping the oldest path one at a time would go over the
+        # slots already emptied at the front of the dict each time
+        sizes = self.sizes
+        oldest = list(itertools.islice(sizes, len(sizes) - self.capacity + self.capacity // PATH_EVICT_BATCH))
+        for path in oldest:
+            del sizes[path]
+        self.evicted += len(oldest)
+
+    def get(self, path, default=None):
+        return self.sizes.get(path, default)
+
+    def pop(self, path, default=None):
+        return self.sizes.pop(path, default)
+
+    def items(self):
+        return self.sizes.items()
+
+
+class TransferStats:
+    """
+    Bytes written to and removed from a drive, from the sizes the watcher logs.
+
+    A modify event carries the file's new size, not what was written, so adding
+    sizes up counts a file that is appended to ten times ten times over.
+    ``TransferStats`` remembers the last size seen per path and only accounts
+    the change: growth is counted as added bytes, shrinking and deletes as
+    removed bytes. Files the watcher has not seen before (they were on the drive
+    already) count with their whole size the first time they are written.
+
+    Besides the totals, added and removed bytes are kept per file extension and
+    per top-level folder of the drive; every event costs a few dict lookups.
+    The sizes are kept in a ``PathSizes``, so only so many paths are remembered.
+    """
+
+    def __init__(self, root=None, sizes=None):
+        self.root = root.rstrip('\\/') if root else root
+        self.sizes = PathSizes() if sizes is None else sizes  # path -> last known size
+        self.added = 0
+        self.removed = 0
+        self.extensions = {}  # extension -> [added, removed]
+        self.folders = {}  # top-level folder -> [added, removed]
+
+    @property
+    def net(self):
+        return self.added - self.removed
+
+    def account(self, action, path, size=None, destination=None):
+        sizes = self.sizes
+        if action == Action.MOVED:
+            replaced = sizes.pop(destination, None)
+            if replaced:
+                self._count(destination, -replaced)
+            if path in sizes:
+                sizes[destination] = sizes.pop(path)
+        elif action == Action.DELETED:
+            previous = sizes.pop(path, None)
+            if previous:
+                self._count(path, -previous)
+        elif size is not None and action in (Action.CREATED, Action.MODIFIED):
+            previous = sizes.get(path, 0)
+            sizes[path] = size
+            if size != previous:
+                self._count(path, size - previous)
+
+    def _count(self, path, delta):
+        name = path[max(path.rfind('/'), path.rfind('\\')) + 1:]
+        extension = os.path.splitext(name)[1].lower() or NO_EXTENSION
+        folder = self.folder_of(path)
+        if delta > 0:
+            self.added += delta
+            index = 0
+        else:
+            self.removed -= delta
+            delta = -delta
+            index = 1
+        counts = self.extensions.get(extension)
+        if counts is None:
+            counts = self.extensions[extension] = [0, 0]
+        counts[index] += delta
+        counts = self.folders.get(folder)
+        if counts is None:
+            counts = self.folders[folder] = [0, 0]
+        counts[index] += delta
+
+    def folder_of(self, path):
+        root = self.root
+        if root and path.startswith(root):
+            path = path[len(root):]
+        elif len(path) > 1 and path[1] == ':':
+            path = path[2:]
+        path = path.lstrip('\\/')
+        ends = [end for end in (path.find('\\'), path.find('/')) if end >= 0]
+        return path[:min(ends)] if ends else ROOT_FOLDER
+
+    def summary(self):
+        """ JSON-ready totals, stored with the detection. """
+        return {'added': self.added, 'removed': self.removed,
+                'extensions': {extension: list(counts) for extension, counts in self.extensions.items()},
+                'folders': {folder: list(counts) for folder, counts in self.folders.items()}}
+
+    @classmethod
+    def of(cls, records, root=None):
+        """ Stats of (timestamp, action, path, size, destination) records, for sessions stored without them. """
+        stats = cls(root)
+        for _, action, path, size, destination in records:
+            stats.account(action, path, size, destination)
+        return stats
+
+
+class SpooledEventLog(EventLog):
+    """
+    EventLog that keeps at most ``limit`` events in memory.
+
+    Older events are appended to segment files under ``folder`` (and the
+    path table is started afresh), so a drive left connected for weeks costs
+    disk space rather than memory. ``events`` and ``paths`` only cover the
+    part still in memory; ``records`` goes through the segments first.
+
+    Segment files are named after ``session`` (the detection id while a
+    flusher is writing the session to the database) and the sequence number
+    of their first event, which is what ``recover_segments`` reads back after
+    a crash.
+    """
+
+    def __init__(self, limit=SPILL_EVENTS, folder=SPILL_DIR, session=None):
+        super().__init__()
+        self.limit = limit
+        self.folder = folder
+        self.session = f"s{os.getpid()}_{id(self):x}" if session is None else session
+        self.segments = []  # [path, first sequence, events]
+        self.segment_size = 0
+        self.spilled = 0
+
+    def __len__(self):
+        return self.spilled + len(self.events)
+
+    def record(self, action, path, size=None, destination=None, timestamp=None, reconciled=False):
+        event = super().record(action, path, size, destination, timestamp, reconciled)
+        if len(self.events) >= self.limit:
+            self.spill()
+        return event
+
+    def spill(self, sync=False):
+        """ Append the events in memory to the current segment and forget them; ``sync`` waits for the disk. """
+        if not self.events:
+            return
+        if not self.segments or self.segment_size >= SEGMENT_BYTES:
+            os.makedirs(self.folder, exist_ok=True)
+            segment = os.path.join(self.folder, f"events_{self.session}_{self.spilled:012d}.seg")
+            self.segments.append([segment, self.spilled, 0])
+            self.segment_size = 0
+        data = bytearray()
+        encoded = [path.encode('utf-8', 'surrogatepass') for path in self.paths]
+        for event in self.events:
+            path = encoded[event.path]
+            destination = b'' if event.destination is None else encoded[event.destination]
+            action = event.action | _RECONCILED if event.reconciled else event.action
+            data += _RECORD.pack(event.timestamp, action, -1 if event.size is None else event.size,
+                                 len(path), 0 if event.destination is None else len(destination) + 1)
+            data += path
+            data += destination
+        with open(self.segments[-1][0], 'ab') as f:
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        self.segment_size += len(data)
+        self.segments[-1][2] += len(self.events)
+        self.spilled += len(self.events)
+        self.events = []
+        self.paths = []
+        self.path_ids = {}
+
+    def entries(self, start=0, stop=None):
+        for segment, first, count in list(self.segments):
+            if first + count <= start:
+                continue
+            if stop is not None and first >= stop:
+                return
+            skip = max(start - first, 0)
+            take = count - skip if stop is None else min(count, stop - first) - skip
+            yield from itertools.islice(read_segment(segment), skip, skip + take)
+        spilled = self.spilled
+        yield from super().entries(max(start - spilled, 0), None if stop is None else max(stop - spilled, 0))
+
+    @classmethod
+    def resume(cls, session, segments, folder=SPILL_DIR):
+        """ The log of a session from the (first sequence, path) segments it left on disk. """
+        log = cls(folder=folder, session=session)
+        for first, segment in segments:
+            count = sum(1 for _ in read_segment(segment))
+            log.segments.append([segment, first, count])
+            log.spilled = first + count
+        return log
+
+    def mark_flushed(self, count):
+        """ Note that the first ``count`` events are in the database; segments holding only those go. """
+        self.flushed = count
+        while self.segments and self.segments[0][1] + self.segments[0][2] <= count:
+            segment = self.segments.pop(0)[0]
+            try:
+                os.remove(segment)
+            except OSError as e:
+                print("SpooledEventLog mark_flushed give Error: ", str(e))
+            if not self.segments:
+                self.segment_size = 0
+
+    def discard(self):
+        for segment, _, _ in self.segments:
+            try:
+                os.remove(segment)
+            except OSError as e:
+                print("SpooledEventLog discard give Error: ", str(e))
+        self.segments = []
+        self.segment_size = 0
+
+
+def recover_segments(folder=SPILL_DIR):
+    """
+    Segments left behind by sessions that never reached the database.
+
+    Returns {session: [(first sequence, path), ...]} in sequence order.
+    """
+    sessions = {}
+    if not os.path.isdir(folder):
+        return sessions
+    for name in os.listdir(folder):
+        if not (name.startswith('events_') and name.endswith('.seg')):
+            continue
+        session, _, first = name[len('events_'):-len('.seg')].rpartition('_')
+        if session and first.isdigit():
+            sessions.setdefault(session, []).append((int(first), os.path.join(folder, name)))
+    for segments in sessions.values():
+        segments.sort()
+    return sessions
+
+
+def read_segment(segment):
+    """ (timestamp, action, path, size, destination, reconciled) entries of a spilled segment file. """
+    with open(segment, 'rb') as f:
+        while True:
+            header = f.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return
+            timestamp, action, size, path_length, destination_length = _RECORD.unpack(header)
+            data = f.read(path_length + max(destination_length - 1, 0))
+            if len(data) < path_length + max(destination_length - 1, 0):
+                return  # cut short by a crash while the record was written
+            path = data[:path_length].decode('utf-8', 'surrogatepass')
+            destination = None
+            if destination_length:
+                destination = data[path_length:].decode('utf-8', 'surrogatepass')
+            yield (timestamp, Action(action & ~_RECONCILED), path, None if size < 0 else size, destination,
+                   bool(action & _RECONCILED))
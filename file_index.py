@@ -0,0 +1,65 @@
+"""
+Paths and names recorded in the file index.
+
+Index entries are normalized so that a search does not depend on case or on
+the separator style of the machine that recorded the drive: paths are
+relative to the drive root, '/' separated and lower-case, and names are the
+last path component.
+"""
+import re
+
+from replay import MOVED, parse_logs
+
+_DRIVE = re.compile(r'^[A-Za-z]:')
+
+
+def normalize_path(path, root=None):
+    """ Index form of ``path``; ``root`` (or a Windows drive letter) is stripped off. """
+    if root and path.startswith(root):
+        path = path[len(root):]
+    elif _DRIVE.match(path):
+        path = path[2:]
+    return path.replace('\\', '/').strip('/').lower()
+
+
+def name_of(path):
+    return path.rpartition('/')[2]
+
+
+def manifest_paths(manifest):
+    """ Index paths of every entry of a Manifest (the root itself excluded). """
+    return [path.lower() for path in manifest.paths()[1:]]
+
+
+def activity_paths(logs, root=None, start=0, stop=None):
+    """
+    Index paths of everything in an EventLog (or legacy log text); moves count for both ends.
+
+    ``start`` and ``stop`` limit an EventLog to part of its events.
+    """
+    if isinstance(logs, str) or logs is None:
+        logged = []
+        for _, action, path, _ in parse_logs(logs or ''):
+            logged.extend(path if action == MOVED else (path,))
+    else:
+        logged = logs.touched_paths(start, stop)
+    paths = set()
+    for path in logged:
+        normalized = normalize_path(path, root)
+        if normalized:
+            paths.add(normalized)
+    return paths
+
+
+def parse_query(query):
+    """
+    ('path' or 'name', normalized value, is_pattern) for a search box entry.
+
+    A query with a separator looks up a whole path, anything else a file or
+    folder name; '*' and '?' make it a wildcard pattern.
+    """
+    query = query.strip()
+    is_pattern = '*' in query or '?' in query
+    if '/' in query or '\\' in query:
+        return 'path', normalize_path(query), is_pattern
+    return 'name', query.lower(), is_pattern
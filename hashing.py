@@ -0,0 +1,127 @@
+"""
+Content hashing of the files recorded in a drive snapshot.
+
+Files are read in fixed-size chunks on a process pool. A cache of earlier
+results, keyed by path with the size and mtime the hash was taken at, lets
+unchanged files be skipped entirely on re-insertion. Each file is stat'ed
+again for that: a rescan copies the entries of unchanged folders over from
+the previous manifest, so a file rewritten in place can still carry its old
+size and mtime there.
+"""
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from manifest import FLAG_DIR, FLAG_ERROR
+
+ALGORITHMS = ('blake2b', 'sha256')
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path, algorithm='blake2b', chunk_size=CHUNK_SIZE):
+    """ Return (hex digest, bytes read) for one file. """
+    digest = hashlib.new(algorithm)
+    read = 0
+    with open(path, 'rb', buffering=0) as f:
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])
+            read += n
+    return digest.hexdigest(), read
+
+
+class HashStats:
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.cached = 0
+        self.failed = 0
+        self.seconds = 0.0
+
+    @property
+    def mb_per_second(self):
+        return self.bytes / (1024 ** 2) / self.seconds if self.seconds else 0.0
+
+    @property
+    def files_per_second(self):
+        return self.files / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"hashed {self.files} files ({self.bytes / (1024 ** 2):.1f} MB) in {self.seconds:.2f}s: "
+                f"{self.mb_per_second:.1f} MB/s, {self.files_per_second:.1f} files/s, "
+                f"{self.cached} from cache, {self.failed} failed")
+
+
+def hash_manifest(manifest, cache=None, algorithm='blake2b', workers=None, in_flight=None,
+                  chunk_size=CHUNK_SIZE):
+    """
+    Hash every file of ``manifest`` that is not already in ``cache``.
+
+    ``cache`` maps relative path to (size, mtime, digest); an entry is reused
+    when size and mtime still match the file on the drive, not just the
+    manifest. ``workers`` is the number of
+    hashing processes (CPU side) and ``in_flight`` the number of files being
+    read at once (IO side, defaults to twice the workers).
+
+    Returns ({relative path: (size, mtime, digest)}, HashStats).
+    """
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unsupported hash algorithm {algorithm}")
+    cache = cache or {}
+    workers = workers or os.cpu_count() or 1
+    in_flight = in_flight or workers * 2
+    stats = HashStats()
+    results = {}
+    start = time.perf_counter()
+
+    todo = []
+    paths = manifest.paths()
+    for row, flags in enumerate(manifest.flags):
+        if flags & (FLAG_DIR | FLAG_ERROR):
+            continue
+        path = paths[row]
+        try:
+            stat = os.stat(os.path.join(manifest.root, *path.split('/')))
+        except OSError as e:
+            print(f"hashing {path} give: ", str(e))
+            stats.failed += 1
+            continue
+        size, mtime = stat.st_size, stat.st_mtime_ns
+        cached = cache.get(path)
+        if cached is not None and cached[0] == size and cached[1] == mtime:
+            results[path] = cached
+            stats.cached += 1
+        else:
+            todo.append((path, size, mtime))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        queue = iter(todo)
+        while True:
+            for path, size, mtime in queue:
+                absolute = os.path.join(manifest.root, *path.split('/'))
+                pending[pool.submit(hash_file, absolute, algorithm, chunk_size)] = (path, size, mtime)
+                if len(pending) >= in_flight:
+                    break
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, size, mtime = pending.pop(future)
+                try:
+                    digest, read = future.result()
+                except OSError as e:
+                    print(f"hashing {path} give: ", str(e))
+                    stats.failed += 1
+                    continue
+                results[path] = (size, mtime, digest)
+                stats.files += 1
+                stats.bytes += read
+
+    stats.seconds = time.perf_counter() - start
+    return results, stats
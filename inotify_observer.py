@@ -0,0 +1,402 @@
+"""
+Native inotify watching of drives on Linux, without watchdog's emitters.
+
+watchdog reports every write() to a file as a modification and runs its own
+reader threads for every watch. ``InotifyObserver`` reads a single inotify
+instance for every attached drive on one thread and reports a file once it
+is closed after writing (IN_CLOSE_WRITE): a completed copy is one created
+event, looked up at its final size, instead of a created event and a
+modification per chunk. Writes in progress (IN_MODIFY) are only noted, and a
+file opened for writing and closed unchanged is not reported at all.
+
+The files already in a folder when it gets created are reported by listing
+it right after it is watched. A file or folder created between the watch and
+the listing also has its IN_CREATE queued: that one is not reported again,
+and a file's close only reports a modification if it changed since it was
+listed (still being written then, say).
+
+Renames are paired by the cookie IN_MOVED_FROM and IN_MOVED_TO share. A
+rename whose other half does not follow moved the file off the drive or onto
+it and is reported as a deletion or a creation. IN_Q_OVERFLOW, sent when the
+kernel queue filled up and events were dropped, is counted in ``overflows``:
+folders created in the meantime are watched, and every drive is sent a
+WatchOverflowEvent so that it rescans. A folder that cannot be watched (out
+of inotify watches, say) gets a WatchErrorEvent.
+
+The observer offers the part of watchdog's Observer API the watcher uses
+(schedule, unschedule, start, stop, join) and dispatches watchdog's event
+objects, so USBEventHandler and WatchRouter work with it unchanged.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import stat
+import struct
+import sys
+import threading
+import time
+
+from watchdog.events import (DirCreatedEvent, DirDeletedEvent, DirMovedEvent, FileCreatedEvent,
+                             FileDeletedEvent, FileModifiedEvent, FileMovedEvent, generate_sub_moved_events)
+
+from reconcile import WatchErrorEvent, WatchOverflowEvent
+
+# Bytes read from the inotify descriptor at a time
+READ_SIZE = 64 * 1024
+# Seconds an IN_MOVED_FROM at the end of a read waits for its IN_MOVED_TO
+MOVE_WAIT = 0.05
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+
+_EVENT = struct.Struct('iIII')  # wd, mask, cookie, length of the name that follows
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+def available():
+    """ Whether this system has inotify. """
+    return _libc is not None
+
+
+class InotifyWatch:
+    """ A drive scheduled on an InotifyObserver, as returned by ``schedule``. """
+
+    def __init__(self, path, handler, recursive):
+        self.path = path
+        self.handler = handler
+        self.recursive = recursive
+        self.descriptors = set()  # watch descriptors of the drive's directories
+
+
+class InotifyObserver(threading.Thread):
+    """ Watches any number of drives through one inotify instance and one thread. """
+
+    def __init__(self):
+        super().__init__(name='inotify-observer', daemon=True)
+        if _libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available on this system")
+        self.fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"inotify_init1: {os.strerror(error)}")
+        self.wake_read, self.wake_write = os.pipe()
+        # Held while events are dispatched, so nothing reaches a drive after unschedule()
+        self.lock = threading.Lock()
+        self.directories = {}  # watch descriptor -> [directory path, InotifyWatch]
+        self.paths = {}  # directory path -> watch descriptor
+        self.moves = {}  # cookie -> (path, is_directory, InotifyWatch, deadline)
+        self.created = set()  # files created and not closed yet
+        self.written = set()  # files written to since they were last closed
+        # Files the listing of a new folder reported -> (size, mtime) then; kept until the
+        # events queued meanwhile were read, the ones an IN_CREATE came for until closed
+        self.listed = {}
+        self.listed_before = {}
+        self.reported = {}
+        self.stopping = False
+        self.events = 0
+        self.overflows = 0
+        self.failed_watches = 0
+
+    def schedule(self, handler, path, recursive=True):
+        watch = InotifyWatch(path, handler, recursive)
+        with self.lock:
+            if recursive:
+                self._add_tree(path, watch)
+            else:
+                self._add(path, watch)
+        return watch
+
+    def unschedule(self, watch):
+        with self.lock:
+            for descriptor in list(watch.descriptors):
+                _libc.inotify_rm_watch(self.fd, descriptor)
+                self._forget(descriptor)
+            for cookie in [cookie for cookie, move in self.moves.items() if move[2] is watch]:
+                del self.moves[cookie]
+            prefix = watch.path.rstrip(os.sep) + os.sep
+            for pending in (self.created, self.written):
+                pending.difference_update([path for path in pending if path.startswith(prefix)])
+            for listed in (self.listed, self.listed_before, self.reported):
+                for path in [path for path in listed if path.startswith(prefix)]:
+                    del listed[path]
+
+    def stop(self):
+        self.stopping = True
+        os.write(self.wake_write, b'x')
+
+    def run(self):
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        poller.register(self.wake_read, select.POLLIN)
+        try:
+            while not self.stopping:
+                timeout = None
+                if self.moves:
+                    deadline = min(move[3] for move in self.moves.values())
+                    timeout = max(deadline - time.monotonic(), 0) * 1000
+                poller.poll(timeout)
+                data = self._read()
+                with self.lock:
+                    try:
+                        self._process(data)
+                        self._expire_moves(time.monotonic())
+                        # whatever was queued while those folders were listed has been read now
+                        self.listed_before, self.listed = self.listed, {}
+                    except Exception as e:
+                        print("InotifyObserver give Error: ", str(e))
+        finally:
+            os.close(self.fd)
+            os.close(self.wake_read)
+            os.close(self.wake_write)
+
+    def _read(self):
+        chunks = []
+        while True:
+            try:
+                chunk = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def _process(self, data):
+        offset = 0
+        while offset < len(data):
+            descriptor, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            self.events += 1
+            if mask & IN_Q_OVERFLOW:
+                self._overflowed()
+                continue
+            if mask & IN_IGNORED:
+                self._forget(descriptor)
+                continue
+            entry = self.directories.get(descriptor)
+            if entry is None or not name:
+                continue
+            directory, watch = entry
+            path = os.path.join(directory, os.fsdecode(name))
+            is_directory = bool(mask & IN_ISDIR)
+            if mask & IN_MOVED_TO:
+                self._moved_to(cookie, path, is_directory, watch)
+                continue
+            # The two halves of a rename come one after the other
+            self._expire_moves(None)
+            if mask & IN_MOVED_FROM:
+                self.moves[cookie] = (path, is_directory, watch, time.monotonic() + MOVE_WAIT)
+            elif mask & IN_CREATE:
+                self._created(path, is_directory, watch)
+            elif mask & IN_MODIFY:
+                self.written.add(path)
+            elif mask & IN_CLOSE_WRITE:
+                listed = self.reported.pop(path, None)
+                if path in self.created:
+                    self.created.discard(path)
+                    self.written.discard(path)
+                    self._dispatch(watch, FileCreatedEvent(path))
+                elif path in self.written:
+                    self.written.discard(path)
+                    if listed is None or listed != self._status(path):
+                        self._dispatch(watch, FileModifiedEvent(path))
+            elif mask & IN_DELETE:
+                self._deleted(path, is_directory, watch)
+
+    def _overflowed(self):
+        self.overflows += 1
+        print("InotifyObserver: the kernel event queue overflowed, some events were lost")
+        # Nothing pending can be trusted any more; the rescans take over
+        self.moves.clear()
+        self.created.clear()
+        self.written.clear()
+        self.reported.clear()
+        watches = {id(watch): watch for _, watch in self.directories.values()}
+        for watch in watches.values():
+            if watch.recursive:
+                self._add_tree(watch.path, watch)
+            self._dispatch(watch, WatchOverflowEvent(watch.path))
+
+    def _created(self, path, is_directory, watch):
+        listed = self.listed_before.pop(path, None) or self.listed.pop(path, None)
+        if listed is not None:
+            # created after its folder was watched, before it was listed: reported already
+            if not is_directory:
+                self.reported[path] = listed
+            return
+        if is_directory:
+            self._dispatch(watch, DirCreatedEvent(path))
+            if watch.recursive:
+                self._add_tree(path, watch, report=True)
+            return
+        try:
+            status = os.lstat(path)
+        except OSError:
+            status = None
+        # Links and special files are never written to, so they are reported right away
+        if status is not None and (not stat.S_ISREG(status.st_mode) or status.st_nlink > 1):
+            self._dispatch(watch, FileCreatedEvent(path))
+        else:
+            self.created.add(path)
+
+    def _deleted(self, path, is_directory, watch):
+        self.written.discard(path)
+        for listed in (self.listed, self.listed_before, self.reported):
+            listed.pop(path, None)
+        if path in self.created:
+            # created and removed again before it was ever closed
+            self.created.discard(path)
+            return
+        self._dispatch(watch, DirDeletedEvent(path) if is_directory else FileDeletedEvent(path))
+
+    def _moved_to(self, cookie, path, is_directory, watch):
+        source = self.moves.pop(cookie, None)
+        self._expire_moves(None)
+        if source is None or source[2] is not watch:
+            # moved onto the drive from somewhere that is not watched with it
+            if source is not None:
+                self._moved_away(*source[:3])
+            if is_directory:
+                self._created(path, True, watch)
+            else:
+                self._dispatch(watch, FileCreatedEvent(path))
+            return
+        origin = source[0]
+        if is_directory:
+            self._rename(origin, path)
+            self._dispatch(watch, DirMovedEvent(origin, path))
+            for event in generate_sub_moved_events(origin, path):
+                self._dispatch(watch, event)
+        elif origin in self.created:
+            # still being written; it is reported under its new name once closed
+            self.created.discard(origin)
+            self.created.add(path)
+        else:
+            if origin in self.written:
+                self.written.discard(origin)
+                self.written.add(path)
+            self._dispatch(watch, FileMovedEvent(origin, path))
+
+    def _moved_away(self, path, is_directory, watch):
+        """ Report a rename whose destination is not on the drive as a deletion. """
+        if is_directory:
+            # the directory is still watched wherever it went
+            prefix = path + os.sep
+            for directory in [directory for directory in self.paths
+                              if directory == path or directory.startswith(prefix)]:
+                descriptor = self.paths[directory]
+                _libc.inotify_rm_watch(self.fd, descriptor)
+                self._forget(descriptor)
+            self._dispatch(watch, DirDeletedEvent(path))
+        else:
+            self._deleted(path, False, watch)
+
+    def _expire_moves(self, now):
+        """ Give up on the IN_MOVED_TO of renames that waited past their deadline (all of them if ``now`` is None). """
+        for cookie in [cookie for cookie, move in self.moves.items() if now is None or move[3] <= now]:
+            self._moved_away(*self.moves.pop(cookie)[:3])
+
+    def _rename(self, origin, destination):
+        prefix = origin + os.sep
+        for directory in [directory for directory in self.paths
+                          if directory == origin or directory.startswith(prefix)]:
+            descriptor = self.paths.pop(directory)
+            renamed = destination + directory[len(origin):]
+            self.paths[renamed] = descriptor
+            self.directories[descriptor][0] = renamed
+        for pending in (self.created, self.written):
+            for path in [path for path in pending if path.startswith(prefix)]:
+                pending.discard(path)
+                pending.add(destination + path[len(origin):])
+
+    def _add(self, directory, watch):
+        descriptor = _libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if descriptor < 0:
+            error = ctypes.get_errno()
+            if error not in (errno.ENOENT, errno.ENOTDIR):
+                self.failed_watches += 1
+                print(f"InotifyObserver give Error: cannot watch {directory}: {os.strerror(error)}")
+                self._dispatch(watch, WatchErrorEvent(directory))
+            return None
+        self.directories[descriptor] = [directory, watch]
+        self.paths[directory] = descriptor
+        watch.descriptors.add(descriptor)
+        return descriptor
+
+    def _add_tree(self, top, watch, report=False):
+        """ Watch ``top`` and every directory below it; with ``report`` dispatch what is already in them. """
+        folders = [top]
+        while folders:
+            folder = folders.pop()
+            if self._add(folder, watch) is None:
+                continue
+            try:
+                with os.scandir(folder) as entries:
+                    entries = list(entries)
+            except OSError:
+                continue
+            for entry in entries:
+                is_directory = entry.is_dir(follow_symlinks=False)
+                if is_directory:
+                    folders.append(entry.path)
+                if not report:
+                    continue
+                status = self._status(entry.path)
+                if status is not None:
+                    self.listed[entry.path] = status
+                self._dispatch(watch, DirCreatedEvent(entry.path) if is_directory else FileCreatedEvent(entry.path))
+
+    @staticmethod
+    def _status(path):
+        """ (size, mtime) of a file or folder, None if it is gone. """
+        try:
+            status = os.lstat(path)
+        except OSError:
+            return None
+        return status.st_size, status.st_mtime_ns
+
+    def _forget(self, descriptor):
+        entry = self.directories.pop(descriptor, None)
+        if entry is not None:
+            directory, watch = entry
+            if self.paths.get(directory) == descriptor:
+                del self.paths[directory]
+            watch.descriptors.discard(descriptor)
+
+    def _dispatch(self, watch, event):
+        try:
+            watch.handler.dispatch(event)
+        except Exception as e:
+            print("InotifyObserver dispatch give Error: ", str(e))
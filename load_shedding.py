@@ -0,0 +1,132 @@
+"""
+Overload mode for floods of file events on one drive.
+
+A ``git checkout`` or ransomware running on a stick rewrites thousands of
+files a second, and logging every one of those writes makes the event log,
+its text and its database rows balloon. ``LoadShedder`` counts the raw
+events a USBEventHandler receives per second; once more than ``rate`` arrive
+in a second it starts shedding, and once ``calm`` seconds in a row stay
+below half that rate it stops.
+
+While shedding, only the writes (created and modified files) are left out of
+the log; they are counted per folder in ``folders``, with the time of the
+first and the last, so the log grows with the folders a flood touches rather
+than with its files. Everything else stays exact:
+
+* the bytes of TransferStats and the per-action counts of the handler still
+  see every event, and so does the state the reconciler replays;
+* moves, deletions, folder events and reconciled events are always logged.
+
+The log itself records each episode: a SHEDDING_STARTED event when it
+begins, and when it ends a SHED event per folder (the writes left out, at
+the time of the first) followed by SHEDDING_STOPPED with the writes left out
+in all. The episode is also printed with its busiest folders and kept in
+``episodes``; ``summary`` is what the detection stores of them.
+"""
+import os
+import time
+
+from file_events import Action
+
+# Raw events per second on one drive above which its log is thinned out, 0 to never shed
+SHED_RATE = 2_000
+# Seconds in a row below half that rate before shedding stops
+SHED_CALM = 5
+# Folders with the most writes shed that an episode keeps, for the detection
+SHED_FOLDERS = 100
+
+
+class LoadShedder:
+    """ Decides which of a handler's events get logged while the drive is flooded. """
+
+    def __init__(self, record, name=None, rate=SHED_RATE, calm=SHED_CALM):
+        self.record = record  # record(action, path, size, destination, timestamp) logs an event
+        self.name = name
+        self.rate = rate
+        self.calm = calm
+        self.active = False
+        self.second = 0
+        self.count = 0  # raw events during ``second``
+        self.quiet = 0  # seconds in a row below half the rate, while active
+        self.folders = {}  # folder -> [writes shed, first, last timestamp], this episode
+        self.started = None
+        self.shed = 0  # writes never logged, over all episodes
+        self.episodes = []  # finished episodes, as ``episode`` describes them
+
+    def tick(self, timestamp):
+        """ Count one raw event seen at ``timestamp``. """
+        second = int(timestamp)
+        if second > self.second:
+            self._second_over(second)
+        self.count += 1
+
+    def settle(self, now=None):
+        """ Let a flood end while no events come in at all. """
+        if self.active:
+            second = int(time.time() if now is None else now)
+            if second > self.second:
+                self._second_over(second)
+
+    def _second_over(self, second):
+        # ``count`` events came in during ``self.second``, none in the seconds up to ``second``
+        if self.active:
+            idle = second - self.second - 1
+            self.quiet = self.quiet + 1 + idle if self.count * 2 < self.rate else idle
+            if self.quiet >= self.calm:
+                self.stop(second)
+        elif self.rate and self.count > self.rate:
+            # from the start of the second that went over the rate
+            self.start(self.second)
+        self.second = second
+        self.count = 0
+
+    def start(self, now=None):
+        self.active = True
+        self.quiet = 0
+        self.started = time.time() if now is None else now
+        self.record(Action.SHEDDING_STARTED, self.name or '', self.rate, None, self.started)
+        print(f"Load shedding started on {self.name}: more than {self.rate} events/s")
+
+    def stop(self, now=None):
+        """ Log what the episode left out and leave overload mode. """
+        if not self.active:
+            return
+        episode = self.episode(time.time() if now is None else now)
+        for folder, (writes, first, _) in sorted(self.folders.items(), key=lambda item: item[1][1]):
+            self.record(Action.SHED, folder, writes, None, first)
+        self.record(Action.SHEDDING_STOPPED, self.name or '', episode['shed'], None, episode['stopped'])
+        self.episodes.append(episode)
+        print(f"Load shedding stopped on {self.name} after {episode['stopped'] - episode['started']:.0f}s: "
+              f"{episode['shed']} writes in {episode['folders']} folders not logged"
+              + "".join(f", {folder} {counts[0]}" for folder, counts in list(episode['busiest'].items())[:3]))
+        self.active = False
+        self.folders = {}
+
+    def episode(self, stopped=None):
+        """ JSON-ready start, stop, writes shed and busiest folders ({folder: [writes, first, last]}). """
+        busiest = sorted(self.folders.items(), key=lambda item: item[1][0], reverse=True)[:SHED_FOLDERS]
+        return {'started': self.started, 'stopped': stopped,
+                'shed': sum(counts[0] for counts in self.folders.values()),
+                'folders': len(self.folders),
+                'busiest': {folder: list(counts) for folder, counts in busiest}}
+
+    def summary(self):
+        """ Writes shed and the episodes so far, the one still running last with no stop time. """
+        return {'shed': self.shed,
+                'episodes': self.episodes + ([self.episode()] if self.active else [])}
+
+    def admit(self, action, path, timestamp=None):
+        """ Whether an event goes to the log; the writes that do not are counted per folder. """
+        if action != Action.CREATED and action != Action.MODIFIED:
+            return True
+        if timestamp is None:
+            timestamp = time.time()
+        self.shed += 1
+        folder = os.path.dirname(path)
+        counts = self.folders.get(folder)
+        if counts is None:
+            self.folders[folder] = [1, timestamp, timestamp]
+        else:
+            counts[0] += 1
+            counts[2] = timestamp
+        return False
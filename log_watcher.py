@@ -1,100 +1,311 @@
+import contextlib
 import time
 import os
-import math
 import threading
-from datetime import datetime, timedelta
-from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
+import inotify_observer
+from coalescer import Coalescer, QUIET_WINDOW
+from event_flusher import EventFlusher
+from reconcile import Reconciler, watchdog_observer
+from stat_worker import StatWorker, STAT_WORKERS
+from load_shedding import LoadShedder
+from file_events import Action, FILE_ACTIONS, PathSizes, SpooledEventLog, TransferStats, format_size
+from watcher_metrics import DriveMetrics, MetricsDump, METRICS_INTERVAL
+
+# What watches the drives: 'inotify' (Linux only), 'watchdog', or 'auto' for inotify where there is one
+WATCH_BACKEND = 'auto'
+
 
 class USBEventHandler(FileSystemEventHandler):
-    def __init__(self):
-        self.total_transferred = 0
-        self.file_events = {}
-        self.logs = []  # Store logs here
+    def __init__(self, quiet_window=QUIET_WINDOW, stat_workers=STAT_WORKERS, session=None, root=None, stats=None):
+        self.root = root
+        self.file_events = PathSizes()  # path -> last known size, for the most recently written paths
+        # Bytes added and removed, from size changes rather than whole sizes
+        self.transfers = TransferStats(root, self.file_events)
+        # Store events here (older ones spill to disk); text is only rendered for display
+        self.events = SpooledEventLog(session=session)
+        # Raw watchdog events are merged per path before they reach the log
+        self.coalescer = Coalescer(self.log_event, quiet_window)
+        # Guards the coalescer and the log against the flusher thread
+        self.lock = threading.Lock()
+        self.flusher = None
+        # The callbacks below only queue events; sizes are looked up by the stat worker,
+        # which may be shared with the other drives
+        self.owns_stats = stats is None
+        self.stats = StatWorker(self.deliver, stat_workers) if stats is None else stats
+        # Rescans folders after the observer lost events; ``baseline`` is the insertion
+        # snapshot to compare against, once there is one (see ``set_baseline``)
+        self.started = time.time()
+        self.baseline = None
+        self.reconciler = Reconciler(self)
+        self.overflows = 0
+        self.watch_errors = 0
+        # Event rate, queue depth and latency, for ``snapshot``
+        self.metrics = DriveMetrics()
+        # Events per action, exact even while a flood of events is only partly logged
+        self.actions = dict.fromkeys(FILE_ACTIONS, 0)
+        self.shedder = LoadShedder(self.record, root)
 
     def convert_size(self, size_bytes):
-        if size_bytes == 0:
-            return "0 B"
-        size_name = ("B", "KB", "MB", "GB", "TB")
-        i = int(math.floor(math.log(size_bytes, 1024)))
-        p = math.pow(1024, i)
-        s = round(size_bytes / p, 2)
-        return f"{s} {size_name[i]}"
-
-    def log_event(self, action, path, size=None):
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        if size is not None:
-            log_message = f"[{timestamp}] {action}: {path}, Size: {self.convert_size(size)}"
-            self.logs.append(log_message)
-            self.logs.append(f"Total transferred: {self.convert_size(self.total_transferred)}")
-        else:
-            log_message = f"[{timestamp}] {action}: {path}"
-            self.logs.append(log_message)
+        return format_size(size_bytes)
+
+    def deliver(self, action, path, size, destination, is_directory, timestamp):
+        self.metrics.delivered_event(timestamp)
+        with self.lock:
+            self.shedder.tick(timestamp)
+            self.coalescer.add(action, path, size, destination, is_directory, timestamp)
+
+    def log_event(self, action, path, size=None, destination=None, timestamp=None, reconciled=False):
+        self.actions[action] += 1
+        self.transfers.account(action, path, size, destination)
+        shedder = self.shedder
+        if shedder.active and not reconciled and not shedder.admit(action, path, timestamp):
+            # Left out of the log, but rescans still have to know about it
+            if self.reconciler.state is not None:
+                self.reconciler.logged(time.time() if timestamp is None else timestamp, action, path, size)
+            return
+        self.record(action, path, size, destination, timestamp, reconciled)
+
+    def record(self, action, path, size=None, destination=None, timestamp=None, reconciled=False):
+        event = self.events.record(action, path, size, destination, timestamp, reconciled)
+        if self.reconciler.state is not None:
+            self.reconciler.logged(event.timestamp, action, path, size, destination)
+        if self.flusher is not None and self.flusher.pending() >= self.flusher.batch_events:
+            self.flusher.request()
+
+    def set_baseline(self, manifest):
+        """ Rescan against ``manifest`` (the insertion snapshot), with everything logged so far replayed over it. """
+        flusher = self.flusher
+        # No flush may move events from the log to the database in between
+        with flusher.flushing if flusher is not None else contextlib.nullcontext():
+            stored = flusher.stored() if flusher is not None and self.events.flushed else None
+            with self.lock:
+                self.baseline = manifest
+                self.reconciler.replay(manifest, stored)
+
+    @property
+    def total_transferred(self):
+        return self.transfers.added
+
+    def activity(self):
+        """ JSON-ready events per action and load shedding of the session, stored with the detection. """
+        return {'actions': {action.name.lower(): count for action, count in self.actions.items()},
+                'shedding': self.shedder.summary()}
+
+    def queue(self, action, path, destination=None, is_directory=False):
+        self.metrics.queued += 1
+        self.stats.put(action, path, destination, is_directory, self.deliver)
 
     def on_created(self, event):
         if not event.is_directory:
-            file_size = os.path.getsize(event.src_path)
-            self.total_transferred += file_size
-            self.file_events[event.src_path] = (datetime.now(), file_size, "created")
-            self.log_event("Created", event.src_path, file_size)
+            self.queue(Action.CREATED, event.src_path)
         else:
-            self.log_event("Created directory", event.src_path)
+            self.queue(Action.CREATED_DIRECTORY, event.src_path, is_directory=True)
 
     def on_deleted(self, event):
-        self.log_event("Deleted", event.src_path)
-        if event.src_path in self.file_events:
-            del self.file_events[event.src_path]
+        self.queue(Action.DELETED, event.src_path, is_directory=event.is_directory)
 
     def on_modified(self, event):
         if not event.is_directory:
-            now = datetime.now()
-            file_size = os.path.getsize(event.src_path)
-            if event.src_path in self.file_events:
-                last_event_time, last_size, last_event_type = self.file_events[event.src_path]
-                if last_event_type == "created" and (now - last_event_time) < timedelta(seconds=5):
-                    self.file_events[event.src_path] = (now, file_size, "modified")
-                    return  # Skip logging if recently created
-                if last_size == file_size:
-                    self.file_events[event.src_path] = (now, file_size, "modified")
-                    return  # Skip logging if the size has not changed
-
-            self.total_transferred += file_size
-            self.file_events[event.src_path] = (now, file_size, "modified")
-            self.log_event("Modified", event.src_path, file_size)
+            self.queue(Action.MODIFIED, event.src_path)
 
     def on_moved(self, event):
-        self.log_event("Changed", f"from {event.src_path} to {event.dest_path}")
-        if event.src_path in self.file_events:
-            self.file_events[event.dest_path] = self.file_events.pop(event.src_path)
+        self.queue(Action.MOVED, event.src_path, event.dest_path, event.is_directory)
+
+    def on_overflow(self, event):
+        self.overflows += 1
+        self.reconciler.request(event.src_path)
+
+    def on_watch_error(self, event):
+        self.watch_errors += 1
+        self.reconciler.request(event.src_path)
+
+    def flush(self, force=False):
+        """ Log the coalesced events whose paths have gone quiet (all of them with ``force``). """
+        with self.lock:
+            self.coalescer.flush(force=force)
+            if force:
+                self.shedder.stop()
+
+    def close(self):
+        """ Log everything still queued or pending, once the drive's watch is gone. """
+        self.reconciler.wait()
+        if self.owns_stats:
+            self.stats.close()
+        else:
+            self.stats.sync()
+        self.flush(force=True)
+        if self.flusher is not None:
+            self.flusher.stop()
+
+    def snapshot(self):
+        """ The drive's watcher metrics as a dict, cheap enough to take at any time from any thread. """
+        metrics = self.metrics
+        now = time.time()
+        return {'uptime': now - metrics.started,
+                'raw_events': metrics.delivered,
+                'raw_per_second': metrics.rate.rate(now),
+                'coalesced_events': self.coalescer.emitted,
+                'reconciled_events': self.reconciler.reconciled,
+                'logged_events': len(self.events),
+                # raw events waiting for the stat worker, raw paths waiting out the quiet
+                # window, logged events not in the database yet
+                'queue_depth': metrics.queued - metrics.delivered,
+                'coalescing': len(self.coalescer.pending),
+                'unflushed': self.flusher.pending() if self.flusher is not None else 0,
+                'latency': metrics.latency.summary(),
+                'bytes_added': self.transfers.added,
+                'bytes_removed': self.transfers.removed,
+                'tracked_paths': len(self.file_events),
+                'evicted_paths': self.file_events.evicted,
+                'actions': {action.name.lower(): count for action, count in self.actions.items()},
+                'shedding': self.shedder.active,
+                'shed_events': self.shedder.shed,
+                'overflows': self.overflows,
+                'watch_errors': self.watch_errors}
 
     def get_logs(self):
-        return "\n".join(self.logs)
+        return self.events.text()
+
+    def get_events(self):
+        return self.events
+
+
+class WatchRouter(FileSystemEventHandler):
+    """ Passes each event of the shared observer to the handler of the drive it happened on. """
+
+    def __init__(self):
+        self.routes = {}  # drive root, without a trailing separator -> USBEventHandler
+        self.lengths = []  # distinct lengths of those roots, longest first
+        self.unrouted = 0
 
+    @staticmethod
+    def key(root):
+        return root.rstrip('\\/') or root
 
-class MonitorThread(threading.Thread):
-    def __init__(self, drive_letter):
-        super().__init__()
+    def add(self, root, handler):
+        self.routes[self.key(root)] = handler
+        self.lengths = sorted({len(key) for key in self.routes}, reverse=True)
+
+    def remove(self, root):
+        self.routes.pop(self.key(root), None)
+        self.lengths = sorted({len(key) for key in self.routes}, reverse=True)
+
+    def route(self, path):
+        # One dict lookup per distinct root length: a single one for drive letters
+        for length in self.lengths:
+            if len(path) < length:
+                continue
+            handler = self.routes.get(path[:length])
+            if handler is not None and (path[length:length + 1] in ('', '\\', '/') or path[length - 1] in ':\\/'):
+                return handler
+        return None
+
+    def dispatch(self, event):
+        handler = self.route(event.src_path)
+        if handler is None:
+            self.unrouted += 1
+        else:
+            handler.dispatch(event)
+
+
+class SharedObserver:
+    """ One observer, router and stat worker for every monitored drive. """
+
+    def __init__(self, stat_workers=STAT_WORKERS, backend=WATCH_BACKEND):
+        self.router = WatchRouter()
+        self.stats = StatWorker(workers=stat_workers)
+        self.watches = {}  # drive -> ObservedWatch or InotifyWatch
+        self.lock = threading.Lock()
+        if backend == 'inotify' or backend == 'auto' and inotify_observer.available():
+            # Files are reported once written and closed, on one thread for all drives
+            self.observer = inotify_observer.InotifyObserver()
+        else:
+            self.observer = watchdog_observer()
+        self.observer.start()
+
+    def attach(self, drive, handler):
+        """ Start watching ``drive`` for ``handler``, replacing any earlier watch of it. """
+        with self.lock:
+            self._detach(drive)
+            self.router.add(drive, handler)
+            try:
+                self.watches[drive] = self.observer.schedule(self.router, path=drive, recursive=True)
+            except Exception:
+                self.router.remove(drive)
+                raise
+
+    def detach(self, drive):
+        """ Stop watching ``drive``; once this returns its handler gets no more events. """
+        with self.lock:
+            self._detach(drive)
+
+    def _detach(self, drive):
+        watch = self.watches.pop(drive, None)
+        if watch is not None:
+            try:
+                self.observer.unschedule(watch)
+            except Exception as e:
+                print("SharedObserver unschedule give Error: ", str(e))
+        self.router.remove(drive)
+
+    def snapshot(self):
+        """ {drive: USBEventHandler.snapshot()} of every drive watched. """
+        with self.lock:
+            handlers = {drive: self.router.routes.get(self.router.key(drive)) for drive in self.watches}
+        return {drive: handler.snapshot() for drive, handler in handlers.items() if handler is not None}
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_observer():
+    """ The process-wide SharedObserver, started on first use. """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = SharedObserver()
+            if METRICS_INTERVAL:
+                MetricsDump(_shared.snapshot, METRICS_INTERVAL).start()
+        return _shared
+
+
+class MonitorThread:
+    """ Monitors one drive through the shared observer; it no longer runs a thread of its own. """
+
+    def __init__(self, drive_letter, detection_id=None):
         self.drive_letter = drive_letter
-        self.observer = Observer()
-        self.event_handler = USBEventHandler()
+        self.shared = shared_observer()
+        self.event_handler = USBEventHandler(session=detection_id, root=drive_letter, stats=self.shared.stats)
+        if detection_id is not None:
+            # Activity reaches the database while the drive is connected, not only at removal
+            self.event_handler.flusher = EventFlusher(self.event_handler, detection_id, drive_letter)
 
-    def run(self):
-        # Schedule the event handler to monitor the specified drive
-        self.observer.schedule(self.event_handler, path=self.drive_letter, recursive=True)
-        self.observer.start()  # Start the observer to begin monitoring
+    def start(self):
+        # Add a watch of the drive to the shared observer
+        self.shared.attach(self.drive_letter, self.event_handler)
+        if self.event_handler.flusher is not None:
+            self.event_handler.flusher.start()
         print(f"Monitoring started on {self.drive_letter}...")
 
     def stop(self):
-        # Method to stop the observer from outside the thread
-        self.observer.stop()
-        self.observer.join()
+        # Remove the drive's watch; the observer keeps running for the other drives
+        self.shared.detach(self.drive_letter)
+        self.event_handler.close()
         print(f"Monitoring stopped on {self.drive_letter}")
-        return self.event_handler.get_logs()
+        return self.event_handler.get_events()
+
+
+def watcher_snapshot():
+    """ The metrics of every drive monitored, {drive: snapshot}; empty before monitoring started. """
+    shared = _shared
+    return shared.snapshot() if shared is not None else {}
 
 
-def start_monitoring(drive_letter):
-    monitor_thread = MonitorThread(drive_letter)
+def start_monitoring(drive_letter, detection_id=None):
+    monitor_thread = MonitorThread(drive_letter, detection_id)
     monitor_thread.start()
     return monitor_thread
 
@@ -106,6 +317,6 @@ def start_monitoring(drive_letter):
 #     monitor_threads["E:"] = start_monitoring("E:")
 #     input("enter: ")
 #     print(monitor_threads)
-#     logs = monitor_threads["E:"].stop()
+#     events = monitor_threads["E:"].stop()
 #     del monitor_threads["E:"]
-#     print(logs)
+#     print(events.text())
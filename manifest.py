@@ -0,0 +1,580 @@
+"""
+Structured drive snapshots.
+
+A manifest is an array-backed table with one row per file or directory found on
+the drive. The row index is the path id; every row stores its parent id, name,
+size, mtime and flags. Rows are kept in the order the drive was walked (a folder
+before its contents, listing order inside a folder), which is all that is needed
+to render the familiar ``print_tree`` text on demand.
+
+For directories the size column holds the number of entries in the folder.
+"""
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from itertools import compress
+
+from utils import SKIPPED_DIRECTORY
+
+FLAG_DIR = 0x01
+FLAG_LAST = 0x02  # last entry of its parent's listing, drawn with '└── '
+FLAG_ERROR = 0x04  # could not be listed or stat'ed while scanning
+
+MAGIC = b'USBM'
+VERSION = 1
+
+_DIR_ROWS = bytes(1 if flags & FLAG_DIR else 0 for flags in range(256))
+
+_HEADER = struct.Struct('<4sHHI')  # magic, version, reserved, row count
+_LENGTH = struct.Struct('<I')
+
+
+def _little_endian(column):
+    if sys.byteorder == 'big':
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+class Manifest:
+    def __init__(self, root=''):
+        self.root = root
+        self.parents = array('i')
+        self.names = []
+        self.sizes = array('q')
+        self.mtimes = array('q')
+        self.flags = array('B')
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, parent, name, size=0, mtime=0, flags=0):
+        self.parents.append(parent)
+        self.names.append(name)
+        self.sizes.append(size)
+        self.mtimes.append(mtime)
+        self.flags.append(flags)
+        return len(self.names) - 1
+
+    def is_dir(self, index):
+        return bool(self.flags[index] & FLAG_DIR)
+
+    def path(self, index):
+        """ Path of a row relative to the drive root, '/' separated. """
+        parts = []
+        while index > 0:
+            parts.append(self.names[index])
+            index = self.parents[index]
+        return '/'.join(reversed(parts))
+
+    def paths(self):
+        """ Relative paths of every row, computed in a single pass. """
+        paths = [''] * len(self)
+        names = self.names
+        parents = self.parents
+        for i in range(1, len(self)):
+            parent = parents[i]
+            paths[i] = names[i] if parent == 0 else paths[parent] + '/' + names[i]
+        return paths
+
+    def children(self):
+        """ Map every folder row to the list of its child rows, in order. """
+        children = {}
+        parents = self.parents
+        for i in range(1, len(self)):
+            children.setdefault(parents[i], []).append(i)
+        return children
+
+    def write_tree(self, write):
+        """ Stream the ``print_tree`` rendering of this snapshot into ``write``. """
+        if not len(self):
+            return
+        write(self.root + '\n')
+        indents = {-1: ''}
+        flags = self.flags
+        for i, name in enumerate(self.names):
+            indent = indents[self.parents[i]]
+            last = flags[i] & FLAG_LAST
+            write(indent + ('└── ' if last else '├── ') + name + '\n')
+            if flags[i] & FLAG_DIR:
+                indents[i] = indent + ('    ' if last else '│   ')
+
+    def tree_text(self):
+        lines = []
+        self.write_tree(lines.append)
+        return ''.join(lines)
+
+    def to_bytes(self):
+        """
+        Serialize to the binary manifest layout.
+
+        Header (magic, version, row count), then the root path and each column
+        as a u32 byte length followed by its little-endian data: parents (i32),
+        sizes (i64), mtimes (i64, ns), flags (u8), name lengths (u16) and the
+        concatenated UTF-8 names.
+        """
+        names = [name.encode('utf-8', 'surrogateescape') for name in self.names]
+        root = self.root.encode('utf-8', 'surrogateescape')
+        parts = [_HEADER.pack(MAGIC, VERSION, 0, len(self)), _LENGTH.pack(len(root)), root]
+        for column in (self.parents, self.sizes, self.mtimes, self.flags, array('H', map(len, names))):
+            data = _little_endian(column)
+            parts.append(_LENGTH.pack(len(data)))
+            parts.append(data)
+        blob = b''.join(names)
+        parts.append(_LENGTH.pack(len(blob)))
+        parts.append(blob)
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = memoryview(data)
+        if len(data) < _HEADER.size:
+            raise ValueError("Manifest is truncated")
+        magic, version, _, count = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Unsupported manifest format {bytes(magic)!r} v{version}")
+        offset = _HEADER.size
+
+        def read_chunk():
+            nonlocal offset
+            (length,) = _LENGTH.unpack_from(data, offset)
+            offset += _LENGTH.size
+            chunk = data[offset:offset + length]
+            if len(chunk) != length:
+                raise ValueError("Manifest is truncated")
+            offset += length
+            return chunk
+
+        manifest = cls(bytes(read_chunk()).decode('utf-8', 'surrogateescape'))
+        columns = []
+        for typecode in ('i', 'q', 'q', 'B', 'H'):
+            column = array(typecode)
+            column.frombytes(read_chunk())
+            if sys.byteorder == 'big':
+                column.byteswap()
+            if len(column) != count:
+                raise ValueError("Manifest column length does not match row count")
+            columns.append(column)
+        manifest.parents, manifest.sizes, manifest.mtimes, manifest.flags, lengths = columns
+
+        blob = bytes(read_chunk())
+        position = 0
+        names = manifest.names
+        for length in lengths:
+            names.append(blob[position:position + length].decode('utf-8', 'surrogateescape'))
+            position += length
+        return manifest
+
+
+class ScanBudget:
+    """
+    Limits for a snapshot taken in the background.
+
+    Walkers charge every folder they list. Once ``seconds`` have passed or more
+    than ``entries`` entries were listed the walk stops and ``truncated`` is
+    set. ``checkpoint(manifest)`` is called with the partial manifest at most
+    every ``checkpoint_interval`` seconds so it can be persisted; walkers pass
+    it, or a function building it, along with their charges.
+    """
+
+    def __init__(self, seconds=None, entries=None, checkpoint=None, checkpoint_interval=10.0):
+        now = time.monotonic()
+        self.deadline = now + seconds if seconds else None
+        self.entries = entries
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.next_checkpoint = now + checkpoint_interval
+        self.listed = 0
+        self.truncated = False
+        self.lock = threading.Lock()
+
+    def charge(self, count, manifest=None):
+        """ Account ``count`` listed entries; returns False once the budget is spent. """
+        with self.lock:
+            if self.truncated:
+                return False
+            self.listed += count
+            now = time.monotonic()
+            if ((self.entries is not None and self.listed > self.entries)
+                    or (self.deadline is not None and now > self.deadline)):
+                self.truncated = True
+                return False
+            due = self.checkpoint is not None and manifest is not None and now >= self.next_checkpoint
+            if due:
+                self.next_checkpoint = now + self.checkpoint_interval
+        if due:
+            self.checkpoint(manifest() if callable(manifest) else manifest)
+        return True
+
+
+def _list_entries(directory):
+    with os.scandir(directory) as it:
+        return list(it)
+
+
+def _walk(manifest, root, entries, delegate=None, budget=None, pending=None, partial=None):
+    """
+    Append the subtree below row ``root`` (whose listing is ``entries``).
+
+    ``delegate(path)`` may take over a sub-folder by returning a future; the
+    folder row is then added without children and returned in the
+    ``{row: future}`` mapping (``pending``) so the caller can splice the
+    result in later. The walk stops early once ``budget`` is spent; its
+    checkpoints get ``partial``, the manifest walked so far or a function
+    building it.
+    """
+    if pending is None:
+        pending = {}
+    stack = [(root, enumerate(entries), len(entries) - 1)]
+    while stack:
+        parent, contents, last_index = stack[-1]
+        for i, entry in contents:
+            flags = FLAG_LAST if i == last_index else 0
+            try:
+                is_dir = entry.is_dir()
+                stat = entry.stat()
+            except OSError:
+                manifest.add(parent, entry.name, 0, 0, flags | FLAG_ERROR)
+                continue
+
+            if not is_dir:
+                manifest.add(parent, entry.name, stat.st_size, stat.st_mtime_ns, flags)
+                continue
+
+            if SKIPPED_DIRECTORY in entry.path:
+                continue
+            if delegate is not None:
+                future = delegate(entry.path)
+                if future is not None:
+                    index = manifest.add(parent, entry.name, 0, stat.st_mtime_ns, flags | FLAG_DIR)
+                    pending[index] = future
+                    continue
+            try:
+                children = _list_entries(entry.path)
+            except OSError:
+                manifest.add(parent, entry.name, 0, stat.st_mtime_ns, flags | FLAG_DIR | FLAG_ERROR)
+                continue
+            index = manifest.add(parent, entry.name, len(children), stat.st_mtime_ns, flags | FLAG_DIR)
+            if budget is not None and not budget.charge(len(children), partial):
+                return pending
+            stack.append((index, enumerate(children), len(children) - 1))
+            break
+        else:
+            stack.pop()
+    return pending
+
+
+class _ParallelScan:
+    """
+    Fan sub-folders out to a bounded thread pool.
+
+    Any folder met while walking is handed to the pool as long as fewer than
+    ``workers`` tasks are waiting to start; otherwise the current thread
+    descends into it itself. Top-level folders are therefore always spread
+    out first, and deeper ones are split off only while workers are idle.
+    Every task returns a fragment that is spliced back under its folder row,
+    so the merged manifest is in exactly the order a serial walk produces.
+
+    Checkpoints are taken by the calling thread only, which owns the top
+    fragment: they merge it with the fragments finished so far, leaving the
+    folders still being scanned empty.
+    """
+
+    def __init__(self, workers, budget=None):
+        self.workers = workers
+        self.budget = budget
+        self.pool = None
+        self.lock = threading.Condition()
+        self.waiting = 0
+        self.outstanding = 0  # tasks submitted and not finished yet
+
+    def delegate(self, path):
+        with self.lock:
+            if self.waiting >= self.workers:
+                return None
+            self.waiting += 1
+            self.outstanding += 1
+        return self.pool.submit(self.scan_folder, path)
+
+    def scan_folder(self, path):
+        with self.lock:
+            self.waiting -= 1
+        try:
+            return self._scan_folder(path)
+        finally:
+            with self.lock:
+                self.outstanding -= 1
+                if not self.outstanding:
+                    self.lock.notify_all()
+
+    def _scan_folder(self, path):
+        fragment = Manifest(path)
+        try:
+            entries = _list_entries(path)
+        except OSError:
+            fragment.add(-1, '', 0, 0, FLAG_DIR | FLAG_ERROR)
+            return fragment, {}
+        root = fragment.add(-1, '', len(entries), 0, FLAG_DIR)
+        if self.budget is not None and not self.budget.charge(len(entries)):
+            return fragment, {}
+        return fragment, _walk(fragment, root, entries, self.delegate, self.budget)
+
+    def run(self, fragment, root, entries):
+        pending = {}
+        partial = None
+        if self.budget is not None and self.budget.checkpoint is not None:
+            def partial():
+                return _merge(fragment, pending, finished_only=True)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='drive-scan') as self.pool:
+            _walk(fragment, root, entries, self.delegate, self.budget, pending, partial)
+            if partial is not None:
+                # Keep checkpointing while the workers finish the folders handed out
+                while True:
+                    with self.lock:
+                        if self.outstanding:
+                            self.lock.wait(max(0.0, self.budget.next_checkpoint - time.monotonic()))
+                        if not self.outstanding:
+                            break
+                    self.budget.charge(0, partial)
+            return _merge(fragment, pending)
+
+
+def _merge(fragment, pending, finished_only=False):
+    merged = Manifest(fragment.root)
+    merged.add(-1, fragment.names[0], fragment.sizes[0], fragment.mtimes[0], fragment.flags[0])
+    mapping = [0] * len(fragment)
+    stack = [(fragment, pending, mapping, iter(range(1, len(fragment))))]
+    while stack:
+        fragment, pending, mapping, rows = stack[-1]
+        for j in rows:
+            index = merged.add(mapping[fragment.parents[j]], fragment.names[j], fragment.sizes[j],
+                               fragment.mtimes[j], fragment.flags[j])
+            mapping[j] = index
+            future = pending.get(j)
+            if future is not None:
+                if finished_only and not (future.done() and future.exception() is None):
+                    continue
+                child, child_pending = future.result()
+                merged.sizes[index] = child.sizes[0]
+                merged.flags[index] |= child.flags[0] & FLAG_ERROR
+                child_mapping = [0] * len(child)
+                child_mapping[0] = index
+                stack.append((child, child_pending, child_mapping, iter(range(1, len(child)))))
+                break
+        else:
+            stack.pop()
+    return merged
+
+
+def copy_subtree(manifest, previous, parent, row, flags):
+    """ Append folder ``row`` of ``previous`` and everything below it under ``parent``. """
+    # Rows are in walk order, so the subtree ends at the first row whose
+    # parent lies before ``row``.
+    parents = previous.parents
+    count = len(previous)
+    end = count if row == 0 else row + 1
+    while end < count and parents[end] >= row:
+        end += 1
+    index = len(manifest)
+    delta = index - row
+    manifest.parents.append(parent)
+    if delta:
+        manifest.parents.extend(array('i', [p + delta for p in parents[row + 1:end]]))
+    else:
+        manifest.parents.extend(parents[row + 1:end])
+    manifest.names.extend(previous.names[row:end])
+    manifest.sizes.extend(previous.sizes[row:end])
+    manifest.mtimes.extend(previous.mtimes[row:end])
+    manifest.flags.extend(previous.flags[row:end])
+    manifest.flags[index] = flags | FLAG_DIR
+
+
+class _Rescan:
+    """
+    Re-snapshot a drive against the manifest taken at its last insertion.
+
+    Every folder of the previous manifest is stat'ed and its entries counted
+    first; FAT and exFAT do not reliably update folder mtimes, so a folder
+    whose entry count differs from the one stored counts as changed too. A
+    subtree in which no folder changed is copied over wholesale; a folder that
+    did not change but has a changed folder somewhere below keeps its previous
+    file rows and is descended into; only changed folders are listed again and
+    have their entries stat'ed.
+    """
+
+    def __init__(self, manifest, previous, budget=None):
+        self.manifest = manifest
+        self.previous = previous
+        self.budget = budget
+        self.stopped = False
+        self.children = None
+        self.mtimes = {}
+        self.counts = {}
+        self.dirty = set()
+        self.stack = []
+
+    def check_folders(self, directory):
+        # Current mtime and entry count of every previously known folder, and the
+        # set of folders that have a changed folder somewhere in their subtree.
+        previous = self.previous
+        flags = previous.flags
+        parents = previous.parents
+        names = previous.names
+        paths = {0: directory}
+        for row in compress(range(len(previous)), flags.tobytes().translate(_DIR_ROWS)):
+            if row:
+                parent = parents[row]
+                paths[row] = (os.path.join(directory, names[row]) if parent == 0
+                              else paths[parent] + os.sep + names[row])
+            try:
+                mtime = os.stat(paths[row]).st_mtime_ns
+                count = len(os.listdir(paths[row]))
+            except OSError:
+                mtime = count = None
+            self.mtimes[row] = mtime
+            self.counts[row] = count
+            if mtime != previous.mtimes[row] or count != previous.sizes[row] or flags[row] & FLAG_ERROR:
+                while row not in self.dirty and row != -1:
+                    self.dirty.add(row)
+                    row = parents[row]
+
+    def copy_subtree(self, parent, row, flags):
+        copy_subtree(self.manifest, self.previous, parent, row, flags)
+        # Copied rows were not listed, so they only count against the time limit
+        self.charge(0)
+
+    def charge(self, count):
+        if self.budget is not None and not self.budget.charge(count, self.manifest):
+            self.stopped = True
+
+    def open_folder(self, parent, path, name, flags, mtime, previous_row):
+        manifest = self.manifest
+        previous = self.previous
+        if (previous_row is not None and previous.mtimes[previous_row] == mtime
+                and previous.flags[previous_row] & (FLAG_DIR | FLAG_ERROR) == FLAG_DIR
+                and self.mtimes.get(previous_row) == mtime
+                and self.counts.get(previous_row) == previous.sizes[previous_row]):
+            if previous_row not in self.dirty:
+                self.copy_subtree(parent, previous_row, flags)
+                return
+            if self.children is None:
+                self.children = previous.children()
+            index = manifest.add(parent, name, previous.sizes[previous_row], mtime, flags | FLAG_DIR)
+            self.stack.append((index, path, iter(self.children.get(previous_row, ())), None, None))
+            return
+
+        try:
+            entries = _list_entries(path)
+        except OSError:
+            manifest.add(parent, name, 0, mtime, flags | FLAG_DIR | FLAG_ERROR)
+            return
+        index = manifest.add(parent, name, len(entries), mtime, flags | FLAG_DIR)
+        self.charge(len(entries))
+        if self.stopped:
+            return
+        known = {}
+        if previous_row is not None:
+            if self.children is None:
+                self.children = previous.children()
+            known = {previous.names[row]: row for row in self.children.get(previous_row, ())
+                     if previous.flags[row] & FLAG_DIR}
+        self.stack.append((index, path, enumerate(entries), len(entries) - 1, known))
+
+    def reuse_row(self, parent, path, row):
+        previous = self.previous
+        flags = previous.flags[row]
+        name = previous.names[row]
+        if not flags & FLAG_DIR:
+            self.manifest.add(parent, name, previous.sizes[row], previous.mtimes[row], flags)
+            return False
+        mtime = self.mtimes.get(row)
+        if mtime is None:
+            self.manifest.add(parent, name, 0, 0, (flags & FLAG_LAST) | FLAG_DIR | FLAG_ERROR)
+            return False
+        self.open_folder(parent, os.path.join(path, name), name, flags & FLAG_LAST, mtime, row)
+        return True
+
+    def list_entry(self, parent, i, entry, last_index, known):
+        manifest = self.manifest
+        flags = FLAG_LAST if i == last_index else 0
+        try:
+            is_dir = entry.is_dir()
+            stat = entry.stat()
+        except OSError:
+            manifest.add(parent, entry.name, 0, 0, flags | FLAG_ERROR)
+            return False
+        if not is_dir:
+            manifest.add(parent, entry.name, stat.st_size, stat.st_mtime_ns, flags)
+            return False
+        if SKIPPED_DIRECTORY in entry.path:
+            return False
+        self.open_folder(parent, entry.path, entry.name, flags, stat.st_mtime_ns, known.get(entry.name))
+        return True
+
+    def run(self, directory):
+        self.check_folders(directory)
+        self.open_folder(-1, directory, os.path.basename(directory), FLAG_LAST,
+                         os.stat(directory).st_mtime_ns, 0 if len(self.previous) else None)
+        self.manifest.names[0] = os.path.basename(directory)
+        stack = self.stack
+        while stack and not self.stopped:
+            parent, path, items, last_index, known = stack[-1]
+            depth = len(stack)
+            if known is None:
+                for row in items:
+                    if (self.reuse_row(parent, path, row) and len(stack) > depth) or self.stopped:
+                        break
+                else:
+                    stack.pop()
+            else:
+                for i, entry in items:
+                    if (self.list_entry(parent, i, entry, last_index, known) and len(stack) > depth) or self.stopped:
+                        break
+                else:
+                    stack.pop()
+        return self.manifest
+
+
+def scan_drive(directory, workers=1, previous=None, budget=None):
+    """
+    Walk ``directory`` and return its Manifest.
+
+    With ``workers`` > 1 folders are listed concurrently on that many threads;
+    the result is identical to the single-threaded walk. When the manifest of
+    an earlier insertion of the same drive is passed as ``previous``, only
+    folders whose mtime changed are listed again. An optional ScanBudget
+    bounds the walk and receives periodic checkpoints.
+    Folders that cannot be listed and entries that cannot be stat'ed are kept
+    with FLAG_ERROR instead of aborting the whole snapshot.
+    """
+    manifest = Manifest(directory)
+    if previous is not None:
+        return _Rescan(manifest, previous, budget).run(directory)
+
+    entries = _list_entries(directory)
+    root = manifest.add(-1, os.path.basename(directory), len(entries),
+                        os.stat(directory).st_mtime_ns, FLAG_DIR | FLAG_LAST)
+    if budget is not None and not budget.charge(len(entries)):
+        return manifest
+    if workers > 1:
+        return _ParallelScan(workers, budget).run(manifest, root, entries)
+    _walk(manifest, root, entries, budget=budget, partial=manifest)
+    return manifest
+
+
+def render_tree(tree):
+    """
+    Return the tree text for a stored snapshot.
+
+    ``tree`` is either a serialized manifest (bytes) or the plain text kept by
+    detections recorded before manifests existed.
+    """
+    if not tree:
+        return ''
+    if isinstance(tree, str):
+        return tree
+    return Manifest.from_bytes(tree).tree_text()
@@ -0,0 +1,231 @@
+"""
+Filling in the file activity a watcher lost.
+
+When the native event queue overflows (inotify's IN_Q_OVERFLOW, or a
+ReadDirectoryChangesW call that returns no data), events are gone for good
+and the log of the drive has holes. The observer layer reports this with a
+``WatchOverflowEvent``, and a folder that cannot be watched (or a watch that
+failed) with a ``WatchErrorEvent``, each naming the folder affected.
+
+``USBEventHandler`` hands those folders to its ``Reconciler``, which rescans
+them on a thread of its own and compares what is on the drive with the last
+state the handler knows of:
+
+* with a ``baseline`` manifest (the insertion snapshot), every logged event
+  is replayed over it as it is logged, those already in the database
+  included, so files and folders of any age are compared;
+* without one, only the files the handler has seen events for, plus any
+  file created or changed since monitoring started.
+
+Every difference is logged as a created, modified or deleted event with
+``reconciled`` set. A file renamed while events were lost shows up as
+deleted and created. Paths that got events of their own while the rescan
+was running are left alone, those events being newer than the rescan.
+"""
+import os
+import sys
+import threading
+
+from watchdog.events import FileSystemEvent
+from watchdog.observers import Observer
+
+from file_events import Action, FILE_ACTIONS, LABELS
+from replay import Replay
+
+
+class WatchOverflowEvent(FileSystemEvent):
+    """ Events under ``src_path`` were dropped by the operating system. """
+
+    event_type = 'overflow'
+    is_directory = True
+
+
+class WatchErrorEvent(FileSystemEvent):
+    """ ``src_path`` could not be watched (any longer). """
+
+    event_type = 'watch_error'
+    is_directory = True
+
+
+if sys.platform == 'win32':
+    from watchdog.observers import winapi
+    from watchdog.observers.api import BaseObserver
+    from watchdog.observers.read_directory_changes import WindowsApiEmitter
+
+    class SignallingEmitter(WindowsApiEmitter):
+        """ watchdog's ReadDirectoryChangesW emitter, reporting the overflows and errors it would swallow. """
+
+        def _read_events(self):
+            if not self._whandle:
+                return []
+            data, size = winapi.read_directory_changes(self._whandle, self.watch.path,
+                                                       recursive=self.watch.is_recursive)
+            if not size and not self.stopped_event.is_set():
+                # What ReadDirectoryChangesW returns when its buffer overflowed
+                self.queue_event(WatchOverflowEvent(self.watch.path))
+            return [winapi.WinAPINativeEvent(action, path) for action, path in winapi._parse_event_buffer(data, size)]
+
+        def queue_events(self, timeout):
+            try:
+                super().queue_events(timeout)
+            except OSError as e:
+                print(f"SignallingEmitter on {self.watch.path} give Error: ", str(e))
+                self.queue_event(WatchErrorEvent(self.watch.path))
+                self.stop()
+
+
+def watchdog_observer():
+    """ A watchdog observer that reports overflows where watchdog itself does not (Windows). """
+    if sys.platform == 'win32':
+        return BaseObserver(SignallingEmitter)
+    return Observer()
+
+
+def scan_folder(folder):
+    """ ({file path: (size, last change time)}, {folder path}) of everything below ``folder``. """
+    files, folders = {}, set()
+    pending = [folder]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                entries = list(entries)
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    folders.add(entry.path)
+                    pending.append(entry.path)
+                else:
+                    status = entry.stat(follow_symlinks=False)
+                    # st_ctime is the creation time on Windows, the last inode change elsewhere
+                    files[entry.path] = (status.st_size, max(status.st_mtime, status.st_ctime))
+            except OSError:
+                continue
+    return files, folders
+
+
+class Reconciler:
+    """ Rescans folders of a USBEventHandler's drive that lost events, one after the other. """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.folders = set()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.rescans = 0
+        self.reconciled = 0
+        self.state = None  # Replay of the log over the baseline, kept current by ``logged``
+
+    def replay(self, manifest, stored=None):
+        """ Compare against ``manifest`` with the events ``stored`` in the database and the rest of the log over it. """
+        events = self.handler.events
+        state = Replay(manifest, self.handler.root)
+        if stored is not None:
+            state.apply_all(stored.replay_events())
+        self.state = state.apply_all(events.replay_events(events.flushed))
+
+    def logged(self, timestamp, action, path, size=None, destination=None):
+        """ Keep the state up to date with an event just logged (or left out while shedding load). """
+        if action not in FILE_ACTIONS:
+            return
+        self.state.apply(int(timestamp * 1_000_000_000), LABELS[action],
+                         (path, destination) if action == Action.MOVED else path, size)
+
+    def request(self, folder):
+        """ Rescan ``folder`` as soon as the rescans already running are done. """
+        with self.lock:
+            self.folders.add(folder)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='reconciler', daemon=True)
+                self.thread.start()
+
+    def wait(self):
+        """ Return once every requested rescan is done. """
+        thread = self.thread
+        if thread is not None:
+            thread.join()
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.folders:
+                    self.thread = None
+                    return
+                folders = sorted(self.folders, key=len)
+                self.folders = set()
+            done = []
+            for folder in folders:
+                # a folder below one just rescanned was covered by it
+                if any(folder == outer or folder.startswith(outer.rstrip('\\/') + os.sep) for outer in done):
+                    continue
+                try:
+                    self.rescan(folder)
+                except Exception as e:
+                    print("Reconciler rescan give Error: ", str(e))
+                done.append(folder)
+
+    def rescan(self, folder):
+        handler = self.handler
+        # Everything seen before the events were lost has to be in the log (or the state) first
+        handler.stats.sync()
+        with handler.lock:
+            handler.coalescer.flush(force=True)
+            mark = len(handler.events)
+        files, folders = scan_folder(folder)
+        handler.stats.sync()
+        with handler.lock:
+            handler.coalescer.flush(force=True)
+            newer = set(handler.events.touched_paths(mark))
+            known_files, known_folders = self.known(folder)
+            events = list(self.differences(known_files, known_folders, files, folders, newer))
+            for action, path, size in events:
+                handler.log_event(action, path, size, reconciled=True)
+        self.rescans += 1
+        self.reconciled += len(events)
+        print(f"Reconciled {folder}: {len(events)} events the watcher lost")
+        return events
+
+    def known(self, folder):
+        """ ({file path: size}, {folder path} or None) below ``folder`` as far as the log goes. """
+        handler = self.handler
+        prefix = folder.rstrip('\\/') + os.sep
+        if self.state is None:
+            return {path: size for path, size in handler.file_events.items() if path.startswith(prefix)}, None
+        root = handler.root if handler.root is not None else handler.baseline.root
+        manifest = self.state.result()
+        files, folders = {}, set()
+        for row, relative in enumerate(manifest.paths()):
+            if not row:
+                continue
+            path = os.path.join(root, *relative.split('/'))
+            if path.startswith(prefix):
+                if manifest.is_dir(row):
+                    folders.add(path)
+                else:
+                    files[path] = manifest.sizes[row]
+        return files, folders
+
+    def differences(self, known_files, known_folders, files, folders, newer):
+        """ (action, path, size) turning the known state into the scanned one, parents before children. """
+        if known_folders is not None:
+            for path in sorted(folders - known_folders):
+                if path not in newer:
+                    yield Action.CREATED_DIRECTORY, path, None
+        since = self.handler.started
+        for path, (size, changed) in files.items():
+            if path in newer:
+                continue
+            if path in known_files:
+                if known_files[path] != size:
+                    yield Action.MODIFIED, path, size
+            elif known_folders is not None or changed >= since:
+                yield Action.CREATED, path, size
+        for path in known_files:
+            if path not in files and path not in newer:
+                yield Action.DELETED, path, None
+        if known_folders is not None:
+            for path in sorted(known_folders - folders, reverse=True):
+                if path not in newer:
+                    yield Action.DELETED, path, None
@@ -0,0 +1,232 @@
+"""
+Reconstruct the state of a drive at removal from its insertion snapshot.
+
+A drive can only be walked while it is plugged in, but every create, delete,
+modify and move in between is recorded by ``log_watcher.USBEventHandler``.
+Replaying those events over the insertion manifest gives the tree as it was
+when the drive was pulled out.
+
+The insertion manifest is never copied while replaying: folders are only
+expanded into editable nodes when an event touches something inside them, and
+untouched subtrees are copied over as whole row ranges when the result is
+built.
+"""
+import os
+import re
+import time
+
+from manifest import Manifest, FLAG_DIR, FLAG_LAST, FLAG_ERROR, copy_subtree
+
+CREATED = 'Created'
+CREATED_DIRECTORY = 'Created directory'
+DELETED = 'Deleted'
+MODIFIED = 'Modified'
+MOVED = 'Changed'
+
+_LOG_LINE = re.compile(r'\[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)\] ([A-Za-z ]+?)(?: \(reconciled\))?: (.*)')
+_SIZE = re.compile(r'(.*), Size: ([\d.]+) (B|KB|MB|GB|TB)$')
+_UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+
+
+def parse_logs(logs):
+    """
+    Yield (timestamp ns, action, path, size) for every event line of ``logs``.
+
+    For moves ``path`` is a (source, destination) pair. Sizes are read back
+    from the rounded "12.5 KB" form the watcher writes, so they are
+    approximate; ``size`` is None where no size was logged.
+    """
+    cache = {}
+    for line in logs.splitlines():
+        match = _LOG_LINE.match(line)
+        if match is None:
+            continue
+        stamp, action, rest = match.groups()
+        seconds = cache.get(stamp)
+        if seconds is None:
+            seconds = cache[stamp] = int(time.mktime(time.strptime(stamp, "%Y-%m-%d %H:%M:%S")))
+        size = None
+        if action == MOVED:
+            if not rest.startswith('from '):
+                continue
+            source, separator, destination = rest[5:].partition(' to ')
+            if not separator:
+                continue
+            path = (source, destination)
+        else:
+            sized = _SIZE.match(rest)
+            if sized is not None:
+                rest = sized.group(1)
+                size = int(float(sized.group(2)) * _UNITS[sized.group(3)])
+            path = rest
+        yield seconds * 1_000_000_000, action, path, size
+
+
+class _Node:
+    __slots__ = ('row', 'size', 'mtime', 'flags', 'children')
+
+    def __init__(self, row, size, mtime, flags, children=None):
+        self.row = row  # row of the insertion manifest, None for new entries
+        self.size = size
+        self.mtime = mtime
+        self.flags = flags
+        self.children = children  # name -> _Node once a folder is expanded
+
+
+class Replay:
+    """
+    Apply watcher events to an insertion manifest.
+
+    Feed events with ``apply`` (or ``apply_all``), then call ``result`` to
+    build the reconstructed Manifest. ``root`` is the prefix of the event
+    paths and defaults to the manifest root; events outside it are ignored
+    and counted in ``skipped``.
+    """
+
+    def __init__(self, manifest, root=None):
+        self.manifest = manifest
+        self.root = (root if root is not None else manifest.root).rstrip('/\\')
+        self.index = None
+        self.folders = {}  # relative folder path -> children of its expanded node
+        self.applied = 0
+        self.skipped = 0
+        if len(manifest):
+            self.tree = _Node(0, manifest.sizes[0], manifest.mtimes[0], manifest.flags[0])
+        else:
+            self.tree = _Node(None, 0, 0, FLAG_DIR | FLAG_LAST, {})
+
+    def relative(self, path):
+        """ (parent folder, name) below the drive root, or None for foreign paths. """
+        if not path.startswith(self.root):
+            return None
+        path = path[len(self.root):]
+        if '\\' in path:
+            path = path.replace('\\', '/')
+        folder, _, name = path.strip('/').rpartition('/')
+        return (folder, name) if name else None
+
+    def expand(self, node):
+        if node.children is None:
+            manifest = self.manifest
+            if self.index is None:
+                self.index = manifest.children()
+            node.children = {manifest.names[row]: _Node(row, manifest.sizes[row], manifest.mtimes[row],
+                                                       manifest.flags[row] & ~FLAG_LAST)
+                             for row in self.index.get(node.row, ())}
+        return node.children
+
+    def folder(self, path, create, mtime=0):
+        """ Children of the folder at ``path``; missing folders are created if asked. """
+        children = self.folders.get(path)
+        if children is not None:
+            return children
+        node = self.tree
+        for name in path.split('/') if path else ():
+            child = self.expand(node).get(name)
+            if child is None or not child.flags & FLAG_DIR:
+                if not create:
+                    return None
+                child = node.children[name] = _Node(None, 0, mtime, FLAG_DIR, {})
+            node = child
+        children = self.folders[path] = self.expand(node)
+        return children
+
+    def detach(self, children, name):
+        node = children.pop(name, None)
+        if node is not None and node.flags & FLAG_DIR:
+            # Cached folders below it now live elsewhere (or nowhere)
+            self.folders.clear()
+        return node
+
+    def apply(self, timestamp, action, path, size=None):
+        if action == MOVED:
+            source, destination = self.relative(path[0]), self.relative(path[1])
+            if source is None or destination is None:
+                self.skipped += 1
+                return
+            children = self.folder(source[0], False)
+            node = self.detach(children, source[1]) if children is not None else None
+            if node is None:
+                self.skipped += 1
+                return
+            children = self.folder(destination[0], True, timestamp)
+            self.detach(children, destination[1])
+            children[destination[1]] = node
+            self.applied += 1
+            return
+
+        target = self.relative(path)
+        if target is None:
+            self.skipped += 1
+            return
+        folder, name = target
+        if action == DELETED:
+            children = self.folder(folder, False)
+            if children is None or self.detach(children, name) is None:
+                self.skipped += 1
+                return
+        elif action == CREATED_DIRECTORY:
+            children = self.folder(folder, True, timestamp)
+            node = children.get(name)
+            if node is None or not node.flags & FLAG_DIR:
+                children[name] = _Node(None, 0, timestamp, FLAG_DIR, {})
+        elif action in (CREATED, MODIFIED):
+            children = self.folder(folder, True, timestamp)
+            node = children.get(name)
+            if node is None or node.flags & FLAG_DIR:
+                self.detach(children, name)
+                children[name] = _Node(None, size or 0, timestamp, 0)
+            else:
+                if size is not None:
+                    node.size = size
+                node.mtime = timestamp
+                node.flags &= ~FLAG_ERROR
+        else:
+            self.skipped += 1
+            return
+        self.applied += 1
+
+    def apply_all(self, events):
+        for timestamp, action, path, size in events:
+            self.apply(timestamp, action, path, size)
+        return self
+
+    def result(self):
+        """ The reconstructed Manifest, in the same row order scan_drive uses. """
+        previous = self.manifest
+        manifest = Manifest(previous.root)
+        tree = self.tree
+        name = previous.names[0] if len(previous) else os.path.basename(previous.root)
+        if tree.children is None:
+            if len(previous):
+                copy_subtree(manifest, previous, -1, 0, previous.flags[0])
+            return manifest
+        root = manifest.add(-1, name, len(tree.children), tree.mtime, tree.flags | FLAG_DIR)
+        stack = [(root, iter(tree.children.items()), len(tree.children) - 1, 0)]
+        while stack:
+            parent, children, last_index, position = stack[-1]
+            for name, node in children:
+                flags = node.flags | (FLAG_LAST if position == last_index else 0)
+                position += 1
+                if not flags & FLAG_DIR:
+                    manifest.add(parent, name, node.size, node.mtime, flags)
+                    continue
+                if node.children is None:
+                    # Untouched folder, possibly moved: copy its rows as they are
+                    index = len(manifest)
+                    copy_subtree(manifest, previous, parent, node.row, flags)
+                    manifest.names[index] = name
+                    continue
+                index = manifest.add(parent, name, len(node.children), node.mtime, flags)
+                stack[-1] = (parent, children, last_index, position)
+                stack.append((index, iter(node.children.items()), len(node.children) - 1, 0))
+                break
+            else:
+                stack.pop()
+        return manifest
+
+
+def replay_logs(manifest, logs, root=None):
+    """ Manifest of the drive at removal, from its insertion manifest and an EventLog (or log text). """
+    events = parse_logs(logs) if isinstance(logs, str) else logs.replay_events()
+    return Replay(manifest, root).apply_all(events).result()
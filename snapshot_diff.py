@@ -0,0 +1,195 @@
+"""
+Structural comparison of two drive snapshots.
+
+Both manifests are joined on the full relative path with a dict, so the
+comparison is linear in the number of entries and is not confused by folders
+that share a name. Entries that disappear in one place and show up in another
+are paired up as renames/moves instead of being reported as a delete plus an
+add.
+"""
+from collections import deque
+
+from manifest import FLAG_DIR
+
+ADDED = 'added'
+REMOVED = 'removed'
+RESIZED = 'resized'
+TOUCHED = 'touched'
+RENAMED = 'renamed'
+
+
+class Change:
+    __slots__ = ('kind', 'path', 'old_path', 'size', 'old_size', 'is_dir')
+
+    def __init__(self, kind, path, old_path=None, size=0, old_size=0, is_dir=False):
+        self.kind = kind
+        self.path = path
+        self.old_path = old_path
+        self.size = size
+        self.old_size = old_size
+        self.is_dir = is_dir
+
+    def __repr__(self):
+        return f"Change({self.kind!r}, {self.path!r}, old_path={self.old_path!r})"
+
+
+def _top_level(rows, manifest, unmatched):
+    # Unmatched folders whose parent folder is matched, i.e. the root of a
+    # subtree that disappeared or appeared as a whole.
+    return [row for row in rows if manifest.flags[row] & FLAG_DIR and manifest.parents[row] not in unmatched]
+
+
+def _signatures(manifest, folders):
+    """ Contents of each folder as a hashable value: direct child names and file sizes. """
+    contents = {row: [] for row in folders}
+    for row, parent in enumerate(manifest.parents):
+        if parent in contents:
+            contents[parent].append((manifest.names[row],
+                                     -1 if manifest.flags[row] & FLAG_DIR else manifest.sizes[row]))
+    return {row: frozenset(children) or None for row, children in contents.items()}
+
+
+def _pair(removed, added, key_old, key_new):
+    """ Pair removed and added rows sharing a key, first come first served. """
+    candidates = {}
+    for row in removed:
+        key = key_old(row)
+        if key is not None:
+            candidates.setdefault(key, deque()).append(row)
+    pairs = []
+    for row in added:
+        key = key_new(row)
+        waiting = candidates.get(key) if key is not None else None
+        if waiting:
+            pairs.append((waiting.popleft(), row))
+    return pairs
+
+
+def diff_manifests(old, new):
+    """
+    Compare two manifests of the same drive.
+
+    Returns a list of Change in new-snapshot order, followed by the removed
+    entries in old-snapshot order. Files are RESIZED when their size changed
+    and TOUCHED when only their mtime did. A folder whose direct contents are
+    unchanged but which moved, or a file that kept its name and size (moved)
+    or its size and mtime (renamed), is reported once as RENAMED.
+    """
+    old_paths = old.paths()
+    new_paths = new.paths()
+    old_index = {old_paths[row]: row for row in range(1, len(old))}
+
+    old_flags, new_flags = old.flags, new.flags
+    new_to_old = [-1] * len(new)  # matching old row of every new row, -1 if none
+    seen = bytearray(len(old))
+    added = []
+    for row in range(1, len(new)):
+        old_row = old_index.get(new_paths[row], -1)
+        if old_row >= 0 and (old_flags[old_row] & FLAG_DIR) == (new_flags[row] & FLAG_DIR):
+            new_to_old[row] = old_row
+            seen[old_row] = 1
+        else:
+            added.append(row)
+    removed = [row for row in range(1, len(old)) if not seen[row]]
+    renamed = {}  # new row -> old row
+
+    # Whole folders that were renamed or moved: pair them by their contents and
+    # then pair everything below them by the path relative to the folder.
+    if removed and added:
+        old_folders = _top_level(removed, old, set(removed))
+        new_folders = _top_level(added, new, set(added))
+        if old_folders and new_folders:
+            old_signatures = _signatures(old, old_folders)
+            new_signatures = _signatures(new, new_folders)
+            folder_pairs = _pair(old_folders, new_folders, old_signatures.get, new_signatures.get)
+        else:
+            folder_pairs = []
+        if folder_pairs:
+            moved_index = {}
+            for old_row, new_row in folder_pairs:
+                renamed[new_row] = old_row
+                moved_index[old_paths[old_row]] = new_paths[new_row]
+            prefixes = {}
+            for old_row in removed:
+                # Walk up to the nearest renamed folder, if any
+                parent = old.parents[old_row]
+                while parent > 0 and old_paths[parent] not in moved_index:
+                    parent = old.parents[parent]
+                if parent > 0:
+                    prefix = old_paths[parent]
+                    prefixes[moved_index[prefix] + old_paths[old_row][len(prefix):]] = old_row
+            moved = {}
+            for row in added:
+                old_row = prefixes.get(new_paths[row])
+                if old_row is not None and row not in renamed and \
+                        (old_flags[old_row] & FLAG_DIR) == (new_flags[row] & FLAG_DIR):
+                    moved[row] = old_row
+            for row, old_row in moved.items():
+                new_to_old[row] = old_row
+            paired = set(renamed.values()) | set(moved.values())
+            removed = [row for row in removed if row not in paired]
+            added = [row for row in added if row not in renamed and row not in moved]
+
+    # Single files: moved (same name and size) first, then renamed in place
+    # (same size and mtime).
+    files_removed = [row for row in removed if not old.flags[row] & FLAG_DIR]
+    files_added = [row for row in added if not new.flags[row] & FLAG_DIR]
+    file_pairs = _pair(files_removed, files_added,
+                       lambda r: (old.names[r], old.sizes[r]),
+                       lambda r: (new.names[r], new.sizes[r]))
+    paired_old = {old_row for old_row, _ in file_pairs}
+    paired_new = {new_row for _, new_row in file_pairs}
+    file_pairs += _pair([row for row in files_removed if row not in paired_old],
+                        [row for row in files_added if row not in paired_new],
+                        lambda r: (old.sizes[r], old.mtimes[r]) if old.sizes[r] else None,
+                        lambda r: (new.sizes[r], new.mtimes[r]) if new.sizes[r] else None)
+    for old_row, new_row in file_pairs:
+        renamed[new_row] = old_row
+    paired_old = set(renamed.values())
+
+    changes = []
+    old_sizes, new_sizes, old_mtimes, new_mtimes = old.sizes, new.sizes, old.mtimes, new.mtimes
+    for row in range(1, len(new)):
+        old_row = new_to_old[row]
+        if old_row >= 0:
+            if new_flags[row] & FLAG_DIR:
+                continue
+            if new_sizes[row] != old_sizes[old_row]:
+                changes.append(Change(RESIZED, new_paths[row], old_paths[old_row], new_sizes[row], old_sizes[old_row]))
+            elif new_mtimes[row] != old_mtimes[old_row]:
+                changes.append(Change(TOUCHED, new_paths[row], old_paths[old_row], new_sizes[row], old_sizes[old_row]))
+            continue
+        is_dir = bool(new_flags[row] & FLAG_DIR)
+        if row in renamed:
+            old_row = renamed[row]
+            changes.append(Change(RENAMED, new_paths[row], old_paths[old_row], new.sizes[row], old.sizes[old_row],
+                                  is_dir))
+        else:
+            changes.append(Change(ADDED, new_paths[row], size=new.sizes[row], is_dir=is_dir))
+    for row in removed:
+        if row not in paired_old:
+            changes.append(Change(REMOVED, old_paths[row], old_paths[row], old_size=old.sizes[row],
+                                  is_dir=bool(old.flags[row] & FLAG_DIR)))
+    return changes
+
+
+def _size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.2f} {unit}"
+        size /= 1024
+    return f"{size:.2f} TB"
+
+
+def describe(change):
+    """ One display line for a change; the first character marks its kind. """
+    suffix = '/' if change.is_dir else ''
+    if change.kind == ADDED:
+        return f"+ {change.path}{suffix}" + ('' if change.is_dir else f" ({_size(change.size)})")
+    if change.kind == REMOVED:
+        return f"- {change.path}{suffix}" + ('' if change.is_dir else f" ({_size(change.old_size)})")
+    if change.kind == RESIZED:
+        return f"~ {change.path} ({_size(change.old_size)} -> {_size(change.size)})"
+    if change.kind == TOUCHED:
+        return f"* {change.path} (modified, same size)"
+    return f"> {change.old_path}{suffix} -> {change.path}{suffix}"
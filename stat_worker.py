@@ -0,0 +1,151 @@
+"""
+File size lookups for the watcher, off watchdog's dispatch thread.
+
+Stat calls on a slow flash drive can take milliseconds each; made inside the
+observer callback they hold up event dispatch until the native event queue
+overflows. ``StatWorker.put`` only timestamps the event and queues it. A
+background thread takes whatever has queued up, looks the sizes up in
+parallel (one task per directory, with a single directory listing when many
+files of the same directory are waiting) and passes the events on in their
+original order. Files renamed in the meantime are looked up under their new
+name, and files that are gone altogether get no size instead of an
+exception.
+
+One worker can serve every monitored drive: each event carries the
+``deliver`` callback of the handler it belongs to, and ``sync`` waits until
+everything queued so far has been delivered without stopping the threads.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from file_events import Action
+
+# Threads doing the stat calls; 0 looks sizes up inline in put()
+STAT_WORKERS = 4
+# Most events taken off the queue in one go
+STAT_BATCH = 512
+# Files waiting in one directory from which a single listing beats separate stats
+SCANDIR_MIN = 8
+
+
+class StatWorker:
+    """ Queues watcher events and passes them to ``deliver(action, path, size, destination, is_directory, timestamp)``. """
+
+    def __init__(self, deliver=None, workers=STAT_WORKERS, batch=STAT_BATCH):
+        self.deliver = deliver
+        self.workers = workers
+        self.batch = batch
+        self.vanished = 0
+        self.queue = queue.SimpleQueue()
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='stat') if workers > 1 else None
+        self.thread = None
+        if workers:
+            self.thread = threading.Thread(target=self.run, name='stat-worker', daemon=True)
+            self.thread.start()
+
+    def put(self, action, path, destination=None, is_directory=False, deliver=None):
+        """ Queue an event for ``deliver``, or for the worker's own callback if not given. """
+        event = (action, path, destination, is_directory, time.time(), deliver or self.deliver)
+        if self.thread is None:
+            self.process([event])
+        else:
+            self.queue.put(event)
+
+    def sync(self):
+        """ Wait until every event queued so far has been delivered. """
+        if self.thread is not None:
+            done = threading.Event()
+            self.queue.put(done)
+            done.wait()
+
+    def close(self):
+        """ Deliver everything still queued and stop the worker threads. """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def run(self):
+        events = self.queue
+        while True:
+            batch = [events.get()]
+            while len(batch) < self.batch:
+                try:
+                    batch.append(events.get_nowait())
+                except queue.Empty:
+                    break
+            closing = None in batch
+            if closing:
+                batch = batch[:batch.index(None)]
+            synced = [event for event in batch if isinstance(event, threading.Event)]
+            if synced:
+                batch = [event for event in batch if not isinstance(event, threading.Event)]
+            try:
+                self.process(batch)
+            except Exception as e:
+                print("StatWorker give Error: ", str(e))
+            for done in synced:
+                done.set()
+            if closing:
+                return
+
+    def process(self, batch):
+        folders = {}
+        for action, path, _, is_directory, _, _ in batch:
+            if not is_directory and action in (Action.CREATED, Action.MODIFIED):
+                folder, name = os.path.split(path)
+                folders.setdefault(folder, set()).add(name)
+        sizes = {}
+        if self.pool is not None and len(folders) > 1:
+            for found in self.pool.map(self.folder_sizes, folders, folders.values()):
+                sizes.update(found)
+        else:
+            for folder, names in folders.items():
+                sizes.update(self.folder_sizes(folder, names))
+        self.follow_moves(batch, sizes)
+        for action, path, destination, is_directory, timestamp, deliver in batch:
+            size = sizes.get(path)
+            if size is None and path in sizes:
+                self.vanished += 1
+            deliver(action, path, size, destination, is_directory, timestamp)
+
+    def follow_moves(self, batch, sizes):
+        """ Look up files renamed before their size was taken under the name they were moved to. """
+        moves = {path: destination for action, path, destination, is_directory, _, _ in batch
+                 if action == Action.MOVED and not is_directory}
+        for path, size in sizes.items():
+            if size is None and path in moves:
+                seen = {path}
+                destination = moves[path]
+                while destination in moves and destination not in seen:
+                    seen.add(destination)
+                    destination = moves[destination]
+                try:
+                    sizes[path] = os.stat(destination).st_size
+                except OSError:
+                    pass
+
+    def folder_sizes(self, folder, names):
+        """ {path: size or None if the file is gone} for ``names`` in ``folder``. """
+        sizes = dict.fromkeys([os.path.join(folder, name) for name in names])
+        if len(names) >= SCANDIR_MIN:
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.name in names:
+                            sizes[entry.path] = entry.stat().st_size
+                return sizes
+            except OSError:
+                pass
+        for path in sizes:
+            try:
+                sizes[path] = os.stat(path).st_size
+            except OSError:
+                pass
+        return sizes
@@ -13,11 +13,18 @@ from sqlmodel import Session
 
 from database import crud
 from database.db import create_db_and_tables, get_db, archive_db
+from file_events import Action, EventLog, SHEDDING_ACTIONS, TransferStats, format_size
+from manifest import Manifest, render_tree
+from replay import replay_logs
+from tree_compair import TreeComparisonApp
 from utils import stylesheet
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG)
 
+# File types and folders listed under the transfer total of a detection
+TRANSFER_BREAKDOWN = 5
+
 
 class TableView(QDialog):
     def __init__(self, super_admin, admin, db, archive_view: bool = False, parent=None):
@@ -42,6 +49,17 @@ class TableView(QDialog):
 
         layout = QVBoxLayout()
 
+        # File search: which drives ever carried a file
+        search_layout = QHBoxLayout()
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("File or folder name, or path on the drive (* and ? as wildcards)")
+        self.search_input.returnPressed.connect(self.search_files)
+        search_layout.addWidget(self.search_input)
+        search_button = QPushButton("Search Files")
+        search_button.clicked.connect(self.search_files)
+        search_layout.addWidget(search_button)
+        layout.addLayout(search_layout)
+
         self.table = QTableWidget()
         if (self.super_admin or self.admin) and not self.archive_view:
             self.table.setColumnCount(8)  # Set to 8 to include the "Register" column
@@ -86,7 +104,7 @@ class TableView(QDialog):
         #     data.append(device_info)
 
         self.table.setRowCount(len(detected_devices))
-        for row_idx, (row_data, tree, is_register) in enumerate(detected_devices):
+        for row_idx, (row_data, detection_id, is_register) in enumerate(detected_devices):
             if is_register:
                 bg_color = QColor(255, 255, 255)  # Default to white background
             else:
@@ -184,6 +202,21 @@ class TableView(QDialog):
         dialog = MoreInfoDialog(serial_number, self.super_admin, self.db)
         dialog.exec_()
 
+    def search_files(self):
+        query = self.search_input.text().strip()
+        if not query:
+            return
+        try:
+            results = crud.search_file_index(query, self.db)
+        except Exception as e:
+            logging.error(f"Error searching the file index for {query}: {e}")
+            results = []
+        if not results:
+            self.show_message("File Search", f"No drive carried {query}")
+            return
+        dialog = FileSearchDialog(query, results, self.super_admin, self.db)
+        dialog.exec_()
+
     def register_usb(self, serial_number):
         try:
             crud.register_usb(serial_number, self.db)
@@ -397,7 +430,7 @@ class MoreInfoDialog(QDialog):
             detected_devices = []
 
         self.table.setRowCount(len(detected_devices))
-        for row_idx, (row_data, tree, logs) in enumerate(detected_devices):
+        for row_idx, (row_data, detection_id) in enumerate(detected_devices):
             self.addTableItem(row_idx, 0, row_data["Serial Number"])
             self.addTableItem(row_idx, 1, row_data["Device Display Name"])
             self.addTableItem(row_idx, 2, row_data["Device Connect Through"])
@@ -405,7 +438,7 @@ class MoreInfoDialog(QDialog):
             self.addTableItem(row_idx, 4, row_data["Removal Time"])
 
             button = QPushButton("View Details")
-            button.clicked.connect(lambda checked, rd=row_data, t=tree, l=logs: self.showDetails(rd, t, l))
+            button.clicked.connect(lambda checked, rd=row_data, d=detection_id: self.showDetails(rd, d))
             self.table.setCellWidget(row_idx, 5, button)
 
         # Expand columns to fit content
@@ -424,9 +457,14 @@ class MoreInfoDialog(QDialog):
         item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)  # Set the item to be selectable but not editable
         self.table.setItem(row, column, item)
 
-    def showDetails(self, row_data, tree, logs):
-        # Implement detail view logic here
-        detail_dialog = DetailDialog(row_data, tree, logs, self.super_admin)
+    def showDetails(self, row_data, detection_id):
+        # Snapshot and logs are only loaded (and decompressed) for the detection being opened
+        try:
+            tree, logs = crud.get_detection_contents(detection_id, self.db)
+        except Exception as e:
+            logging.error(f"Error fetching details of detection {detection_id}: {e}")
+            tree, logs = '', EventLog()
+        detail_dialog = DetailDialog(row_data, tree, logs, self.super_admin, detection_id, self.db)
         detail_dialog.exec_()
 
     def showEvent(self, event):
@@ -444,9 +482,78 @@ class MoreInfoDialog(QDialog):
         self.window_animation.start()
 
 
+class FileSearchDialog(QDialog):
+    def __init__(self, query, results, super_admin, db, parent=None):
+        super().__init__(parent)
+
+        # Set the window flags to include minimize and maximize buttons
+        self.setWindowFlags(self.windowFlags() | Qt.WindowMinimizeButtonHint | Qt.WindowMaximizeButtonHint)
+
+        self.super_admin = super_admin
+        self.db = db
+        self.setWindowTitle(f'File Search: {query}')
+        self.setGeometry(100, 100, 1900, 900)
+
+        layout = QVBoxLayout()
+
+        self.table = QTableWidget()
+        self.table.setColumnCount(7)
+        headers = ["Serial Number", "Device Name", "Connect Time", "Removal Time", "Path", "Found In", "More Info"]
+        self.table.setHorizontalHeaderLabels(headers)
+
+        # Bold the header
+        header_font = QFont()
+        header_font.setPointSize(12)
+        header_font.setBold(True)
+        for idx in range(len(headers)):
+            self.table.horizontalHeaderItem(idx).setFont(header_font)
+
+        item_font = QFont()
+        item_font.setPointSize(12)
+        self.table.setFont(item_font)
+        self.table.verticalHeader().setDefaultSectionSize(40)
+
+        self.table.setRowCount(len(results))
+        for row_idx, (row_data, detection_id) in enumerate(results):
+            self.addTableItem(row_idx, 0, row_data["Serial Number"])
+            self.addTableItem(row_idx, 1, row_data["Device Display Name"])
+            self.addTableItem(row_idx, 2, row_data["Insertion Time"])
+            self.addTableItem(row_idx, 3, row_data["Removal Time"])
+            self.addTableItem(row_idx, 4, row_data["Path"])
+            self.addTableItem(row_idx, 5, row_data["Found In"])
+
+            button = QPushButton("View Details")
+            button.clicked.connect(lambda checked, rd=row_data, d=detection_id: self.showDetails(rd, d))
+            self.table.setCellWidget(row_idx, 6, button)
+
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+
+        layout.addWidget(self.table)
+        self.setLayout(layout)
+
+    def addTableItem(self, row, column, text):
+        item = QTableWidgetItem(text)
+        item.setTextAlignment(Qt.AlignCenter)
+        item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)  # Set the item to be selectable but not editable
+        self.table.setItem(row, column, item)
+
+    def showDetails(self, row_data, detection_id):
+        try:
+            tree, logs = crud.get_detection_contents(detection_id, self.db)
+        except Exception as e:
+            logging.error(f"Error fetching details of detection {detection_id}: {e}")
+            tree, logs = '', EventLog()
+        detail_dialog = DetailDialog(row_data, tree, logs, self.super_admin, detection_id, self.db)
+        detail_dialog.exec_()
+
+
 class DetailDialog(QDialog):
-    def __init__(self, row_data, tree, logs, super_admin, parent=None):
+    def __init__(self, row_data, tree, logs, super_admin, detection_id=None, db=None, parent=None):
         super().__init__(parent)
+        self.detection_id = detection_id
+        self.db = db
+        self.tree = tree
+        self.comparison = None
 
         # Set the window flags to include minimize and maximize buttons
         self.setWindowFlags(self.windowFlags() | Qt.WindowMinimizeButtonHint | Qt.WindowMaximizeButtonHint)
@@ -455,7 +562,7 @@ class DetailDialog(QDialog):
         if self.super_admin:
             self.logs = logs
         else:
-            self.logs = ""
+            self.logs = EventLog()
         self.setWindowTitle('Device Detail')
         self.setGeometry(100, 100, 1900, 950)  # Adjust size as needed
 
@@ -519,10 +626,11 @@ class DetailDialog(QDialog):
             "QTextEdit { background-color: #f0f0f0; border: 1px solid #ccc; padding: 10px; }")
         details_layout.addWidget(self.sa_text)
 
-        log_lines = self.logs.split('\n')
-        has_created = any("Created" in line for line in log_lines)
-        has_deleted = any("Deleted" in line for line in log_lines)
-        has_modified = any("Modified" in line or "Changed" in line for line in log_lines)
+        actions = {event.action for event in self.logs}
+        has_created = Action.CREATED in actions or Action.CREATED_DIRECTORY in actions
+        has_deleted = Action.DELETED in actions
+        has_modified = Action.MODIFIED in actions or Action.MOVED in actions
+        has_shedding = not actions.isdisjoint(SHEDDING_ACTIONS)
 
         if has_created:
             # Create sections for each log type
@@ -537,10 +645,19 @@ class DetailDialog(QDialog):
             self.create_log_section("Modified Files Record", details_layout)
             self.modified_moved_logs = self.create_log_text_edit(details_layout)
 
+        if has_shedding:
+            # Floods of writes are only counted per folder while they last
+            self.create_log_section("Load Shedding Record", details_layout)
+            self.shedding_logs = self.create_log_text_edit(details_layout)
+
         # Total Transferred Label
         self.total_label = QLabel("Total transferred: 0 MB")
         self.total_label.setFont(QFont("Arial", 14))
         details_layout.addWidget(self.total_label)
+        self.breakdown_label = QLabel("")
+        self.breakdown_label.setFont(QFont("Arial", 12))
+        self.breakdown_label.setWordWrap(True)
+        details_layout.addWidget(self.breakdown_label)
 
         splitter.addWidget(details_widget)
 
@@ -555,7 +672,13 @@ class DetailDialog(QDialog):
         drive_tree_label.setStyleSheet("background-color: #006600; border-bottom: 1px solid #a0a0a0;")
         tree_layout.addWidget(drive_tree_label)
 
-        tree_label = QLabel(f"{tree}")
+        if row_data.get("Snapshot Status") in ("pending", "truncated"):
+            partial_label = QLabel("Partial snapshot: the drive was not read completely")
+            partial_label.setFont(QFont("Arial", 12))
+            partial_label.setStyleSheet("color: #B22222;")
+            tree_layout.addWidget(partial_label)
+
+        tree_label = QLabel(render_tree(tree))
         tree_label.setFont(QFont("Arial", 13))
         scroll_area = QScrollArea()
         scroll_area.setWidget(tree_label)
@@ -578,6 +701,10 @@ class DetailDialog(QDialog):
 
         main_layout.addWidget(splitter)
         main_layout.addWidget(toggle_button)
+        if detection_id is not None and db is not None:
+            compare_button = QPushButton("Compare Insertion And Removal")
+            compare_button.clicked.connect(self.compareTrees)
+            main_layout.addWidget(compare_button)
         self.setLayout(main_layout)
 
         # Apply fade-in animation
@@ -608,19 +735,41 @@ class DetailDialog(QDialog):
         return log_text_edit
 
     def load_logs(self):
-
-        log_lines = self.logs.split('\n')
-        for line in log_lines:
-            if "Created" in line:
+        # Event records are only turned into text here, for display
+        for event in self.logs:
+            line = self.logs.describe(event)
+            if event.action in (Action.CREATED, Action.CREATED_DIRECTORY):
                 self.append_colored_text(line, QColor("dark green"), self.created_logs)
-            elif "Deleted" in line:
+            elif event.action == Action.DELETED:
                 self.append_colored_text(line, QColor("dark red"), self.deleted_logs)
-            elif "Modified" in line:
+            elif event.action == Action.MODIFIED:
                 self.append_colored_text(line, QColor("dark blue"), self.modified_moved_logs)
-            elif "Changed" in line:
+            elif event.action == Action.MOVED:
                 self.append_colored_text(line, QColor("dark orange"), self.modified_moved_logs)
-            elif "Total transferred" in line:
-                self.total_label.setText(line)
+            elif event.action in SHEDDING_ACTIONS:
+                self.append_colored_text(line, QColor("purple"), self.shedding_logs)
+        if len(self.logs):
+            self.show_transfers()
+
+    def show_transfers(self):
+        # Byte counts come from size changes, so rewriting a file does not count it twice
+        try:
+            if self.detection_id is not None and self.db is not None:
+                summary = crud.get_transfer_summary(self.detection_id, self.db)
+            else:
+                summary = TransferStats.of(self.logs.records()).summary()
+        except Exception as e:
+            logging.error(f"Error fetching transfer totals of detection {self.detection_id}: {e}")
+            return
+        self.total_label.setText(f"Total transferred: {format_size(summary['added'])}"
+                                 f" (removed: {format_size(summary['removed'])})")
+        lines = []
+        for title, counts in (("By file type", summary['extensions']), ("By folder", summary['folders'])):
+            largest = sorted(counts.items(), key=lambda item: item[1][0], reverse=True)[:TRANSFER_BREAKDOWN]
+            if largest and largest[0][1][0]:
+                lines.append(f"{title}: " + ", ".join(f"{name} {format_size(added)}"
+                                                       for name, (added, _) in largest if added))
+        self.breakdown_label.setText("\n".join(lines))
 
     def append_colored_text(self, text, color, target_log):
         cursor = target_log.textCursor()
@@ -632,6 +781,22 @@ class DetailDialog(QDialog):
         target_log.setTextCursor(cursor)
         target_log.ensureCursorVisible()
 
+    def compareTrees(self):
+        # The removal-time tree is rebuilt from the watcher logs; without logs
+        # (e.g. the drive is still connected) fall back to the next insertion.
+        try:
+            if self.logs and isinstance(self.tree, bytes):
+                insertion = Manifest.from_bytes(self.tree)
+                removal, title = replay_logs(insertion, self.logs), "Removal Tree"
+            else:
+                insertion, removal = crud.get_comparison_manifests(self.detection_id, self.db)
+                title = "Next Insertion Tree"
+        except Exception as e:
+            logging.error(f"Error fetching snapshots of detection {self.detection_id}: {e}")
+            insertion, removal, title = None, None, "Removal Tree"
+        self.comparison = TreeComparisonApp(insertion, removal, title)
+        self.comparison.show()
+
     def toggleTreeVisibility(self, tree_widget, toggle_button):
         if toggle_button.isChecked():
             tree_widget.setVisible(False)
@@ -1,48 +1,134 @@
 import sys
-from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QLabel, QTextEdit, QPushButton, QHBoxLayout
-from PyQt5.QtGui import QColor, QTextCursor, QTextCharFormat, QIcon
-import difflib
-
-tree1 = """project/
-├── src/
-│   ├── main.py
-│   ├── utils.py
-│   └── __init__.py
-├── tests/
-│   ├── test_main.py
-│   └── test_utils.py
-├── data/
-│   ├── input.txt
-│   └── output.txt
-├── docs/
-│   └── README.md
-└── setup.py
-"""
-
-tree2 = """project/
-├── src/
-│   ├── main.py
-│   ├── utils.py
-│   └── __init__.py
-├── tests/
-│   ├── test_main.py
-│   └── test_utils.py
-├── docs/
-│   └── README.md
-├── src/
-│   ├── main.py
-│   ├── utils.py
-│   └── __init__.py
-└── setup.py
-"""
+from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QLabel, QPushButton, QHBoxLayout, QListView,
+                             QStyledItemDelegate, QAbstractItemView)
+from PyQt5.QtGui import QColor, QIcon, QPalette
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex
+
+from manifest import Manifest
+from snapshot_diff import ADDED, REMOVED, RESIZED, TOUCHED, RENAMED, Change, diff_manifests, describe
+
+COLORS = {
+    ADDED: '#228B22',  # Green for additions
+    REMOVED: '#B22222',  # Red for deletions
+    RESIZED: '#0000FF',  # Blue for size changes
+    TOUCHED: '#555555',  # Grey for files rewritten with the same size
+    RENAMED: '#FF8C00',  # Orange for moves and renames
+}
+
+
+def load_manifest(manifest):
+    if manifest is None or isinstance(manifest, Manifest):
+        return manifest
+    return Manifest.from_bytes(manifest)
+
 
 def find_differences(tree1, tree2):
-    diff = difflib.unified_diff(tree1.splitlines(), tree2.splitlines(), lineterm='')
-    return list(diff)
+    """ Structural differences between two snapshots as (kind, line) pairs. """
+    return [(change.kind, describe(change)) for change in diff_manifests(tree1, tree2)]
+
+
+def tree_lines(manifest):
+    lines = []
+    manifest.write_tree(lambda line: lines.append(line[:-1]))
+    return lines
+
+
+KIND_ROLE = Qt.UserRole + 1
+
+
+class DiffLineModel(QAbstractListModel):
+    """
+    Read-only list of diff (Change) or plain text lines.
+
+    Lines are only formatted when the view asks for a visible row, so handing
+    over a list of any length costs the same.
+    """
+
+    def __init__(self, lines=None, parent=None):
+        super().__init__(parent)
+        self.lines = lines if lines is not None else []
+
+    def set_lines(self, lines):
+        self.beginResetModel()
+        self.lines = lines
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.lines)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        line = self.lines[index.row()]
+        if role == Qt.DisplayRole:
+            return describe(line) if isinstance(line, Change) else line
+        if role == KIND_ROLE:
+            return line.kind if isinstance(line, Change) else None
+        return None
+
+    def kind(self, row):
+        line = self.lines[row]
+        return line.kind if isinstance(line, Change) else None
+
+    def next_hunk(self, row):
+        """ First row of the run of same-kind lines after the one holding ``row``. """
+        count = len(self.lines)
+        if not count:
+            return None
+        row = max(row, 0)
+        kind = self.kind(row)
+        while row < count and self.kind(row) == kind:
+            row += 1
+        return row if row < count else None
+
+    def previous_hunk(self, row):
+        """ First row of the run of same-kind lines before the one holding ``row``. """
+        if row <= 0 or not self.lines:
+            return None
+        row = min(row, len(self.lines) - 1)
+        kind = self.kind(row)
+        while row > 0 and self.kind(row - 1) == kind:
+            row -= 1
+        if row == 0:
+            return None
+        row -= 1
+        kind = self.kind(row)
+        while row > 0 and self.kind(row - 1) == kind:
+            row -= 1
+        return row
+
+
+class DiffLineDelegate(QStyledItemDelegate):
+    """ Colours each line by its change kind when it is painted. """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.colors = {kind: QColor(color) for kind, color in COLORS.items()}
+
+    def initStyleOption(self, option, index):
+        super().initStyleOption(option, index)
+        color = self.colors.get(index.data(KIND_ROLE))
+        if color is not None:
+            option.palette.setColor(QPalette.Text, color)
+
+
+def line_view(model, background):
+    view = QListView()
+    view.setModel(model)
+    view.setUniformItemSizes(True)  # rows are never measured one by one
+    view.setLayoutMode(QListView.Batched)
+    view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+    view.setItemDelegate(DiffLineDelegate(view))
+    view.setStyleSheet(f"QListView {{ background-color: {background}; border: 1px solid #ccc; padding: 10px; }}")
+    return view
+
 
 class TreeComparisonApp(QWidget):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, insertion=None, removal=None, removal_title="Removal Tree", parent=None):
+        super().__init__(parent)
+        self.insertion = load_manifest(insertion)
+        self.removal = load_manifest(removal)
+        self.removal_title = removal_title
         self.initUI()
 
     def initUI(self):
@@ -59,31 +145,36 @@ class TreeComparisonApp(QWidget):
         insertion_tree_header.setStyleSheet("font-weight: bold; font-size: 16px;")
         main_layout.addWidget(insertion_tree_header)
 
-        # Tree1 TextEdit
-        self.tree1_text = QTextEdit()
-        self.tree1_text.setPlainText(tree1)
-        self.tree1_text.setReadOnly(True)
-        self.tree1_text.setStyleSheet("QTextEdit { background-color: #f0f0f0; border: 1px solid #ccc; padding: 10px; }")
-        main_layout.addWidget(self.tree1_text)
+        # Insertion tree lines
+        self.tree1_model = DiffLineModel(tree_lines(self.insertion) if self.insertion else ["No snapshot recorded"])
+        self.tree1_view = line_view(self.tree1_model, "#f0f0f0")
+        main_layout.addWidget(self.tree1_view)
 
         # Removal Tree Header
-        removal_tree_header = QLabel("Removal Tree")
+        removal_tree_header = QLabel(self.removal_title)
         removal_tree_header.setStyleSheet("font-weight: bold; font-size: 16px;")
         main_layout.addWidget(removal_tree_header)
 
-        # Tree2 TextEdit
-        self.tree2_text = QTextEdit()
-        self.tree2_text.setPlainText(tree2)
-        self.tree2_text.setReadOnly(True)
-        self.tree2_text.setStyleSheet("QTextEdit { background-color: #f0f0f0; border: 1px solid #ccc; padding: 10px; }")
-        main_layout.addWidget(self.tree2_text)
-
-        # Difference TextEdit
-        self.diff_text = QTextEdit()
-        self.diff_text.setReadOnly(True)
-        self.diff_text.setStyleSheet("QTextEdit { background-color: #ffffff; border: 1px solid #ccc; padding: 10px; }")
+        # Removal tree lines
+        self.tree2_model = DiffLineModel(tree_lines(self.removal) if self.removal else ["No snapshot recorded"])
+        self.tree2_view = line_view(self.tree2_model, "#f0f0f0")
+        main_layout.addWidget(self.tree2_view)
+
+        # Difference lines
+        self.diff_model = DiffLineModel()
+        self.diff_view = line_view(self.diff_model, "#ffffff")
         main_layout.addWidget(QLabel("Differences:"))
-        main_layout.addWidget(self.diff_text)
+        main_layout.addWidget(self.diff_view)
+
+        # Hunk navigation
+        navigation_layout = QHBoxLayout()
+        self.previous_button = QPushButton('Previous Change')
+        self.previous_button.clicked.connect(self.previous_hunk)
+        navigation_layout.addWidget(self.previous_button)
+        self.next_button = QPushButton('Next Change')
+        self.next_button.clicked.connect(self.next_hunk)
+        navigation_layout.addWidget(self.next_button)
+        main_layout.addLayout(navigation_layout)
 
         # Compare Button
         self.compare_button = QPushButton('Compare')
@@ -94,30 +185,42 @@ class TreeComparisonApp(QWidget):
         self.setLayout(main_layout)
 
     def compare_trees(self):
-        differences = find_differences(tree1, tree2)
-        self.diff_text.clear()
-        cursor = self.diff_text.textCursor()
-        for line in differences:
-            color = None
-            if line.startswith('+'):
-                color = QColor('#228B22')  # Green for additions
-            elif line.startswith('-'):
-                color = QColor('#B22222')  # Red for deletions
-            elif line.startswith('@'):
-                color = QColor('#0000FF')  # Blue for context information
-            else:
-                color = QColor('#000000')  # Black for unchanged lines
-
-            self.append_colored_text(cursor, line, color)
-
-    def append_colored_text(self, cursor, text, color):
-        format = QTextCharFormat()
-        format.setForeground(color)
-        cursor.movePosition(QTextCursor.End)
-        cursor.insertText(text + '\n', format)
+        if self.insertion is None or self.removal is None:
+            self.diff_model.set_lines(["Both snapshots are needed to compare"])
+            return
+        differences = diff_manifests(self.insertion, self.removal)
+        self.diff_model.set_lines(differences or ["No differences"])
+
+    def current_row(self):
+        index = self.diff_view.currentIndex()
+        return index.row() if index.isValid() else -1
+
+    def go_to_row(self, row):
+        if row is None:
+            return
+        index = self.diff_model.index(row)
+        self.diff_view.setCurrentIndex(index)
+        self.diff_view.scrollTo(index, QAbstractItemView.PositionAtTop)
+
+    def next_hunk(self):
+        row = self.current_row()
+        self.go_to_row(0 if row < 0 and self.diff_model.rowCount() else self.diff_model.next_hunk(row))
+
+    def previous_hunk(self):
+        self.go_to_row(self.diff_model.previous_hunk(self.current_row()))
+
 
 if __name__ == '__main__':
+    # python tree_compair.py <detection id>
+    from database import crud
+    from database.db import get_db
+    from replay import replay_logs
+
+    db = get_db()
+    manifest, logs = crud.get_detection_contents(int(sys.argv[1]), db)
+    db.close()
+    insertion = load_manifest(manifest) if isinstance(manifest, bytes) else None
     app = QApplication(sys.argv)
-    ex = TreeComparisonApp()
+    ex = TreeComparisonApp(insertion, replay_logs(insertion, logs) if insertion else None)
     ex.show()
     sys.exit(app.exec_())
@@ -1,17 +1,34 @@
+import multiprocessing
+import os
 import pprint
 
-import win32api
-import win32con
-import win32gui
 import threading
-import pythoncom
 import usb_monitoring
 from sqlmodel import Session
 from database.db import get_db, create_db_and_tables
+from device_backends import ARRIVAL, REMOVAL, device_backend
+from event_flusher import recover_sessions
+from file_events import EventLog
+from hashing import hash_manifest
 from log_watcher import start_monitoring
-from utils import print_tree, timestamp
+from manifest import Manifest, ScanBudget, scan_drive
+from utils import timestamp
 from database import crud
 
+# Number of threads used to list folders while taking the insertion snapshot
+SCAN_WORKERS = 4
+# Limits for the background snapshot; the partial snapshot is saved every
+# SNAPSHOT_CHECKPOINT_INTERVAL seconds while the scan runs
+SNAPSHOT_TIME_BUDGET = 300  # in seconds
+SNAPSHOT_ENTRY_BUDGET = 5_000_000
+SNAPSHOT_CHECKPOINT_INTERVAL = 10  # in seconds
+# Optional content hashing after a complete snapshot: HASH_WORKERS processes
+# hash files, HASH_IN_FLIGHT files are read at the same time
+HASH_FILES = False
+HASH_ALGORITHM = 'blake2b'
+HASH_WORKERS = 2
+HASH_IN_FLIGHT = 4
+
 connected_devices = usb_monitoring.get_connected_devices()
 disks = usb_monitoring.get_existing_disk()
 monitor_threads = {}
@@ -31,32 +48,78 @@ def extract_new_disks():
     return new_disks, current_disks
 
 
-def create_window() -> int:
+def device_changed(change):
+    """
+    Hot-plug callback of the device backend
+    """
+    if change == ARRIVAL:
+        print("USB device connected")
+        # Start a new thread to extract device information
+        threading.Thread(target=connection_monitoring).start()
+    elif change == REMOVAL:
+        # USB device removed
+        print("USB device removed")
+        threading.Thread(target=removal_monitoring).start()
+
+
+def take_snapshot(symbol, serial_number, budget=None):
     """
-    Create a window for listening to messages
+    Snapshot the drive, reusing the manifest of its last insertion when there is one.
     """
-    wc = win32gui.WNDCLASS()
-    wc.lpfnWndProc = wnd_proc
-    wc.lpszClassName = 'USB Monitoring'
-    wc.hInstance = win32api.GetModuleHandle(None)
-    class_atom = win32gui.RegisterClass(wc)
-    return win32gui.CreateWindow(class_atom, 'USB Monitoring', 0, 0, 0, 0, 0, 0, 0, wc.hInstance, None)
+    previous = crud.get_last_manifest(serial_number)
+    if previous:
+        try:
+            return scan_drive(symbol, previous=Manifest.from_bytes(previous), budget=budget)
+        except ValueError as e:
+            print(f"previous manifest of {serial_number} give: ", str(e))
+    return scan_drive(symbol, workers=SCAN_WORKERS, budget=budget)
 
 
-def wnd_proc(hwnd, msg, wparam, lparam):
+def snapshot_monitoring(symbol, serial_number, detection_id):
     """
-    Window procedure to handle messages
+    Take the snapshot of an already recorded detection within the configured budget
     """
-    if msg == win32con.WM_DEVICECHANGE:
-        if wparam == win32con.DBT_DEVICEARRIVAL:
-            print("USB device connected")
-            # Start a new thread to extract device information
-            threading.Thread(target=connection_monitoring).start()
-        elif wparam == win32con.DBT_DEVICEREMOVECOMPLETE:
-            # USB device removed
-            print("USB device removed")
-            threading.Thread(target=removal_monitoring).start()
-    return win32gui.DefWindowProc(hwnd, msg, wparam, lparam)
+    def checkpoint(manifest):
+        crud.update_snapshot(detection_id, manifest.to_bytes(), crud.SNAPSHOT_PENDING)
+
+    budget = ScanBudget(SNAPSHOT_TIME_BUDGET, SNAPSHOT_ENTRY_BUDGET, checkpoint, SNAPSHOT_CHECKPOINT_INTERVAL)
+    try:
+        manifest = take_snapshot(symbol, serial_number, budget)
+    except Exception as e:
+        print(f"tree on {symbol} give: ", str(e))
+        # Keep whatever the last checkpoint stored
+        crud.set_snapshot_status(detection_id, crud.SNAPSHOT_TRUNCATED)
+        return
+
+    # A drive pulled out during the scan leaves error rows behind instead of its contents
+    if budget.truncated or not os.path.isdir(symbol):
+        status = crud.SNAPSHOT_TRUNCATED
+    else:
+        status = crud.SNAPSHOT_COMPLETE
+    crud.update_snapshot(detection_id, manifest.to_bytes(), status)
+
+    monitor = monitor_threads.get(symbol)
+    if monitor is not None and status == crud.SNAPSHOT_COMPLETE:
+        # What a rescan compares the drive against after the watcher lost events
+        monitor.event_handler.set_baseline(manifest)
+
+    if HASH_FILES and status == crud.SNAPSHOT_COMPLETE:
+        hash_snapshot(manifest, serial_number, detection_id)
+
+
+def hash_snapshot(manifest, serial_number, detection_id):
+    """
+    Hash the drive contents, reading only files that changed since they were last hashed
+    """
+    cache = crud.get_file_hashes(serial_number, HASH_ALGORITHM)
+    try:
+        hashes, stats = hash_manifest(manifest, cache, HASH_ALGORITHM, HASH_WORKERS, HASH_IN_FLIGHT)
+    except Exception as e:
+        print(f"hashing {manifest.root} give: ", str(e))
+        return
+    print(f"{serial_number}: {stats}")
+    changed = {path: value for path, value in hashes.items() if cache.get(path) != value}
+    crud.save_file_hashes(serial_number, HASH_ALGORITHM, changed, detection_id)
 
 
 def connection_monitoring():
@@ -68,38 +131,35 @@ def connection_monitoring():
     Extract information about connected USB devices
     """
     try:
-        # Initialize the COM environment
-        pythoncom.CoInitialize()
-
         new_devices, current_devices = extract_new_devices()
         new_disks, current_disks = extract_new_disks()
         if new_devices:
-            tree = ''
             symbol = ''
+            serial_number, device = next(iter(new_devices.items()))
             try:
                 symbol, drive = next(iter(new_disks.items()))
             except Exception as e:
                 print("Win32_LogicalDisk for new drive give: ", str(e))
-            try:
-                tree = print_tree(symbol, symbol + '\n')
-                monitor_threads[symbol] = start_monitoring(symbol)
-            except Exception as e:
-                print(f"tree on {symbol} give: ", str(e))
 
-            serial_number, device = next(iter(new_devices.items()))
             if drive['name'] == '':
                 drive['name'] = f'USB Drive ({symbol})'
             device['display_name'] = drive['name']
             device['total_size'] = drive['total_size']
             device['free_space'] = drive['free_space']
             device['used_space'] = drive['used_space']
-            crud.add_or_update_detected_pc(device, serial_number, tree, timestamp())
+
+            # The detection is stored right away; the drive contents follow in the background
+            detection_id = crud.add_or_update_detected_pc(device, serial_number, None, timestamp(),
+                                                          crud.SNAPSHOT_PENDING)
+            try:
+                monitor_threads[symbol] = start_monitoring(symbol, detection_id)
+            except Exception as e:
+                print(f"monitoring on {symbol} give: ", str(e))
+            if detection_id is not None:
+                threading.Thread(target=snapshot_monitoring, args=(symbol, serial_number, detection_id)).start()
 
         connected_devices = current_devices
         disks = current_disks
-
-        # Uninitialize the COM environment
-        pythoncom.CoUninitialize()
     except Exception as e:
         print("Error:", e)
 
@@ -112,9 +172,6 @@ def removal_monitoring():
     Extract information about connected USB devices
     """
     try:
-        # Initialize the COM environment
-        pythoncom.CoInitialize()
-
         current_devices = usb_monitoring.get_connected_devices()
         removal_device = {sn: dev for sn, dev in connected_devices.items() if sn not in current_devices}
         serial_number, device = next(iter(removal_device.items()))
@@ -122,28 +179,35 @@ def removal_monitoring():
         current_disks = usb_monitoring.get_existing_disk()
         removal_disk = {symbol: dev for symbol, dev in disks.items() if symbol not in current_disks}
 
-        logs = ''
+        events = EventLog()
+        transfers = None
+        activity = None
+        symbol = None
         try:
             symbol, drive = next(iter(removal_disk.items()))
-            logs = monitor_threads[symbol].stop()
+            events = monitor_threads[symbol].stop()
+            transfers = monitor_threads[symbol].event_handler.transfers
+            activity = monitor_threads[symbol].event_handler.activity()
         except Exception as e:
             print("Win32_LogicalDisk for removal drive give: ", str(e))
 
-        crud.update_removal_time(serial_number, timestamp(), logs)
+        crud.update_removal_time(serial_number, timestamp(), events, symbol, transfers, activity)
 
         connected_devices = current_devices
         disks = current_disks
         print("removed device is also removed from database")
-
-        # Uninitialize the COM environment
-        pythoncom.CoUninitialize()
     except Exception as e:
         print("Error:", e)
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     # Create a database session
     db: Session = get_db()
     create_db_and_tables()
-    hwnd = create_window()
-    win32gui.PumpMessages()
+    # Activity of drives that were connected when the program last stopped
+    recover_sessions()
+    # WM_DEVICECHANGE on Windows, uevents and mount table changes on Linux
+    devices = device_backend()
+    devices.subscribe(device_changed)
+    devices.wait()
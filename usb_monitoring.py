@@ -1,38 +1,16 @@
 import time
 
-import wmi
+from device_backends import device_backend
 
 # Constants
 REFRESH_INTERVAL = 1  # in seconds
 
 
 def get_existing_disk():
-    disks = {}
-    c = wmi.WMI()
-    for disk in c.Win32_LogicalDisk():
-        device_id = disk.DeviceID
-        volume_name = disk.VolumeName
-        free_space_gb = round(int(disk.FreeSpace) / (1024 ** 3), 2)
-        size_gb = round(int(disk.Size) / (1024 ** 3), 2)
-        used_space_gb = round(size_gb - free_space_gb, 2)
-
-        # Check if used space is less than 1 GB
-        if used_space_gb < 1:
-            used_space_mb = round((size_gb - free_space_gb) * 1024, 2)
-            used_space_str = f"{used_space_mb} MB"
-        else:
-            used_space_str = f"{used_space_gb} GB"
-
-        disk_info = {
-            "name": volume_name,
-            "free_space": f"{free_space_gb} GB",
-            "total_size": f"{size_gb} GB",
-            "used_space": used_space_str
-        }
-
-        disks[device_id] = disk_info
-
-    return disks
+    """
+    Retrieve the mounted volumes (drive letters, or mount points outside Windows) from the device backend.
+    """
+    return device_backend().existing_disks()
 
 
 def get_connected_devices():
@@ -43,24 +21,7 @@ def get_connected_devices():
         dict: A dictionary containing SerialNumber as keys and corresponding disk drive objects as values.
     """
     try:
-        connected_devices = {}
-        c = wmi.WMI()
-        for device in c.Win32_DiskDrive():
-            device_info = {
-                "SerialNumber": device.SerialNumber,
-                "Caption": device.Caption,
-                "InterfaceType": device.InterfaceType,
-                "MediaType": device.MediaType,
-                "Model": device.Model,
-                "Status": device.Status,
-                "Partitions": device.Partitions,
-                "CapabilityDescriptions": device.CapabilityDescriptions,
-                "Manufacturer": device.Manufacturer,
-                "FirmwareRevision": device.FirmwareRevision
-            }
-
-            connected_devices[device.SerialNumber] = device_info
-        return connected_devices
+        return device_backend().connected_devices()
     except Exception as e:
         # Log the error instead of printing directly
         print(f"Error retrieving connected devices: {e}")
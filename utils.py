@@ -17,6 +17,12 @@ def get_database_url():
     return url
 
 
+def get_database_folder():
+    """ Absolute folder of the sqlite database file, for files kept next to it. """
+    path = get_database_url()[len("sqlite:///"):]
+    return os.path.dirname(os.path.abspath(path))
+
+
 # def timestamp():
 #     # Get current time
 #     current_time = datetime.now()
@@ -51,42 +57,58 @@ def bytes_to_gb(bytes):
     return gb
 
 
-def print_tree(directory, tree, indent='', last=True):
-    # Add the current directory or file to the tree string
-    tree += indent
-    if last:
-        tree += '└── '
-        indent += '    '
-    else:
-        tree += '├── '
-        indent += '│   '
-    tree += os.path.basename(directory) + '\n'
-
-    # Iterate over the contents of the directory
-
-    contents = os.listdir(directory)
-    for i, item in enumerate(contents):
-        item_path = os.path.join(directory, item)
-        is_last = (i == len(contents) - 1)
-
-        # Check if the item is a directory
-        if os.path.isdir(item_path):
-            if "System Volume Information" in item_path:
-                continue
-            # If it's a directory, recursively add its contents to the tree string
-            tree = print_tree(item_path, tree, indent, is_last)
+SKIPPED_DIRECTORY = "System Volume Information"
+
+
+def _list_entries(directory):
+    # One directory read per folder; the DirEntry objects keep the d_type
+    # returned by the OS so is_dir() does not need another stat call.
+    with os.scandir(directory) as it:
+        return list(it)
+
+
+def write_tree(directory, write, indent='', last=True):
+    """
+    Stream the tree of ``directory`` line by line into ``write``.
+
+    The walk is iterative and built on ``os.scandir``; every rendered line is
+    handed to ``write`` (e.g. ``file.write``, ``io.StringIO().write`` or
+    ``list.append``) as soon as it is produced. The output is byte-identical
+    to what ``print_tree`` has always returned.
+    """
+    write(indent + ('└── ' if last else '├── ') + os.path.basename(directory) + '\n')
+
+    entries = _list_entries(directory)
+    stack = [(enumerate(entries), len(entries) - 1, indent + ('    ' if last else '│   '))]
+    while stack:
+        contents, last_index, indent = stack[-1]
+        for i, entry in contents:
+            is_last = (i == last_index)
+
+            if entry.is_dir():
+                if SKIPPED_DIRECTORY in entry.path:
+                    continue
+                write(indent + ('└── ' if is_last else '├── ') + entry.name + '\n')
+                children = _list_entries(entry.path)
+                stack.append((enumerate(children), len(children) - 1,
+                              indent + ('    ' if is_last else '│   ')))
+                break
+
+            write(indent + ('└── ' if is_last else '├── ') + entry.name + '\n')
         else:
-            # If it's a file, print its name
-            tree += indent
-            if is_last:
-                tree += '└── '
-            else:
-                tree += '├── '
-            tree += item + "\n"
-            # If it's a file, add its name to the tree string
-            # tree += indent + ('└── ' if is_last else '├── ') + item + '\n'
-
-    return tree
+            stack.pop()
+
+
+def print_tree(directory, tree, indent='', last=True):
+    """
+    Return ``tree`` followed by the rendered tree of ``directory``.
+
+    Kept for existing callers; the lines are produced by ``write_tree`` and
+    joined once at the end instead of being concatenated entry by entry.
+    """
+    lines = [tree]
+    write_tree(directory, lines.append, indent, last)
+    return ''.join(lines)
 
 
 # Example
@@ -0,0 +1,151 @@
+"""
+How hard the watcher is working, per monitored drive.
+
+Every USBEventHandler carries a ``DriveMetrics``: the observer thread counts
+the events it queues, and the stat worker, as it hands each event on, adds
+how long the event waited (queueing plus the size lookup) to a latency
+histogram and its arrival second to a rate window. Both are a few integer
+operations per event, without locks: each counter has a single writer.
+
+``USBEventHandler.snapshot`` puts these together with what the rest of the
+pipeline already counts (coalesced and logged events, what is waiting to be
+coalesced or flushed, bytes accounted) and ``log_watcher.watcher_snapshot``
+returns the snapshots of every monitored drive. ``MetricsDump`` prints them
+every ``METRICS_INTERVAL`` seconds and appends them to ``METRICS_FILE`` as
+JSON lines when one is set.
+"""
+import json
+import threading
+import time
+
+from file_events import format_size
+
+# Histogram buckets: bucket i holds latencies below 2**i microseconds (the last one everything above)
+LATENCY_BUCKETS = 26
+# Seconds the raw event rate is averaged over
+RATE_WINDOW = 10
+# Seconds between dumps of every drive's metrics, 0 for none
+METRICS_INTERVAL = 60.0
+# JSON lines file the dumps are appended to, None to only print them
+METRICS_FILE = None
+
+
+class LatencyHistogram:
+    """ Latencies counted in power-of-two microsecond buckets. """
+
+    __slots__ = ('counts', 'count', 'total', 'maximum')
+
+    def __init__(self):
+        self.counts = [0] * LATENCY_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, seconds):
+        index = int(seconds * 1_000_000).bit_length() if seconds > 0 else 0
+        self.counts[index if index < LATENCY_BUCKETS else LATENCY_BUCKETS - 1] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+
+    def percentile(self, share):
+        """ Upper bound in seconds of the bucket holding the ``share`` quantile. """
+        if not self.count:
+            return 0.0
+        rank = share * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min((1 << index) / 1_000_000, self.maximum)
+        return self.maximum
+
+    def summary(self):
+        return {'count': self.count,
+                'mean': self.total / self.count if self.count else 0.0,
+                'p50': self.percentile(0.5), 'p90': self.percentile(0.9), 'p99': self.percentile(0.99),
+                'max': self.maximum,
+                # upper bound in microseconds -> events, for the buckets in use
+                'buckets': {1 << index: count for index, count in enumerate(self.counts) if count}}
+
+
+class EventRate:
+    """ Events per second over the last RATE_WINDOW seconds, from per-second counts. """
+
+    __slots__ = ('counts', 'seconds')
+
+    def __init__(self):
+        self.counts = [0] * RATE_WINDOW
+        self.seconds = [0] * RATE_WINDOW
+
+    def add(self, timestamp):
+        second = int(timestamp)
+        slot = second % RATE_WINDOW
+        if self.seconds[slot] != second:
+            self.seconds[slot] = second
+            self.counts[slot] = 0
+        self.counts[slot] += 1
+
+    def rate(self, now=None):
+        current = int(time.time() if now is None else now)
+        return sum(count for count, second in zip(self.counts, self.seconds)
+                   if current - RATE_WINDOW < second <= current) / RATE_WINDOW
+
+
+class DriveMetrics:
+    """ The counters a USBEventHandler keeps about its own load. """
+
+    def __init__(self):
+        self.started = time.time()
+        self.queued = 0  # raw events the observer handed over (observer thread)
+        self.delivered = 0  # raw events passed on to the coalescer (stat worker)
+        self.latency = LatencyHistogram()
+        self.rate = EventRate()
+
+    def delivered_event(self, timestamp):
+        """ One raw event, seen by the observer at ``timestamp``, reached the coalescer. """
+        self.delivered += 1
+        self.latency.add(time.time() - timestamp)
+        self.rate.add(timestamp)
+
+
+def describe(drive, snapshot):
+    """ One line summing up a drive's snapshot. """
+    latency = snapshot['latency']
+    return (f"{drive}: {snapshot['raw_per_second']:.0f} raw events/s, {snapshot['raw_events']} raw -> "
+            f"{snapshot['coalesced_events']} coalesced, queue {snapshot['queue_depth']}, "
+            f"coalescing {snapshot['coalescing']}, unflushed {snapshot['unflushed']}, "
+            f"latency p50 {latency['p50'] * 1000:.3f} ms p99 {latency['p99'] * 1000:.3f} ms, "
+            f"{format_size(snapshot['bytes_added'])} added, {format_size(snapshot['bytes_removed'])} removed")
+
+
+class MetricsDump(threading.Thread):
+    """ Prints (and with ``path`` appends as JSON lines) the snapshots ``source()`` returns, every ``interval``. """
+
+    def __init__(self, source, interval=METRICS_INTERVAL, path=METRICS_FILE):
+        super().__init__(name='watcher-metrics', daemon=True)
+        self.source = source
+        self.interval = interval
+        self.path = path
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.dump()
+
+    def stop(self):
+        self.stopping.set()
+
+    def dump(self):
+        try:
+            snapshots = self.source()
+            now = time.time()
+            for drive, snapshot in snapshots.items():
+                print(describe(drive, snapshot))
+            if self.path and snapshots:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    for drive, snapshot in snapshots.items():
+                        f.write(json.dumps({'time': now, 'drive': drive, **snapshot}) + '\n')
+        except Exception as e:
+            print("MetricsDump give Error: ", str(e))